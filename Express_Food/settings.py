@@ -51,6 +51,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "backoffice.instrumentation.InstrumentationMiddleware",  # Mesures par requête (SQL, appels externes, sérialisation)
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",  # CorsMiddleware
@@ -63,6 +64,9 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = "Express_Food.urls"
 
+# Renvoie les mesures de chaque requête dans l'en-tête Server-Timing
+INSTRUMENTATION_SERVER_TIMING = DEBUG
+
 TEMPLATES = [
     {
         "BACKEND": "django.template.backends.django.DjangoTemplates",
@@ -82,14 +86,23 @@ TEMPLATES = [
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.BasicAuthentication',
-        'rest_framework.authentication.TokenAuthentication',
+        'backoffice.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    # Rendu chronométré (catégorie 'serialisation' de l'instrumentation)
+    'DEFAULT_RENDERER_CLASSES': [
+        'backoffice.instrumentation.JSONRendererMesure',
+        'backoffice.instrumentation.BrowsableAPIRendererMesure',
+    ],
+    'DEFAULT_PAGINATION_CLASS': 'backoffice.pagination.PaginationCurseur',
+    'PAGE_SIZE': 50,  # Taille de page par défaut, modifiable avec ?taille=
 }
 
+PAGINATION_TAILLE_MAX = 200
+
 # REST_FRAMEWORK = {
 #     'DEFAULT_AUTHENTICATION_CLASSES': [
 #         'rest_framework.authentication.BasicAuthentication',  # Authentification de base
@@ -155,7 +168,116 @@ USE_TZ = True
 
 STATIC_URL = "static/"
 
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# La table du cache de géocodage se crée avec "python manage.py createcachetable"
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "geocodage": {
+        "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+        "LOCATION": "backoffice_cache_geocodage",
+        "OPTIONS": {"MAX_ENTRIES": 100000},
+    },
+}
+
+# Catalogue produits en cache. Les représentations (CATALOGUE_CACHE_TTL) sont rangées sous le jeton de
+# version du catalogue, recalculé en base au bout de CATALOGUE_VERSION_TTL secondes. Une modification de
+# produit n'invalide le jeton que dans le cache CATALOGUE_CACHE_ALIAS du processus qui la fait : avec un
+# LocMemCache, comme "default" ici, les autres processus servent l'ancienne version pendant au plus
+# CATALOGUE_VERSION_TTL secondes. Avec un cache partagé (Redis, Memcached), ce délai disparaît.
+CATALOGUE_CACHE_ALIAS = "default"
+CATALOGUE_CACHE_TTL = 60
+CATALOGUE_VERSION_TTL = 5
+
+# Géocodage (api-adresse.data.gouv.fr)
+GEOCODAGE_CACHE_ALIAS = "geocodage"
+GEOCODAGE_CACHE_TAILLE = 1024  # Nombre d'adresses gardées en mémoire par processus
+GEOCODAGE_CACHE_TTL = 60 * 60 * 24 * 30  # Adresses trouvées : 30 jours
+GEOCODAGE_CACHE_TTL_NEGATIF = 60 * 60  # Adresses introuvables : 1 heure
+GEOCODAGE_CACHE_SECOURS = 60 * 60 * 24 * 30  # Réponses expirées gardées pour répondre pendant une panne de l'API
+GEOCODAGE_POOL_TAILLE = 10  # Connexions HTTP gardées ouvertes vers l'API
+GEOCODAGE_DELAI_CONNEXION = 1.0  # Secondes
+GEOCODAGE_DELAI_LECTURE = 2.0  # Secondes
+GEOCODAGE_DISJONCTEUR_SEUIL = 5  # Échecs consécutifs avant d'arrêter d'appeler l'API
+GEOCODAGE_DISJONCTEUR_DELAI = 30  # Secondes avant un nouvel appel d'essai
+GEOCODAGE_NOUVEAUX_ESSAIS_MAX = 1  # Nouveaux essais par recherche après une erreur
+GEOCODAGE_ATTENTE_NOUVEL_ESSAI = 0.1  # Secondes (au plus) avant le nouvel essai, tirées au hasard
+GEOCODAGE_BUDGET_NOUVEAUX_ESSAIS = 0.1  # Nouveaux essais autorisés : 10 % des appels du processus au plus
+# Index local d'un extrait de la Base Adresse Nationale (commande indexer_adresses), consulté avant l'API
+GEOCODAGE_INDEX_FICHIER = os.getenv('GEOCODAGE_INDEX_FICHIER')
+GEOCODAGE_INDEX_SCORE_MINIMUM = 0.5  # Similarité minimale (trigrammes) entre la saisie et une voie connue
+GEOCODAGE_INDEX_SEUL = False  # True : une adresse absente de l'index est introuvable, sans appel à l'API
+
+# Cache de l'authentification par token (token -> utilisateur), à deux niveaux : mémoire du processus
+# (AUTH_TOKEN_CACHE_TTL_LOCAL) puis cache AUTH_TOKEN_CACHE_ALIAS (AUTH_TOKEN_CACHE_TTL). Ce second niveau
+# n'est utilisé que s'il est partagé entre processus (Redis, Memcached) : avec un LocMemCache, comme
+# "default" ici, il est ignoré. Un token révoqué est refusé partout au bout de AUTH_TOKEN_CACHE_TTL_LOCAL secondes.
+AUTH_TOKEN_CACHE_ALIAS = "default"
+AUTH_TOKEN_CACHE_TAILLE = 4096  # Nombre de tokens gardés en mémoire par processus
+AUTH_TOKEN_CACHE_TTL = 300  # Secondes, dans le cache partagé
+AUTH_TOKEN_CACHE_TTL_LOCAL = 30
+
+# Flux d'événements des commandes (Server-Sent Events)
+# Sans URL Redis, les événements ne sont diffusés qu'aux abonnés du même processus
+EVENEMENTS_REDIS_URL = os.getenv('EVENEMENTS_REDIS_URL')
+EVENEMENTS_KEEPALIVE = 15  # Secondes entre deux commentaires de maintien de la connexion
+
+# Positions des livreurs : gardées en mémoire et écrites en base par lots
+POSITIONS_INTERVALLE_ECRITURE = 5  # Secondes entre deux écritures (0 : écriture manuelle uniquement)
+POSITIONS_TAILLE_LOT = 1000  # Au-delà, les positions en attente sont écrites immédiatement
+POSITIONS_CACHE_TAILLE = 10000  # Livreurs dont le profil est gardé en mémoire par processus
+# Index en mémoire des livreurs disponibles, propre à chaque processus : relu en base à cet intervalle
+# (secondes) pour prendre en compte les réservations et positions enregistrées par les autres processus
+INDEX_LIVREURS_TTL = 30
+
+# Estimation de l'heure de livraison
+# 'vol_oiseau' : distance directe × facteur de détour à vitesse constante
+# 'grille' : temps de parcours précalculés sur le réseau routier (commande construire_grille_eta)
+ETA_MOTEUR = os.getenv('ETA_MOTEUR', 'vol_oiseau')
+ETA_GRILLE_FICHIER = os.getenv('ETA_GRILLE_FICHIER')  # Fichier JSON produit par construire_grille_eta
+ETA_GRILLE_TOLERANCE_KM = 0.5  # Distance maximale au point d'origine de la grille
+ETA_VITESSE_KMH = 50
+ETA_FACTEUR_DETOUR = 1.3  # Rapport moyen entre distance routière et distance directe en ville
+ETA_FUSEAU = "Europe/Paris"
+# Coefficient de durée par heure locale de départ (heures de pointe plus lentes)
+ETA_PROFIL_HORAIRE = [
+    1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.1, 1.3, 1.5, 1.3, 1.1, 1.1,
+    1.2, 1.2, 1.1, 1.1, 1.2, 1.4, 1.5, 1.3, 1.1, 1.0, 1.0, 1.0,
+]
+
+# Variantes des images produits, générées en tâche de fond (file 'images') à l'envoi d'une image
+PRODUIT_IMAGE_LARGEURS = [160, 320, 640, 1024]
+PRODUIT_IMAGE_FORMATS = ['avif', 'webp', 'jpeg']  # AVIF ignoré si le Pillow installé ne le prend pas en charge
+
+# File de tâches de fond enregistrée en base, exécutée par la commande travailleur_taches
+TACHES_EXECUTION_IMMEDIATE = False  # True : tâches exécutées par le processus qui les enfile, après la transaction
+TACHES_TENTATIVES = 5  # Essais avant abandon d'une tâche
+TACHES_DELAI_INITIAL = 5  # Secondes avant le deuxième essai, doublées à chaque échec
+TACHES_DELAI_MAX = 3600
+TACHES_DELAI_BLOCAGE = 600  # Une tâche en cours depuis plus longtemps est reprise (travailleur arrêté)
+TACHES_CONSERVATION_JOURS = 7  # Les tâches terminées sont ensuite supprimées
+# Tâches exécutées simultanément par file, tous travailleurs confondus. Les événements Stripe réservés
+# ensemble sont appliqués en une transaction : la limite 'stripe' borne aussi la taille de ces lots
+TACHES_CONCURRENCE = {'images': 2, 'geocodage': 2, 'stripe': 50}
+
+# Adresse du restaurant, point de départ des livraisons
+RESTAURANT_ADRESSE = "14 Avenue de l'Europe 77144 Montévrain"
+RESTAURANT_LATITUDE = 48.8733
+RESTAURANT_LONGITUDE = 2.7488
+
 STRIPE_SECRET_KEY = 'sk_test_51MFEQcEZ0N5FcY9bSn2ZvngxqzpearInM7PjuDeuBGMmR7QVQByRCwqkEc0SDo2xPmc9Gao1OdyOl9bvAucGWHxF00eD8IwFau'
+# Secret de signature du webhook Stripe : lorsqu'il est défini, les paiements sont confirmés par le webhook
+# et verify_payment ne fait plus d'appel à Stripe. Les événements reçus sont appliqués par la file de tâches
+# 'stripe' : un travailleur (manage.py travailleur_taches) doit tourner, sinon aucun paiement n'est confirmé.
+STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET')
+# Au-delà (secondes), des événements non traités signalent un travailleur arrêté : verify_payment interroge
+# alors Stripe directement
+STRIPE_WEBHOOK_DELAI_TRAVAILLEUR = 120
+STRIPE_API_BASE = None  # Adresse de l'API Stripe à utiliser à la place de https://api.stripe.com (tests)
+STRIPE_TIMEOUT = 10  # Délai maximum (secondes) des appels asynchrones à Stripe
 
 
 # Default primary key field type
@@ -182,6 +304,11 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 # Configurations pour les médias
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Envoi des fichiers médias délégué au serveur frontal : None, 'x-sendfile' ou 'x-accel-redirect' (nginx,
+# avec un emplacement "internal" MEDIA_ACCEL_PREFIX pointant sur MEDIA_ROOT)
+MEDIA_SENDFILE = os.getenv('MEDIA_SENDFILE') or None
+MEDIA_ACCEL_PREFIX = '/media-interne/'
+MEDIA_CACHE_MAX_AGE = 3600  # Fichiers sans empreinte dans leur nom (les autres sont immuables)
 
 
 CORS_ALLOW_HEADERS = [
@@ -0,0 +1,19 @@
+"""
+Réglages des commandes de mesure (mesurer_parcours_commande, analyser_requetes) : identiques aux réglages
+du projet, avec une base SQLite jetable à la place de la base MySQL.
+
+    python manage.py migrate --settings Express_Food.settings_mesures
+    python manage.py mesurer_parcours_commande --settings Express_Food.settings_mesures --produits 1000 ...
+"""
+import os
+
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR
+
+DATABASES = {
+    "default": {
+        "ENGINE": "django.db.backends.sqlite3",
+        # Fichier de la base jetable, à supprimer entre deux campagnes de mesure
+        "NAME": os.getenv("MESURES_SQLITE", os.path.join(BASE_DIR, "mesures.sqlite3")),
+    }
+}
@@ -15,13 +15,13 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
-from django.conf.urls.static import static
+from django.urls import path, include, re_path
 from django.conf import settings
 from rest_framework.routers import DefaultRouter
 from rest_framework.authtoken import views as auth_views
 from backoffice import views
 from backoffice.views import create_payment_intent
+from backoffice.medias import servir_media
 
 router = DefaultRouter()
 
@@ -42,4 +42,5 @@ urlpatterns = [
     path('connexion/', auth_views.obtain_auth_token),
     path('', include(router.urls)),
     # path('back/', views.back, name='back'),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    re_path(rf'^{settings.MEDIA_URL.lstrip("/")}(?P<chemin>.+)$', servir_media, name='media'),
+]
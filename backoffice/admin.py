@@ -1,9 +1,11 @@
 from django.contrib import admin
-from .models import Client, Commande, CommandeProduit, Produit, Livreur, Paiement
+from .models import Client, Commande, CommandeProduit, Produit, Livreur, Paiement, EvenementStripe, Tache
 
 admin.site.register(Client)
 admin.site.register(Commande)
 admin.site.register(CommandeProduit)
 admin.site.register(Produit)
 admin.site.register(Livreur)
-admin.site.register(Paiement)
\ No newline at end of file
+admin.site.register(Paiement)
+admin.site.register(EvenementStripe)
+admin.site.register(Tache)
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class BackofficeConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "backoffice"
+
+    def ready(self):
+        # Enregistre les signaux qui maintiennent l'index des livreurs disponibles, le cache du catalogue,
+        # le cache des tokens d'authentification et les images produits, ainsi que les tâches de fond
+        from . import authentication, catalogue, geocodage, images, index_livreurs, webhooks  # noqa: F401
@@ -0,0 +1,96 @@
+import copy
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .cache_local import CacheLRU
+
+_cache_local = CacheLRU(getattr(settings, 'AUTH_TOKEN_CACHE_TAILLE', 4096))
+
+
+def _cle(key):
+    # Le token n'est jamais utilisé tel quel comme clé de cache
+    return 'auth:token:' + hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def _cache_partage():
+    """
+    Cache Django de AUTH_TOKEN_CACHE_ALIAS s'il est réellement partagé entre processus (Redis, Memcached,
+    base de données), sinon None : un cache propre au processus garderait un token révoqué dans les autres
+    processus pendant AUTH_TOKEN_CACHE_TTL, sans apporter plus que le cache local.
+    """
+    cache = caches[getattr(settings, 'AUTH_TOKEN_CACHE_ALIAS', 'default')]
+    if isinstance(cache, (LocMemCache, DummyCache)):
+        return None
+    return cache
+
+
+def invalider_token(key):
+    """Retire un token des caches (local et partagé) : il sera relu en base à la prochaine requête."""
+    cle = _cle(key)
+    _cache_local.delete(cle)
+    cache = _cache_partage()
+    if cache is not None:
+        cache.delete(cle)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Authentification par token (en-tête `Authorization: Token <clé>`) dont la résolution token → utilisateur
+    est gardée en cache : d'abord en mémoire du processus, puis dans le cache Django partagé s'il y en a un.
+    Un token supprimé, ou l'utilisateur modifié (désactivation...), est retiré des caches ; les autres
+    processus le voient au plus tard après AUTH_TOKEN_CACHE_TTL_LOCAL secondes.
+    """
+
+    def authenticate_credentials(self, key):
+        cle = _cle(key)
+        user = _cache_local.get(cle)
+        if user is None:
+            cache = _cache_partage()
+            user = cache.get(cle) if cache is not None else None
+            if user is None:
+                try:
+                    user = get_user_model().objects.get(auth_token__key=key)
+                except get_user_model().DoesNotExist:
+                    raise exceptions.AuthenticationFailed(_('Invalid token.'))
+                if cache is not None:
+                    cache.set(cle, user, getattr(settings, 'AUTH_TOKEN_CACHE_TTL', 300))
+            _cache_local.set(cle, user, getattr(settings, 'AUTH_TOKEN_CACHE_TTL_LOCAL', 30))
+
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+        # Copie propre à la requête : les profils chargés (user.client...) ne sont pas partagés entre requêtes
+        user = copy.copy(user)
+        return (user, Token(key=key, user=user))
+
+
+def authentifier(request):
+    """Authentifie une requête Django hors des vues DRF, avec les mêmes classes que l'API (token, session...)."""
+    drf_request = Request(request, authenticators=[classe() for classe in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    return drf_request.user
+
+
+@receiver(post_delete, sender=Token)
+def invalider_token_supprime(sender, instance, **kwargs):
+    invalider_token(instance.key)
+
+
+@receiver(post_save, sender=get_user_model())
+def invalider_tokens_utilisateur(sender, instance, created, **kwargs):
+    if created or kwargs.get('update_fields') == frozenset({'last_login'}):
+        return
+    for key in Token.objects.filter(user=instance).values_list('key', flat=True):
+        invalider_token(key)
@@ -0,0 +1,39 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class CacheLRU:
+    """Petit cache LRU en mémoire avec une durée de vie par entrée."""
+
+    def __init__(self, taille_max=1024):
+        self.taille_max = taille_max
+        self._entrees = OrderedDict()
+        self._verrou = threading.Lock()
+
+    def get(self, cle):
+        with self._verrou:
+            entree = self._entrees.get(cle)
+            if entree is None:
+                return None
+            expiration, valeur = entree
+            if expiration < time.monotonic():
+                del self._entrees[cle]
+                return None
+            self._entrees.move_to_end(cle)
+            return valeur
+
+    def set(self, cle, valeur, ttl):
+        with self._verrou:
+            self._entrees[cle] = (time.monotonic() + ttl, valeur)
+            self._entrees.move_to_end(cle)
+            while len(self._entrees) > self.taille_max:
+                self._entrees.popitem(last=False)
+
+    def delete(self, cle):
+        with self._verrou:
+            self._entrees.pop(cle, None)
+
+    def clear(self):
+        with self._verrou:
+            self._entrees.clear()
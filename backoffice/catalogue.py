@@ -0,0 +1,69 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Count, Max
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils.cache import get_conditional_response
+
+from .models import Produit
+
+CLE_VERSION = 'catalogue:version'
+
+
+def _cache():
+    return caches[getattr(settings, 'CATALOGUE_CACHE_ALIAS', 'default')]
+
+
+def version_catalogue():
+    """
+    Renvoie le jeton de version du catalogue, calculé à partir de la base (date de dernière modification
+    et nombre de produits). Une modification n'invalide que le cache du processus qui la fait : avec un
+    cache local (LocMemCache), les autres processus gardent l'ancien jeton au plus CATALOGUE_VERSION_TTL
+    secondes ; avec un cache partagé (CATALOGUE_CACHE_ALIAS), tous voient la nouvelle version aussitôt.
+    """
+    jeton = _cache().get(CLE_VERSION)
+    if jeton is None:
+        resume = Produit.objects.aggregate(derniere_modification=Max('date_modification'), nombre=Count('id'))
+        derniere_modification = resume['derniere_modification']
+        jeton = f"{derniere_modification.isoformat() if derniere_modification else ''}|{resume['nombre']}"
+        _cache().set(CLE_VERSION, jeton, getattr(settings, 'CATALOGUE_VERSION_TTL', 5))
+    return jeton
+
+
+def invalider_catalogue():
+    _cache().delete(CLE_VERSION)
+
+
+def reponse_catalogue(request, calculer, response_class):
+    """
+    Sert une représentation du catalogue depuis le cache, avec un ETag.
+    `calculer` n'est appelé (et la base interrogée) que si la représentation n'est pas déjà en cache ;
+    un client qui possède déjà la bonne version reçoit un 304 sans corps.
+    Pas de Last-Modified : la suppression d'un produit ne change pas la date de dernière modification et
+    un If-Modified-Since renverrait un 304 périmé ; le nombre de produits, lui, est compris dans l'ETag.
+    """
+    jeton = version_catalogue()
+    empreinte = hashlib.sha1(f"{jeton}|{request.build_absolute_uri()}|{request.accepted_renderer.format}".encode('utf-8')).hexdigest()
+    etag = f'"{empreinte}"'
+
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        cle = f'catalogue:{empreinte}'
+        donnees = _cache().get(cle)
+        if donnees is None:
+            donnees = calculer()
+            _cache().set(cle, donnees, getattr(settings, 'CATALOGUE_CACHE_TTL', 60))
+        response = response_class(donnees)
+
+    response['ETag'] = etag
+    # Le client garde la réponse mais doit la revalider (réponse 304 si rien n'a changé)
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+@receiver(post_save, sender=Produit)
+@receiver(post_delete, sender=Produit)
+def invalider_catalogue_produit(sender, **kwargs):
+    invalider_catalogue()
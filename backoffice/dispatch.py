@@ -0,0 +1,96 @@
+import time
+
+import numpy as np
+from django.conf import settings
+from django.utils.timezone import now
+
+from .eta import heure_locale, moteur_eta
+from .models import Commande, Livreur
+
+STATUTS_ACTIFS = ['en_cours', 'prise_en_charge', 'en_cours_de_livraison']
+
+
+def _positions(couples):
+    """Tableau n × 2 de (latitude, longitude), NaN pour une position inconnue."""
+    return np.array([(np.nan, np.nan) if None in couple else couple for couple in couples], dtype=float).reshape(-1, 2)
+
+
+def _affecter(secondes, a_affecter):
+    """
+    Affectation gloutonne livreurs × commandes : dans l'ordre des colonnes, chaque commande à affecter prend
+    le livreur restant le plus rapide, qui est ensuite retiré. Renvoie l'indice du livreur (ou None) par commande.
+    """
+    restantes = secondes.copy()
+    meilleurs = [None] * secondes.shape[1]
+    for j in np.flatnonzero(a_affecter):
+        if not restantes.shape[0]:
+            break
+        i = int(np.argmin(restantes[:, j]))
+        if not np.isfinite(restantes[i, j]):
+            continue
+        meilleurs[j] = i
+        restantes[i, :] = np.inf
+    return meilleurs
+
+
+def tableau_dispatch():
+    """
+    Pour chaque commande active, heure d'arrivée estimée chez le client avec le livreur de la commande et
+    avec le meilleur livreur disponible. Deux requêtes SQL, puis un calcul matriciel livreurs × commandes.
+    Chaque livreur disponible n'est proposé que pour une commande : les commandes les plus anciennes
+    choisissent d'abord.
+    """
+    debut = time.perf_counter()
+    commandes = list(Commande.objects
+                     .filter(statut__in=STATUTS_ACTIFS)
+                     .order_by('date_commande')
+                     .values_list('id', 'statut', 'client_id', 'livreur_id', 'client__latitude', 'client__longitude',
+                                  'livreur__latitude', 'livreur__longitude'))
+    livreurs = list(Livreur.objects
+                    .filter(statut='disponible', latitude__isnull=False, longitude__isnull=False)
+                    .values_list('id', 'latitude', 'longitude'))
+
+    moteur = moteur_eta()
+    depart = now()
+    restaurant = [(settings.RESTAURANT_LATITUDE, settings.RESTAURANT_LONGITUDE)]
+    clients = _positions([commande[4:6] for commande in commandes])
+    assignes = _positions([commande[6:8] for commande in commandes])
+    disponibles = _positions([livreur[1:] for livreur in livreurs])
+    en_route = np.array([commande[1] == 'en_cours_de_livraison' for commande in commandes], dtype=bool)
+
+    # Trajet restaurant → client, précédé du trajet livreur → restaurant si le repas n'est pas encore récupéré
+    livraison = moteur.matrice_secondes(restaurant, clients, depart)[0]
+    direct = moteur.paires_secondes(assignes, clients, depart)
+    eta_assignes = np.where(en_route, direct, moteur.matrice_secondes(assignes, restaurant, depart)[:, 0] + livraison)
+    # Matrice livreurs disponibles × commandes
+    eta_disponibles = moteur.matrice_secondes(disponibles, restaurant, depart) + livraison[None, :]
+    eta_disponibles = np.where(np.isnan(eta_disponibles), np.inf, eta_disponibles)
+    meilleurs = _affecter(eta_disponibles, ~en_route)
+
+    def arrivee(secondes):
+        return heure_locale(depart, secondes) if np.isfinite(secondes) else None
+
+    def minutes(secondes):
+        return round(float(secondes) / 60, 1) if np.isfinite(secondes) else None
+
+    resultats = []
+    for j, (commande_id, statut, client_id, livreur_id, *_) in enumerate(commandes):
+        meilleur = meilleurs[j]
+        secondes_meilleur = eta_disponibles[meilleur, j] if meilleur is not None else np.nan
+        resultats.append({
+            'id': commande_id,
+            'statut': statut,
+            'client': client_id,
+            'livreur': livreur_id,
+            'minutes_livreur': minutes(eta_assignes[j]),
+            'arrivee_livreur': arrivee(eta_assignes[j]),
+            'meilleur_livreur': livreurs[meilleur][0] if meilleur is not None else None,
+            'minutes_meilleur_livreur': minutes(secondes_meilleur),
+            'arrivee_meilleur_livreur': arrivee(secondes_meilleur),
+        })
+
+    return {
+        'commandes': resultats,
+        'livreurs_disponibles': len(livreurs),
+        'calcul_ms': round((time.perf_counter() - debut) * 1000, 2),
+    }
@@ -0,0 +1,172 @@
+import abc
+import json
+import math
+from datetime import timedelta
+from zoneinfo import ZoneInfo
+
+import numpy as np
+from django.conf import settings
+from django.utils.timezone import now
+
+from .index_livreurs import KM_PAR_DEGRE_LATITUDE, KM_PAR_DEGRE_LONGITUDE, distance_approx_km
+
+
+def distances_km(lat1, lon1, lat2, lon2):
+    """Version vectorisée (tableaux NumPy, avec diffusion) de distance_approx_km."""
+    dx = (lon2 - lon1) * KM_PAR_DEGRE_LONGITUDE * np.cos(np.radians((lat1 + lat2) / 2))
+    dy = (lat2 - lat1) * KM_PAR_DEGRE_LATITUDE
+    return np.hypot(dx, dy)
+
+
+def _fuseau():
+    return ZoneInfo(getattr(settings, 'ETA_FUSEAU', 'Europe/Paris'))
+
+
+def heure_locale(depart, secondes):
+    """Heure locale (à la seconde) atteinte `secondes` après `depart`."""
+    return (depart + timedelta(seconds=float(secondes))).astimezone(_fuseau()).time().replace(microsecond=0)
+
+
+class MoteurETA(abc.ABC):
+    """Estime la durée d'un trajet ; les moteurs concrets implémentent `secondes_hors_trafic`."""
+
+    def __init__(self, profil_horaire=None):
+        # Coefficient appliqué à la durée selon l'heure locale de départ (24 valeurs, 1.0 = trafic fluide)
+        self.profil_horaire = profil_horaire or getattr(settings, 'ETA_PROFIL_HORAIRE', None) or [1.0] * 24
+
+    @abc.abstractmethod
+    def secondes_hors_trafic(self, lat1, lon1, lat2, lon2):
+        """Durée du trajet en secondes, hors trafic."""
+
+    def secondes_vectorisees(self, lat1, lon1, lat2, lon2):
+        """Comme secondes_hors_trafic, sur des tableaux NumPy de coordonnées (avec diffusion)."""
+        return np.vectorize(self.secondes_hors_trafic, otypes=[float])(lat1, lon1, lat2, lon2)
+
+    def coefficient(self, depart=None):
+        return self.profil_horaire[(depart or now()).astimezone(_fuseau()).hour]
+
+    def matrice_secondes(self, origines, destinations, depart=None):
+        """
+        Durées (en secondes, trafic compris) de chaque origine vers chaque destination, en un seul calcul :
+        `origines` (n × 2) et `destinations` (m × 2) sont des listes de (latitude, longitude) ; renvoie n × m.
+        """
+        origines = np.asarray(origines, dtype=float).reshape(-1, 2)
+        destinations = np.asarray(destinations, dtype=float).reshape(-1, 2)
+        secondes = self.secondes_vectorisees(origines[:, 0:1], origines[:, 1:2], destinations[:, 0], destinations[:, 1])
+        return secondes * self.coefficient(depart)
+
+    def paires_secondes(self, origines, destinations, depart=None):
+        """Durées (en secondes, trafic compris) de chaque origine vers la destination de même rang."""
+        origines = np.asarray(origines, dtype=float).reshape(-1, 2)
+        destinations = np.asarray(destinations, dtype=float).reshape(-1, 2)
+        secondes = self.secondes_vectorisees(origines[:, 0], origines[:, 1], destinations[:, 0], destinations[:, 1])
+        return secondes * self.coefficient(depart)
+
+    def duree(self, lat1, lon1, lat2, lon2, depart=None):
+        depart = (depart or now()).astimezone(_fuseau())
+        secondes = self.secondes_hors_trafic(lat1, lon1, lat2, lon2) * self.profil_horaire[depart.hour]
+        return timedelta(seconds=secondes)
+
+    def heure_arrivee(self, lat1, lon1, lat2, lon2, depart=None):
+        """Heure locale d'arrivée estimée (à la seconde) pour un départ maintenant ou à `depart`."""
+        depart = depart or now()
+        return heure_locale(depart, self.duree(lat1, lon1, lat2, lon2, depart).total_seconds())
+
+
+class MoteurVolOiseau(MoteurETA):
+    """Distance à vol d'oiseau, allongée d'un facteur de détour, parcourue à vitesse constante."""
+
+    def __init__(self, vitesse_kmh=None, facteur_detour=None, profil_horaire=None):
+        super().__init__(profil_horaire)
+        self.vitesse_kmh = vitesse_kmh or getattr(settings, 'ETA_VITESSE_KMH', 50)
+        self.facteur_detour = facteur_detour or getattr(settings, 'ETA_FACTEUR_DETOUR', 1.3)
+
+    def secondes_hors_trafic(self, lat1, lon1, lat2, lon2):
+        distance = distance_approx_km(lat1, lon1, lat2, lon2) * self.facteur_detour
+        return distance / self.vitesse_kmh * 3600
+
+    def secondes_vectorisees(self, lat1, lon1, lat2, lon2):
+        return distances_km(lat1, lon1, lat2, lon2) * (self.facteur_detour / self.vitesse_kmh * 3600)
+
+
+class MoteurGrille(MoteurETA):
+    """
+    Temps de parcours précalculés sur le réseau routier, depuis une origine (le restaurant) vers chaque
+    point d'une grille régulière (voir la commande construire_grille_eta). Une requête est une
+    interpolation bilinéaire entre les quatre points voisins. Les trajets qui ne partent pas de
+    l'origine, ou qui sortent de la grille, sont estimés par le moteur de secours.
+    """
+
+    def __init__(self, chemin, secours=None, tolerance_km=None):
+        with open(chemin, encoding='utf-8') as fichier:
+            table = json.load(fichier)
+        super().__init__(table.get('profil_horaire'))
+        self.origine = tuple(table['origine'])
+        self.lat_min, self.lon_min, self.pas = table['lat_min'], table['lon_min'], table['pas']
+        self.lignes, self.colonnes = table['lignes'], table['colonnes']
+        self.durees = table['durees']
+        # Même table en tableau NumPy (NaN : point inaccessible) pour les calculs vectorisés
+        self._durees = np.array([np.nan if valeur is None else valeur for valeur in self.durees]).reshape(
+            self.lignes, self.colonnes)
+        self.secours = secours or MoteurVolOiseau()
+        self.tolerance_km = tolerance_km if tolerance_km is not None else getattr(settings, 'ETA_GRILLE_TOLERANCE_KM', 0.5)
+
+    def _interpoler(self, latitude, longitude):
+        x = (latitude - self.lat_min) / self.pas
+        y = (longitude - self.lon_min) / self.pas
+        i, j = math.floor(x), math.floor(y)
+        if not (0 <= i < self.lignes - 1 and 0 <= j < self.colonnes - 1):
+            return None
+        dx, dy = x - i, y - j
+        total = poids_total = 0.0
+        for di, dj, poids in ((0, 0, (1 - dx) * (1 - dy)), (1, 0, dx * (1 - dy)), (0, 1, (1 - dx) * dy), (1, 1, dx * dy)):
+            valeur = self.durees[(i + di) * self.colonnes + j + dj]
+            if valeur is not None:
+                total += valeur * poids
+                poids_total += poids
+        # Points voisins inaccessibles ignorés ; aucun accessible : pas d'estimation
+        return total / poids_total if poids_total else None
+
+    def secondes_hors_trafic(self, lat1, lon1, lat2, lon2):
+        if distance_approx_km(lat1, lon1, *self.origine) <= self.tolerance_km:
+            secondes = self._interpoler(lat2, lon2)
+            if secondes is not None:
+                return secondes
+        return self.secours.secondes_hors_trafic(lat1, lon1, lat2, lon2)
+
+    def _interpoler_vectorise(self, latitude, longitude):
+        x = (latitude - self.lat_min) / self.pas
+        y = (longitude - self.lon_min) / self.pas
+        dans_grille = (x >= 0) & (x < self.lignes - 1) & (y >= 0) & (y < self.colonnes - 1)
+        i = np.clip(np.floor(x).astype(int), 0, self.lignes - 2)
+        j = np.clip(np.floor(y).astype(int), 0, self.colonnes - 2)
+        dx, dy = x - i, y - j
+        total = np.zeros(np.shape(x))
+        poids_total = np.zeros(np.shape(x))
+        for di, dj, poids in ((0, 0, (1 - dx) * (1 - dy)), (1, 0, dx * (1 - dy)), (0, 1, (1 - dx) * dy), (1, 1, dx * dy)):
+            valeurs = self._durees[i + di, j + dj]
+            accessibles = ~np.isnan(valeurs)
+            total += np.where(accessibles, valeurs, 0) * poids
+            poids_total += np.where(accessibles, poids, 0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(dans_grille & (poids_total > 0), total / poids_total, np.nan)
+
+    def secondes_vectorisees(self, lat1, lon1, lat2, lon2):
+        lat1, lon1, lat2, lon2 = np.broadcast_arrays(*(np.asarray(valeur, dtype=float) for valeur in (lat1, lon1, lat2, lon2)))
+        depuis_origine = distances_km(lat1, lon1, *self.origine) <= self.tolerance_km
+        secondes = np.where(depuis_origine, self._interpoler_vectorise(lat2, lon2), np.nan)
+        return np.where(np.isnan(secondes), self.secours.secondes_vectorisees(lat1, lon1, lat2, lon2), secondes)
+
+
+_moteur = None
+
+
+def moteur_eta():
+    """Moteur choisi par ETA_MOTEUR ('vol_oiseau' ou 'grille', avec ETA_GRILLE_FICHIER), chargé une fois par processus."""
+    global _moteur
+    if _moteur is None:
+        if getattr(settings, 'ETA_MOTEUR', 'vol_oiseau') == 'grille':
+            _moteur = MoteurGrille(settings.ETA_GRILLE_FICHIER)
+        else:
+            _moteur = MoteurVolOiseau()
+    return _moteur
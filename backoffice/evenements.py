@@ -0,0 +1,204 @@
+import asyncio
+import json
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+from rest_framework.exceptions import APIException
+
+from .authentication import authentifier
+from .models import Commande
+
+try:
+    import redis
+    import redis.asyncio
+except ImportError:  # Le broker Redis est optionnel
+    redis = None
+
+STATUTS_FINAUX = ('livree',)
+
+
+class AbonnementMemoire:
+    def __init__(self, broker, canal):
+        self._broker = broker
+        self._canal = canal
+        self._boucle = asyncio.get_running_loop()
+        self._file = asyncio.Queue()
+
+    def recevoir(self, message):
+        # Appelé depuis n'importe quel thread : le message est remis à la boucle de l'abonné
+        try:
+            self._boucle.call_soon_threadsafe(self._file.put_nowait, message)
+        except RuntimeError:  # Boucle déjà fermée
+            pass
+
+    async def suivant(self, delai):
+        """Renvoie le prochain message, ou None si aucun n'arrive dans le délai."""
+        try:
+            return await asyncio.wait_for(self._file.get(), delai)
+        except asyncio.TimeoutError:
+            return None
+
+    async def fermer(self):
+        self._broker._retirer(self._canal, self)
+
+
+class BrokerMemoire:
+    """Diffusion en mémoire : ne relie que les abonnés du même processus (développement, serveur unique)."""
+
+    def __init__(self):
+        self._abonnes = {}
+        self._verrou = threading.Lock()
+
+    def publier(self, canal, message):
+        with self._verrou:
+            abonnes = list(self._abonnes.get(canal, ()))
+        for abonnement in abonnes:
+            abonnement.recevoir(message)
+
+    async def abonner(self, canal):
+        abonnement = AbonnementMemoire(self, canal)
+        with self._verrou:
+            self._abonnes.setdefault(canal, set()).add(abonnement)
+        return abonnement
+
+    def _retirer(self, canal, abonnement):
+        with self._verrou:
+            abonnes = self._abonnes.get(canal)
+            if abonnes:
+                abonnes.discard(abonnement)
+                if not abonnes:
+                    del self._abonnes[canal]
+
+
+class AbonnementRedis:
+    def __init__(self, client, pubsub):
+        self._client = client
+        self._pubsub = pubsub
+
+    async def suivant(self, delai):
+        message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=delai)
+        return json.loads(message['data']) if message else None
+
+    async def fermer(self):
+        await self._pubsub.aclose()
+        await self._client.aclose()
+
+
+class BrokerRedis:
+    """Diffusion par Redis (pub/sub) : relie tous les processus et serveurs de l'application."""
+
+    def __init__(self, url):
+        if redis is None:
+            raise ImproperlyConfigured("Le paquet 'redis' est requis pour utiliser EVENEMENTS_REDIS_URL.")
+        self.url = url
+        self._client = redis.Redis.from_url(url)
+
+    def publier(self, canal, message):
+        self._client.publish(canal, json.dumps(message, cls=DjangoJSONEncoder))
+
+    async def abonner(self, canal):
+        client = redis.asyncio.Redis.from_url(self.url)
+        pubsub = client.pubsub()
+        await pubsub.subscribe(canal)
+        return AbonnementRedis(client, pubsub)
+
+
+_broker = None
+
+
+def broker():
+    global _broker
+    if _broker is None:
+        url = getattr(settings, 'EVENEMENTS_REDIS_URL', None)
+        _broker = BrokerRedis(url) if url else BrokerMemoire()
+    return _broker
+
+
+def canal_commande(commande_id):
+    return f'commande:{commande_id}'
+
+
+def etat_commande(commande):
+    return {
+        'id': commande.pk,
+        'statut': commande.statut,
+        'temps_estime_livraison': commande.temps_estime_livraison,
+    }
+
+
+def publier_commande(commande):
+    """Annonce le nouvel état de la commande à ses abonnés, une fois la transaction validée."""
+    message = json.loads(json.dumps(etat_commande(commande), cls=DjangoJSONEncoder))
+    transaction.on_commit(lambda: broker().publier(canal_commande(commande.pk), message))
+
+
+def publier_commandes(ids):
+    """Comme publier_commande, pour des commandes modifiées par une mise à jour groupée."""
+    for commande in Commande.objects.filter(pk__in=ids).only('id', 'statut', 'temps_estime_livraison'):
+        publier_commande(commande)
+
+
+def _message_sse(donnees):
+    return f"event: commande\ndata: {json.dumps(donnees, cls=DjangoJSONEncoder)}\n\n"
+
+
+@require_GET
+async def flux_commande(request, pk):
+    """
+    Flux Server-Sent Events des changements de statut d'une commande, pour son client, son livreur
+    ou un administrateur. Le navigateur (EventSource) ne pouvant pas envoyer d'en-tête, le token
+    peut être passé en paramètre : /api/commandes/<id>/evenements/?token=<clé>.
+    Nécessite un serveur ASGI : sous WSGI, chaque flux occuperait un worker jusqu'à la livraison, la vue
+    répond donc 501 et le client se rabat sur l'interrogation périodique de /commandes/<id>/.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'detail': "Flux d'événements disponible uniquement sous ASGI.",
+                             'suivi': f'/commandes/{pk}/'}, status=501)
+    if 'token' in request.GET and 'HTTP_AUTHORIZATION' not in request.META:
+        request.META['HTTP_AUTHORIZATION'] = f"Token {request.GET['token']}"
+    try:
+        user = await sync_to_async(authentifier)(request)
+    except APIException as e:
+        return JsonResponse({'detail': str(e.detail)}, status=e.status_code)
+    if not user.is_authenticated:
+        return JsonResponse({'detail': "Informations d'authentification non fournies."}, status=401)
+
+    try:
+        commande = await Commande.objects.select_related('client', 'livreur').aget(pk=pk)
+    except Commande.DoesNotExist:
+        return JsonResponse({'detail': "Aucune commande ne correspond à l'identifiant fourni."}, status=404)
+    autorise = (user.is_staff or (commande.client and commande.client.user_id == user.pk)
+                or (commande.livreur and commande.livreur.user_id == user.pk))
+    if not autorise:
+        return JsonResponse({'error': "Permission denied."}, status=403)
+
+    # Abonnement avant l'envoi de l'état courant : aucun changement ne peut être manqué entre les deux
+    abonnement = await broker().abonner(canal_commande(commande.pk))
+    await commande.arefresh_from_db(fields=['statut', 'temps_estime_livraison'])
+
+    async def flux():
+        try:
+            etat = etat_commande(commande)
+            yield _message_sse(etat)
+            while etat['statut'] not in STATUTS_FINAUX:
+                message = await abonnement.suivant(getattr(settings, 'EVENEMENTS_KEEPALIVE', 15))
+                if message is None:
+                    # Commentaire SSE : garde la connexion ouverte à travers les proxys
+                    yield ": ping\n\n"
+                    continue
+                etat = message
+                yield _message_sse(etat)
+        finally:
+            await abonnement.fermer()
+
+    response = StreamingHttpResponse(flux(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Pas de mise en tampon par nginx
+    return response
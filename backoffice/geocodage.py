@@ -0,0 +1,261 @@
+import hashlib
+import random
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DatabaseError
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .cache_local import CacheLRU
+from .index_adresses import index_adresses, normaliser_adresse
+from .instrumentation import _centile, mesurer
+from .models import Client
+from .taches import enfiler, tache
+
+API_ADRESSE_URL = "https://api-adresse.data.gouv.fr/search"
+
+
+_cache_local = CacheLRU(getattr(settings, 'GEOCODAGE_CACHE_TAILLE', 1024))
+
+
+def _ttl(donnees):
+    # Les adresses introuvables sont gardées moins longtemps que les adresses trouvées
+    if donnees.get('features'):
+        return getattr(settings, 'GEOCODAGE_CACHE_TTL', 60 * 60 * 24 * 30)
+    return getattr(settings, 'GEOCODAGE_CACHE_TTL_NEGATIF', 60 * 60)
+
+
+def _cache_persistant():
+    return caches[getattr(settings, 'GEOCODAGE_CACHE_ALIAS', 'default')]
+
+
+def extraire_coordonnees(donnees):
+    """Renvoie (latitude, longitude) du premier résultat de l'API, ou None."""
+    if donnees.get('features'):
+        longitude, latitude = donnees['features'][0]['geometry']['coordinates'][:2]
+        return latitude, longitude
+    return None
+
+
+class APIAdresseIndisponible(Exception):
+    """L'API adresse n'a pas répondu à temps, a renvoyé une erreur serveur, ou le disjoncteur est ouvert."""
+
+
+class Disjoncteur:
+    """
+    Après `seuil` échecs consécutifs, le circuit s'ouvre : les appels sont refusés immédiatement pendant
+    `delai` secondes. Un seul appel d'essai est ensuite autorisé ; il referme le circuit s'il réussit.
+    """
+
+    def __init__(self, seuil=5, delai=30):
+        self.seuil = seuil
+        self.delai = delai
+        self.etat = 'ferme'
+        self.echecs = 0
+        self.ouvertures = 0
+        self._ouvert_depuis = 0.0
+        self._essai_en_cours = False
+        self._verrou = threading.Lock()
+
+    def autoriser(self):
+        with self._verrou:
+            if self.etat == 'ouvert' and time.monotonic() - self._ouvert_depuis >= self.delai:
+                self.etat, self._essai_en_cours = 'semi_ouvert', False
+            if self.etat == 'semi_ouvert' and not self._essai_en_cours:
+                self._essai_en_cours = True
+                return True
+            return self.etat == 'ferme'
+
+    def succes(self):
+        with self._verrou:
+            self.etat, self.echecs, self._essai_en_cours = 'ferme', 0, False
+
+    def echec(self):
+        with self._verrou:
+            self.echecs += 1
+            self._essai_en_cours = False
+            if self.etat == 'semi_ouvert' or (self.etat == 'ferme' and self.echecs >= self.seuil):
+                self.etat, self._ouvert_depuis = 'ouvert', time.monotonic()
+                self.ouvertures += 1
+
+
+class ClientAPIAdresse:
+    """
+    Client de api-adresse.data.gouv.fr partagé par le processus : connexions réutilisées (requests.Session),
+    délais de connexion et de lecture stricts, disjoncteur et au plus un nouvel essai par recherche, après une
+    courte attente aléatoire, dans la limite d'une fraction des appels du processus (budget), pour qu'une API
+    lente ou en panne ne bloque pas les workers ni ne soit surchargée d'essais.
+    """
+
+    def __init__(self):
+        self.session = requests.Session()
+        adaptateur = HTTPAdapter(pool_connections=1, pool_maxsize=getattr(settings, 'GEOCODAGE_POOL_TAILLE', 10))
+        self.session.mount('https://', adaptateur)
+        self.session.mount('http://', adaptateur)
+        self.delais = (getattr(settings, 'GEOCODAGE_DELAI_CONNEXION', 1.0), getattr(settings, 'GEOCODAGE_DELAI_LECTURE', 2.0))
+        self.disjoncteur = Disjoncteur(getattr(settings, 'GEOCODAGE_DISJONCTEUR_SEUIL', 5),
+                                       getattr(settings, 'GEOCODAGE_DISJONCTEUR_DELAI', 30))
+        # Chaque appel crédite le budget de `ratio_essais` (crédit initial : celui de 10 appels) ;
+        # un nouvel essai le débite de 1. Le budget plafonne les essais de l'ensemble du processus.
+        self.ratio_essais = getattr(settings, 'GEOCODAGE_BUDGET_NOUVEAUX_ESSAIS', 0.1)
+        self.budget = 10 * self.ratio_essais
+        self.nouveaux_essais_max = getattr(settings, 'GEOCODAGE_NOUVEAUX_ESSAIS_MAX', 1)
+        self.attente_nouvel_essai = getattr(settings, 'GEOCODAGE_ATTENTE_NOUVEL_ESSAI', 0.1)
+        self.compteurs = dict.fromkeys(('appels', 'echecs', 'nouveaux_essais', 'refus_disjoncteur', 'cache_perime'), 0)
+        self._latences = deque(maxlen=1000)
+        self._verrou = threading.Lock()
+
+    def compter(self, compteur):
+        with self._verrou:
+            self.compteurs[compteur] += 1
+
+    def _nouvel_essai_autorise(self):
+        with self._verrou:
+            if self.budget < 1:
+                return False
+            self.budget -= 1
+            self.compteurs['nouveaux_essais'] += 1
+            return True
+
+    def _appeler(self, adresse):
+        debut = time.perf_counter()
+        try:
+            with mesurer('externe'):
+                response = self.session.get(API_ADRESSE_URL, params={'q': adresse, 'limit': 1}, timeout=self.delais)
+            if response.status_code >= 500 or response.status_code == 429:
+                raise APIAdresseIndisponible(f"Erreur {response.status_code} de l'API adresse.")
+            return response.status_code, response.json()
+        finally:
+            with self._verrou:
+                self.compteurs['appels'] += 1
+                self._latences.append(time.perf_counter() - debut)
+
+    def rechercher(self, adresse):
+        """Renvoie (code HTTP, réponse JSON) ; lève APIAdresseIndisponible si l'API ne peut pas répondre."""
+        if not self.disjoncteur.autoriser():
+            self.compter('refus_disjoncteur')
+            raise APIAdresseIndisponible("API adresse indisponible (disjoncteur ouvert).")
+        with self._verrou:
+            self.budget = min(self.budget + self.ratio_essais, 10.0)
+
+        essais = 0
+        while True:
+            try:
+                resultat = self._appeler(adresse)
+            except (requests.RequestException, ValueError, APIAdresseIndisponible) as erreur:
+                self.compter('echecs')
+                if essais < self.nouveaux_essais_max and self._nouvel_essai_autorise():
+                    essais += 1
+                    # Attente aléatoire : les workers touchés par la même erreur ne réessaient pas ensemble
+                    time.sleep(random.uniform(0.5, 1) * self.attente_nouvel_essai)
+                    continue
+                self.disjoncteur.echec()
+                raise APIAdresseIndisponible(str(erreur)) from erreur
+            self.disjoncteur.succes()
+            return resultat
+
+    def etat(self):
+        with self._verrou:
+            latences = sorted(self._latences)
+            etat = dict(self.compteurs, budget_nouveaux_essais=round(self.budget, 2))
+        etat.update({
+            'disjoncteur': self.disjoncteur.etat,
+            'echecs_consecutifs': self.disjoncteur.echecs,
+            'ouvertures_disjoncteur': self.disjoncteur.ouvertures,
+            'p50_ms': round(_centile(latences, 50) * 1000, 2) if latences else None,
+            'p95_ms': round(_centile(latences, 95) * 1000, 2) if latences else None,
+        })
+        return etat
+
+
+_client = None
+
+
+def client_api_adresse():
+    global _client
+    if _client is None:
+        _client = ClientAPIAdresse()
+    return _client
+
+
+def rechercher_adresse(adresse):
+    """
+    Cherche l'adresse dans l'index BAN local s'il est configuré (GEOCODAGE_INDEX_FICHIER), sinon interroge
+    l'API adresse.data.gouv.fr (premier résultat uniquement) en passant par un cache LRU local puis par le
+    cache Django persistant. Si l'API est indisponible, une réponse expirée du cache persistant
+    est renvoyée à défaut ; sans elle, APIAdresseIndisponible est levée.
+    """
+    index = index_adresses()
+    if index is not None:
+        donnees = index.rechercher(adresse)
+        if donnees['features'] or getattr(settings, 'GEOCODAGE_INDEX_SEUL', False):
+            return donnees
+
+    cle = normaliser_adresse(adresse)
+    donnees = _cache_local.get(cle)
+    if donnees is not None:
+        return donnees
+
+    cle_persistante = 'geocodage:' + hashlib.sha1(cle.encode('utf-8')).hexdigest()
+    try:
+        entree = _cache_persistant().get(cle_persistante)
+    except DatabaseError:
+        # Table de cache absente ou indisponible : on se rabat sur l'API
+        entree = None
+    if entree is not None and 'donnees' not in entree:
+        # Entrée enregistrée sans date d'expiration : considérée comme à jour
+        entree = {'donnees': entree, 'expiration': float('inf')}
+
+    if entree is not None and entree['expiration'] > time.time():
+        donnees = entree['donnees']
+    else:
+        client = client_api_adresse()
+        try:
+            statut, donnees = client.rechercher(adresse)
+        except APIAdresseIndisponible:
+            if entree is None:
+                raise
+            client.compter('cache_perime')
+            return entree['donnees']
+        if statut != 200:
+            # Ne pas mettre en cache les erreurs de l'API
+            return donnees
+        try:
+            # Conservée au-delà de son expiration pour servir de secours en cas de panne de l'API
+            _cache_persistant().set(cle_persistante, {'donnees': donnees, 'expiration': time.time() + _ttl(donnees)},
+                                    _ttl(donnees) + getattr(settings, 'GEOCODAGE_CACHE_SECOURS', 60 * 60 * 24 * 30))
+        except DatabaseError:
+            pass
+
+    _cache_local.set(cle, donnees, _ttl(donnees))
+    return donnees
+
+
+@tache('geocodage.client', file='geocodage')
+def geocoder_client(client_id):
+    """Renseigne les coordonnées d'un client dont l'adresse n'a pas pu être vérifiée à l'enregistrement."""
+    adresse = Client.objects.filter(pk=client_id).values_list('adresse', flat=True).first()
+    if not adresse:
+        return
+    donnees = rechercher_adresse(adresse)
+    if 'features' not in donnees:
+        # Erreur de l'API : la tâche sera réessayée
+        raise ValueError(f"Réponse inattendue de l'API adresse : {donnees}")
+    coordonnees = extraire_coordonnees(donnees)
+    if coordonnees:
+        latitude, longitude = coordonnees
+        Client.objects.filter(pk=client_id, adresse=adresse).update(latitude=latitude, longitude=longitude)
+
+
+@receiver(post_save, sender=Client)
+def geocoder_nouvelle_adresse(sender, instance, **kwargs):
+    """Géocode en tâche de fond un client enregistré avec une adresse mais sans coordonnées."""
+    if instance.adresse and instance.latitude is None:
+        empreinte = hashlib.sha1(normaliser_adresse(instance.adresse).encode('utf-8')).hexdigest()[:16]
+        enfiler(geocoder_client, instance.pk, cle_idempotence=f'geocodage:{instance.pk}:{empreinte}')
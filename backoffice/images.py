@@ -0,0 +1,114 @@
+import io
+import logging
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.timezone import now
+from PIL import Image, ImageOps
+
+from .catalogue import invalider_catalogue
+from .models import Produit
+from .taches import enfiler, tache
+
+logger = logging.getLogger(__name__)
+
+# Format Pillow et options d'enregistrement de chaque variante
+FORMATS = {
+    'avif': ('AVIF', {'quality': 60}),
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def formats_disponibles():
+    """Formats de variantes pris en charge par le Pillow installé (AVIF selon la version ou le plugin)."""
+    extensions = Image.registered_extensions()
+    return [format_variante for format_variante in getattr(settings, 'PRODUIT_IMAGE_FORMATS', ['avif', 'webp', 'jpeg'])
+            if f'.{format_variante}' in extensions and format_variante in FORMATS]
+
+
+def generer_variantes(nom_image):
+    """
+    Crée à côté de l'image originale une version redimensionnée par largeur et par format
+    (ex. produits/pizza_320.webp). Renvoie {format: {largeur: nom du fichier}}.
+    """
+    racine = os.path.splitext(nom_image)[0]
+    with default_storage.open(nom_image, 'rb') as fichier:
+        original = ImageOps.exif_transpose(Image.open(fichier))
+        original.load()
+
+    largeurs = sorted(largeur for largeur in getattr(settings, 'PRODUIT_IMAGE_LARGEURS', [160, 320, 640, 1024])
+                      if largeur < original.width) or [original.width]
+    variantes = {}
+    for largeur in largeurs:
+        image = original.copy()
+        image.thumbnail((largeur, largeur * original.height // original.width or 1), Image.LANCZOS)
+        for format_variante in formats_disponibles():
+            format_pillow, options = FORMATS[format_variante]
+            copie = image.convert('RGB') if format_pillow == 'JPEG' and image.mode != 'RGB' else image
+            contenu = io.BytesIO()
+            copie.save(contenu, format_pillow, **options)
+            nom = f'{racine}_{largeur}.{format_variante}'
+            default_storage.delete(nom)
+            variantes.setdefault(format_variante, {})[str(largeur)] = default_storage.save(nom, ContentFile(contenu.getvalue()))
+    return variantes
+
+
+def supprimer_variantes(variantes):
+    for noms in (variantes or {}).get('formats', {}).values():
+        for nom in noms.values():
+            default_storage.delete(nom)
+
+
+@tache('images.variantes', file='images')
+def traiter_image(produit_id, nom_image):
+    """Génère les variantes de l'image d'un produit et les enregistre, si l'image n'a pas changé entre-temps."""
+    if not Produit.objects.filter(pk=produit_id, image=nom_image).exists():
+        # Produit supprimé ou image remplacée avant l'exécution de la tâche
+        return
+    formats = generer_variantes(nom_image)
+    anciennes = Produit.objects.filter(pk=produit_id).values_list('image_variantes', flat=True).first()
+    mis_a_jour = Produit.objects.filter(pk=produit_id, image=nom_image).update(
+        image_variantes={'source': nom_image, 'formats': formats}, date_modification=now())
+    if mis_a_jour:
+        if anciennes and anciennes.get('source') != nom_image:
+            supprimer_variantes(anciennes)
+        invalider_catalogue()
+    else:
+        # Produit supprimé ou image remplacée pendant la génération
+        supprimer_variantes({'formats': formats})
+
+
+@tache('images.suppression', file='images')
+def supprimer_image(nom_image, variantes):
+    """Supprime une image et ses variantes, sauf si un produit l'utilise de nouveau (même contenu renvoyé depuis)."""
+    if Produit.objects.filter(image=nom_image).exists():
+        return
+    default_storage.delete(nom_image)
+    for nom in variantes:
+        default_storage.delete(nom)
+
+
+def planifier_variantes(produit):
+    """Enfile la génération des variantes, exécutée par un travailleur après validation de la transaction."""
+    enfiler(traiter_image, produit.pk, produit.image.name,
+            cle_idempotence=f'variantes:{produit.pk}:{produit.image.name}')
+
+
+@receiver(post_save, sender=Produit)
+def variantes_image_produit(sender, instance, **kwargs):
+    if instance.image and (instance.image_variantes or {}).get('source') != instance.image.name:
+        planifier_variantes(instance)
+
+
+@receiver(post_delete, sender=Produit)
+def submission_delete(sender, instance, **kwargs):
+    # Supprime le fichier après la suppression de l'instance du modèle, ainsi que toutes ses versions
+    # redimensionnées, en tâche de fond
+    if instance.image:
+        variantes = [nom for noms in (instance.image_variantes or {}).get('formats', {}).values() for nom in noms.values()]
+        enfiler(supprimer_image, instance.image.name, variantes)
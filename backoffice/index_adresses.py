@@ -0,0 +1,243 @@
+import bisect
+import json
+import mmap
+import re
+import threading
+import unicodedata
+
+import numpy as np
+from django.conf import settings
+
+ENTETE = b'BANIDX01'
+ALPHABET = ' abcdefghijklmnopqrstuvwxyz0123456789'
+NOMBRE_TRIGRAMMES = len(ALPHABET) ** 3
+_code_caractere = {caractere: position for position, caractere in enumerate(ALPHABET)}
+
+# Tables à enregistrement fixe ; les textes (clés normalisées, libellés) sont dans un bloc d'octets commun
+ADRESSE = np.dtype([('cle', '<u8'), ('cle_long', '<u2'), ('label', '<u8'), ('label_long', '<u2'),
+                    ('lat', '<f8'), ('lon', '<f8')])
+VOIE = np.dtype([('cle', '<u8'), ('cle_long', '<u2'), ('label', '<u8'), ('label_long', '<u2'),
+                 ('lat', '<f8'), ('lon', '<f8'), ('premiere', '<u4'), ('nombre', '<u4'), ('trigrammes', '<u2')])
+
+# Abréviations courantes des types de voie, développées dans les clés de l'index et dans les recherches
+ABREVIATIONS = {
+    'r': 'rue', 'av': 'avenue', 'ave': 'avenue', 'bd': 'boulevard', 'bld': 'boulevard', 'pl': 'place',
+    'all': 'allee', 'imp': 'impasse', 'ch': 'chemin', 'che': 'chemin', 'rte': 'route', 'sq': 'square',
+    'fg': 'faubourg', 'st': 'saint', 'ste': 'sainte',
+}
+NUMERO = re.compile(r'^(\d+)(?: (bis|ter|quater|quinquies|[a-z]))? (.+)$')
+
+
+def normaliser_adresse(adresse):
+    """Normalise une adresse (casse, accents, ponctuation, espaces) pour servir de clé de cache et d'index."""
+    adresse = unicodedata.normalize('NFKD', adresse or '')
+    adresse = ''.join(c for c in adresse if not unicodedata.combining(c))
+    adresse = re.sub(r"[^a-z0-9]+", ' ', adresse.lower())
+    return adresse.strip()
+
+
+def cle_index(adresse):
+    return ' '.join(ABREVIATIONS.get(mot, mot) for mot in normaliser_adresse(adresse).split())
+
+
+def trigrammes(texte):
+    """Codes des trigrammes d'un texte normalisé, bordé d'espaces."""
+    texte = f' {texte} '
+    codes = set()
+    for i in range(len(texte) - 2):
+        a, b, c = (_code_caractere.get(caractere, 0) for caractere in texte[i:i + 3])
+        codes.add((a * len(ALPHABET) + b) * len(ALPHABET) + c)
+    return codes
+
+
+def _libelle_voie(ligne):
+    return f"{ligne['nom_voie']} {ligne['code_postal']} {ligne['nom_commune']}"
+
+
+def _libelle_adresse(ligne):
+    numero = f"{ligne['numero']} {ligne['rep']}" if ligne.get('rep') else ligne['numero']
+    return f"{numero} {_libelle_voie(ligne)}"
+
+
+def construire_index(lignes, chemin):
+    """
+    Écrit l'index à partir de lignes d'un extrait BAN (numero, rep, nom_voie, code_postal, nom_commune,
+    lon, lat). Contenu : adresses triées par clé normalisée (recherche exacte par dichotomie), voies avec
+    leurs adresses, et listes de voies par trigramme (recherche approchée). Renvoie (adresses, voies).
+    """
+    adresses, voies = {}, {}
+    for ligne in lignes:
+        if not ligne.get('numero') or ligne['numero'] == '99999' or not ligne.get('lat'):
+            # 99999 : lieu-dit sans numéro
+            continue
+        label = _libelle_adresse(ligne)
+        adresses[cle_index(label)] = (label, float(ligne['lat']), float(ligne['lon']))
+        voies.setdefault(cle_index(_libelle_voie(ligne)), (_libelle_voie(ligne), []))[1].append(cle_index(label))
+
+    bloc = bytearray()
+
+    def texte(valeur):
+        donnees = valeur.encode('utf-8')
+        bloc.extend(donnees)
+        return len(bloc) - len(donnees), len(donnees)
+
+    cles_adresses = sorted(adresses)
+    rang = {cle: i for i, cle in enumerate(cles_adresses)}
+    table_adresses = np.zeros(len(cles_adresses), dtype=ADRESSE)
+    for i, cle in enumerate(cles_adresses):
+        label, lat, lon = adresses[cle]
+        table_adresses[i] = (*texte(cle), *texte(label), lat, lon)
+
+    cles_voies = sorted(voies)
+    table_voies = np.zeros(len(cles_voies), dtype=VOIE)
+    adresses_voies = []
+    postings = [[] for _ in range(NOMBRE_TRIGRAMMES)]
+    for i, cle in enumerate(cles_voies):
+        label, membres = voies[cle]
+        ids = sorted(rang[membre] for membre in set(membres))
+        codes = trigrammes(cle)
+        table_voies[i] = (*texte(cle), *texte(label), table_adresses['lat'][ids].mean(),
+                          table_adresses['lon'][ids].mean(), len(adresses_voies), len(ids), len(codes))
+        adresses_voies.extend(ids)
+        for code in codes:
+            postings[code].append(i)
+
+    debuts_trigrammes = np.zeros(NOMBRE_TRIGRAMMES + 1, dtype='<u8')
+    debuts_trigrammes[1:] = np.cumsum([len(liste) for liste in postings])
+    sections = {
+        'adresses': table_adresses,
+        'voies': table_voies,
+        'adresses_voies': np.array(adresses_voies, dtype='<u4'),
+        'debuts_trigrammes': debuts_trigrammes,
+        'voies_trigrammes': np.array([i for liste in postings for i in liste], dtype='<u4'),
+        'textes': np.frombuffer(bytes(bloc), dtype='u1'),
+    }
+
+    # En-tête JSON (position, type, taille de chaque section), puis sections alignées sur 8 octets
+    description, position = {}, 0
+    for nom, tableau in sections.items():
+        dtype = tableau.dtype.descr if tableau.dtype.names else tableau.dtype.str
+        description[nom] = {'position': position, 'dtype': dtype, 'nombre': len(tableau)}
+        position += -(-tableau.nbytes // 8) * 8
+    entete = json.dumps(description).encode('utf-8')
+    entete += b' ' * (-len(entete) % 8)
+    with open(chemin, 'wb') as fichier:
+        fichier.write(ENTETE + len(entete).to_bytes(8, 'little') + entete)
+        for tableau in sections.values():
+            fichier.write(tableau.tobytes())
+            fichier.write(b'\0' * (-tableau.nbytes % 8))
+    return len(table_adresses), len(table_voies)
+
+
+class IndexAdresses:
+    """
+    Index d'adresses BAN projeté en mémoire (mmap) : seules les pages consultées sont lues et elles sont
+    partagées entre processus. Renvoie des réponses au format de l'API adresse (label et coordonnées).
+    """
+
+    def __init__(self, chemin, score_minimum=0.5):
+        self.score_minimum = score_minimum
+        with open(chemin, 'rb') as fichier:
+            self._mmap = mmap.mmap(fichier.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:8] != ENTETE:
+            raise ValueError(f"{chemin} n'est pas un index d'adresses (commande indexer_adresses).")
+        longueur = int.from_bytes(self._mmap[8:16], 'little')
+        description = json.loads(self._mmap[16:16 + longueur])
+        debut = 16 + longueur
+        for nom, section in description.items():
+            dtype = section['dtype']
+            dtype = np.dtype([tuple(champ) for champ in dtype]) if isinstance(dtype, list) else np.dtype(dtype)
+            setattr(self, nom, np.frombuffer(self._mmap, dtype=dtype, count=section['nombre'],
+                                             offset=debut + section['position']))
+        self._debut_textes = debut + description['textes']['position']
+        self._cles = _Cles(self, range(len(self.adresses)))
+
+    def _texte(self, position, longueur):
+        position = self._debut_textes + int(position)
+        return self._mmap[position:position + int(longueur)].decode('utf-8')
+
+    def cle(self, i):
+        return self._texte(self.adresses['cle'][i], self.adresses['cle_long'][i])
+
+    def _resultat(self, label, lat, lon, type_resultat, score):
+        return {'type': 'FeatureCollection', 'features': [{
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': [float(lon), float(lat)]},
+            'properties': {'label': label, 'score': round(score, 3), 'type': type_resultat},
+        }]}
+
+    def _adresse(self, i, score):
+        adresse = self.adresses[i]
+        return self._resultat(self._texte(adresse['label'], adresse['label_long']), adresse['lat'], adresse['lon'],
+                              'housenumber', score)
+
+    def _meilleure_voie(self, requete):
+        """
+        Voie la plus proche de la requête et son score (similarité de Jaccard sur les trigrammes), calculé
+        pour toutes les voies partageant au moins un trigramme à partir des seules listes de l'index.
+        """
+        codes = trigrammes(requete)
+        listes = [self.voies_trigrammes[self.debuts_trigrammes[code]:self.debuts_trigrammes[code + 1]] for code in codes]
+        voies, communs = np.unique(np.concatenate(listes), return_counts=True)
+        if not len(voies):
+            return None, 0.0
+        scores = communs / (len(codes) + self.voies['trigrammes'][voies] - communs)
+        meilleure = int(np.argmax(scores))
+        return int(voies[meilleure]), float(scores[meilleure])
+
+    def rechercher(self, adresse):
+        """Réponse au format de l'API adresse (premier résultat uniquement), {'features': []} si introuvable."""
+        requete = cle_index(adresse)
+        if not requete:
+            return {'type': 'FeatureCollection', 'features': []}
+        i = bisect.bisect_left(self._cles, requete)
+        if i < len(self.adresses) and self.cle(i) == requete:
+            return self._adresse(i, 1.0)
+
+        correspondance = NUMERO.match(requete)
+        numero, rep, reste = correspondance.groups() if correspondance else (None, None, requete)
+        voie, score = self._meilleure_voie(reste)
+        if voie is None or score < self.score_minimum:
+            return {'type': 'FeatureCollection', 'features': []}
+        if numero:
+            cle_voie = self._texte(self.voies['cle'][voie], self.voies['cle_long'][voie])
+            attendue = ' '.join(filter(None, (numero, rep, cle_voie)))
+            premiere = int(self.voies['premiere'][voie])
+            # Adresses de la voie rangées dans l'ordre des clés : recherche par dichotomie
+            cles = _Cles(self, self.adresses_voies[premiere:premiere + int(self.voies['nombre'][voie])])
+            j = bisect.bisect_left(cles, attendue)
+            if j < len(cles) and cles[j] == attendue:
+                return self._adresse(cles.ids[j], score)
+        # Numéro inconnu : position de la voie, comme le fait l'API
+        voie = self.voies[voie]
+        return self._resultat(self._texte(voie['label'], voie['label_long']), voie['lat'], voie['lon'], 'street', score)
+
+
+class _Cles:
+    """Séquence triée des clés d'une liste d'adresses de l'index, pour bisect."""
+
+    def __init__(self, index, ids):
+        self.index = index
+        self.ids = ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, i):
+        return self.index.cle(self.ids[i])
+
+
+_index = None
+_verrou = threading.Lock()
+
+
+def index_adresses():
+    """Index chargé depuis GEOCODAGE_INDEX_FICHIER, une fois par processus ; None s'il n'est pas configuré."""
+    global _index
+    chemin = getattr(settings, 'GEOCODAGE_INDEX_FICHIER', None)
+    if not chemin:
+        return None
+    with _verrou:
+        if _index is None:
+            _index = IndexAdresses(chemin, getattr(settings, 'GEOCODAGE_INDEX_SCORE_MINIMUM', 0.5))
+    return _index
@@ -0,0 +1,255 @@
+import heapq
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Livreur
+
+KM_PAR_DEGRE_LATITUDE = 110.57
+KM_PAR_DEGRE_LONGITUDE = 111.32
+
+
+def parser_position(position_geo):
+    """Convertit une position texte "latitude,longitude" en tuple de flottants, ou None si illisible."""
+    if not position_geo:
+        return None
+    try:
+        latitude, longitude = (float(valeur) for valeur in position_geo.replace(';', ',').split(','))
+    except ValueError:
+        return None
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return None
+    return latitude, longitude
+
+
+def distance_approx_km(lat1, lon1, lat2, lon2):
+    """Distance équirectangulaire, suffisante pour comparer des livreurs à l'échelle d'une ville."""
+    dx = (lon2 - lon1) * KM_PAR_DEGRE_LONGITUDE * math.cos(math.radians((lat1 + lat2) / 2))
+    dy = (lat2 - lat1) * KM_PAR_DEGRE_LATITUDE
+    return math.hypot(dx, dy)
+
+
+class IndexLivreurs:
+    """
+    Grille spatiale en mémoire des livreurs disponibles.
+    Chaque cellule couvre `taille_cellule` degrés ; la recherche parcourt les anneaux de cellules
+    autour du point jusqu'à être certaine d'avoir les livreurs les plus proches.
+    L'index est propre au processus : les écritures des autres processus (et les QuerySet.update(), qui
+    n'émettent pas de signal) ne l'atteignent pas, il est donc rechargé toutes les INDEX_LIVREURS_TTL secondes.
+    """
+
+    def __init__(self, taille_cellule=0.01, anneaux_max=100):
+        self.taille_cellule = taille_cellule
+        self.anneaux_max = anneaux_max
+        self._cellules = {}
+        self._positions = {}
+        # Positions reçues pour des livreurs absents de l'index (non disponibles), pas encore écrites en base
+        self._recentes = {}
+        self._verrou = threading.RLock()
+        self._charge_le = None
+
+    def _cellule(self, latitude, longitude):
+        return (math.floor(latitude / self.taille_cellule), math.floor(longitude / self.taille_cellule))
+
+    def _retirer(self, livreur_id):
+        position = self._positions.pop(livreur_id, None)
+        if position is not None:
+            cellule = self._cellule(*position)
+            membres = self._cellules.get(cellule)
+            if membres is not None:
+                membres.discard(livreur_id)
+                if not membres:
+                    del self._cellules[cellule]
+
+    def retirer(self, livreur_id):
+        with self._verrou:
+            self._retirer(livreur_id)
+
+    @staticmethod
+    def _ttl():
+        return getattr(settings, 'INDEX_LIVREURS_TTL', 30)
+
+    def _position_recente(self, livreur_id, latitude, longitude):
+        """Position reçue par deplacer() si elle est plus récente que la dernière lecture possible en base."""
+        recente = self._recentes.get(livreur_id)
+        if recente is not None and time.monotonic() - recente[2] < self._ttl():
+            return recente[:2]
+        return latitude, longitude
+
+    def mettre_a_jour(self, livreur_id, latitude, longitude, disponible=True):
+        with self._verrou:
+            self._retirer(livreur_id)
+            latitude, longitude = self._position_recente(livreur_id, latitude, longitude)
+            if disponible and latitude is not None and longitude is not None:
+                self._positions[livreur_id] = (latitude, longitude)
+                self._cellules.setdefault(self._cellule(latitude, longitude), set()).add(livreur_id)
+
+    def deplacer(self, livreur_id, latitude, longitude):
+        """
+        Met à jour la position d'un livreur indexé (donc disponible). Pour un livreur absent de l'index, la
+        position est gardée et utilisée lorsqu'il y entre (redevenu disponible ou rechargement), la base
+        pouvant encore contenir l'ancienne position tant que le tampon n'est pas écrit.
+        """
+        with self._verrou:
+            if livreur_id in self._positions:
+                self._recentes.pop(livreur_id, None)
+                self._retirer(livreur_id)
+                self._positions[livreur_id] = (latitude, longitude)
+                self._cellules.setdefault(self._cellule(latitude, longitude), set()).add(livreur_id)
+            else:
+                self._recentes[livreur_id] = (latitude, longitude, time.monotonic())
+
+    def synchroniser(self, livreur):
+        self.mettre_a_jour(livreur.pk, livreur.latitude, livreur.longitude, livreur.statut == 'disponible')
+
+    def charger(self):
+        """(Re)construit l'index à partir de la base de données."""
+        livreurs = (Livreur.objects
+                    .filter(statut='disponible', latitude__isnull=False, longitude__isnull=False)
+                    .values_list('id', 'latitude', 'longitude'))
+        with self._verrou:
+            self._cellules = {}
+            self._positions = {}
+            for livreur_id, latitude, longitude in livreurs.iterator():
+                self.mettre_a_jour(livreur_id, latitude, longitude)
+            instant = time.monotonic()
+            self._recentes = {livreur_id: recente for livreur_id, recente in self._recentes.items()
+                              if instant - recente[2] < self._ttl()}
+            self._charge_le = instant
+
+    def vider(self):
+        with self._verrou:
+            self._cellules = {}
+            self._positions = {}
+            self._recentes = {}
+            self._charge_le = None
+
+    def perime(self):
+        return self._charge_le is None or time.monotonic() - self._charge_le >= self._ttl()
+
+    def plus_proches(self, latitude, longitude, nombre=5, exclus=()):
+        """
+        Renvoie jusqu'à `nombre` identifiants de livreurs disponibles, du plus proche au plus éloigné, en
+        ignorant ceux de `exclus`.
+        """
+        if self.perime():
+            self.charger()
+        nombre += len(exclus)
+
+        with self._verrou:
+            if not self._positions:
+                return []
+            centre_lat, centre_lon = self._cellule(latitude, longitude)
+            # Distance minimale couverte par un anneau de cellules supplémentaire
+            km_par_anneau = self.taille_cellule * min(
+                KM_PAR_DEGRE_LATITUDE,
+                KM_PAR_DEGRE_LONGITUDE * max(math.cos(math.radians(latitude)), 0.01),
+            )
+            candidats = []
+            vus = 0
+            for anneau in range(self.anneaux_max + 1):
+                for cellule in self._anneau(centre_lat, centre_lon, anneau):
+                    for livreur_id in self._cellules.get(cellule, ()):
+                        candidats.append((distance_approx_km(latitude, longitude, *self._positions[livreur_id]), livreur_id))
+                        vus += 1
+                if len(candidats) >= nombre and heapq.nsmallest(nombre, candidats)[-1][0] <= anneau * km_par_anneau:
+                    break
+                if vus == len(self._positions):
+                    break
+            else:
+                # Livreurs trop éloignés pour la grille : parcours complet
+                candidats = [
+                    (distance_approx_km(latitude, longitude, *position), livreur_id)
+                    for livreur_id, position in self._positions.items()
+                ]
+            return [livreur_id for _, livreur_id in heapq.nsmallest(nombre, candidats)
+                    if livreur_id not in exclus][:nombre - len(exclus)]
+
+    @staticmethod
+    def _anneau(centre_lat, centre_lon, anneau):
+        if anneau == 0:
+            yield (centre_lat, centre_lon)
+            return
+        for dlon in range(-anneau, anneau + 1):
+            yield (centre_lat - anneau, centre_lon + dlon)
+            yield (centre_lat + anneau, centre_lon + dlon)
+        for dlat in range(-anneau + 1, anneau):
+            yield (centre_lat + dlat, centre_lon - anneau)
+            yield (centre_lat + dlat, centre_lon + anneau)
+
+
+index_livreurs = IndexLivreurs()
+
+
+def _verrouiller_disponible(livreurs):
+    """
+    Verrouille un seul livreur disponible parmi `livreurs`, sans attendre ceux déjà verrouillés par une autre
+    commande (SKIP LOCKED) lorsque la base le permet. Une seule ligne à la fois : des livreurs verrouillés
+    mais non réservés resteraient bloqués pour les autres commandes jusqu'à la fin de la transaction.
+    """
+    livreurs = livreurs.filter(statut='disponible')
+    if connection.features.has_select_for_update_skip_locked:
+        livreurs = livreurs.select_for_update(skip_locked=True)
+    return livreurs.order_by('id').first()
+
+
+def reserver_livreur(latitude=None, longitude=None, nombre_candidats=5):
+    """
+    Réserve le livreur disponible le plus proche (ou un livreur disponible quelconque si la position
+    est inconnue) et le passe au statut 'reserve'. Doit être appelé dans une transaction : deux
+    commandes simultanées obtiennent toujours deux livreurs différents. Renvoie None si aucun livreur
+    n'est disponible.
+    """
+    essayes = set()
+    if latitude is not None and longitude is not None:
+        recharge = False
+        while True:
+            candidats = index_livreurs.plus_proches(latitude, longitude, nombre_candidats, exclus=essayes)
+            if not candidats:
+                if recharge:
+                    break
+                # Index périmé (livreurs réservés ou revenus par un autre processus) : relu une fois en base
+                index_livreurs.charger()
+                recharge = True
+                continue
+            for livreur_id in candidats:
+                essayes.add(livreur_id)
+                livreur = _verrouiller_disponible(Livreur.objects.filter(pk=livreur_id))
+                if livreur is None:
+                    # Déjà réservé ailleurs, ou verrouillé par une commande en cours
+                    index_livreurs.retirer(livreur_id)
+                elif _reserver(livreur):
+                    return livreur
+
+    while True:
+        livreur = _verrouiller_disponible(Livreur.objects.exclude(pk__in=essayes))
+        if livreur is None:
+            return None
+        if _reserver(livreur):
+            return livreur
+        essayes.add(livreur.pk)
+
+
+def _reserver(livreur):
+    # Mise à jour conditionnelle : seule une transaction peut faire passer le livreur de 'disponible' à 'reserve'
+    if Livreur.objects.filter(pk=livreur.pk, statut='disponible').update(statut='reserve'):
+        livreur.statut = 'reserve'
+        transaction.on_commit(lambda livreur_id=livreur.pk: index_livreurs.retirer(livreur_id))
+        return True
+    index_livreurs.retirer(livreur.pk)
+    return False
+
+
+@receiver(post_save, sender=Livreur)
+def synchroniser_index_livreur(sender, instance, **kwargs):
+    index_livreurs.synchroniser(instance)
+
+
+@receiver(post_delete, sender=Livreur)
+def retirer_index_livreur(sender, instance, **kwargs):
+    index_livreurs.retirer(instance.pk)
@@ -0,0 +1,201 @@
+import contextvars
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import ExitStack, contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from rest_framework import renderers, serializers
+
+CATEGORIES = ('db', 'externe', 'serialisation')
+
+_mesures_requete = contextvars.ContextVar('mesures_requete', default=None)
+
+
+class MesuresRequete:
+    """Temps (en secondes) et nombre de requêtes SQL accumulés pendant le traitement d'une requête HTTP."""
+
+    def __init__(self):
+        self.temps = dict.fromkeys(CATEGORIES, 0.0)
+        self.nombre_requetes_sql = 0
+        self._en_cours = set()
+
+
+@contextmanager
+def mesurer(categorie):
+    """
+    Ajoute le temps passé dans le bloc à la catégorie donnée pour la requête HTTP en cours.
+    Sans effet en dehors d'une requête ; les blocs imbriqués d'une même catégorie ne sont comptés qu'une fois.
+    """
+    mesures = _mesures_requete.get()
+    if mesures is None or categorie in mesures._en_cours:
+        yield
+        return
+    mesures._en_cours.add(categorie)
+    debut = time.perf_counter()
+    try:
+        yield
+    finally:
+        mesures.temps[categorie] += time.perf_counter() - debut
+        mesures._en_cours.discard(categorie)
+
+
+def _mesurer_sql(execute, sql, params, many, context):
+    mesures = _mesures_requete.get()
+    mesures.nombre_requetes_sql += 1
+    with mesurer('db'):
+        return execute(sql, params, many, context)
+
+
+class ListeMesuree(serializers.ListSerializer):
+    @property
+    def data(self):
+        with mesurer('serialisation'):
+            return super().data
+
+
+class SerialisationMesureeMixin:
+    """
+    Compte le temps passé dans `data` (to_representation des champs, y compris les sérialiseurs imbriqués)
+    dans la catégorie 'serialisation'. À placer en premier parent des sérialiseurs utilisés par les vues ;
+    avec many=True, la liste créée est une ListeMesuree.
+    """
+
+    @property
+    def data(self):
+        with mesurer('serialisation'):
+            return super().data
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        liste = super().many_init(*args, **kwargs)
+        if type(liste) is serializers.ListSerializer:
+            # Même objet, avec la seule propriété `data` chronométrée
+            liste.__class__ = ListeMesuree
+        return liste
+
+
+class RenduMesureMixin:
+    """
+    Compte le rendu des réponses DRF (encodage JSON...) dans la catégorie 'serialisation', avec le temps
+    des sérialiseurs : à associer à une classe de rendu (DEFAULT_RENDERER_CLASSES).
+    """
+
+    def render(self, *args, **kwargs):
+        with mesurer('serialisation'):
+            return super().render(*args, **kwargs)
+
+
+class JSONRendererMesure(RenduMesureMixin, renderers.JSONRenderer):
+    pass
+
+
+class BrowsableAPIRendererMesure(RenduMesureMixin, renderers.BrowsableAPIRenderer):
+    pass
+
+
+def _centile(valeurs_triees, centile):
+    if not valeurs_triees:
+        return None
+    rang = min(len(valeurs_triees) - 1, int(round(centile / 100 * (len(valeurs_triees) - 1))))
+    return valeurs_triees[rang]
+
+
+class StatistiquesRoutes:
+    """Derniers échantillons par route (méthode + motif d'URL), pour calculer les centiles."""
+
+    def __init__(self, taille_max=1000):
+        self.taille_max = taille_max
+        self._echantillons = defaultdict(lambda: deque(maxlen=self.taille_max))
+        self._verrou = threading.Lock()
+
+    def enregistrer(self, route, total, mesures):
+        with self._verrou:
+            self._echantillons[route].append((total, mesures.nombre_requetes_sql, dict(mesures.temps)))
+
+    def rapport(self):
+        with self._verrou:
+            echantillons = {route: list(valeurs) for route, valeurs in self._echantillons.items()}
+
+        rapport = []
+        for route, valeurs in sorted(echantillons.items()):
+            totaux = sorted(total for total, _, _ in valeurs)
+            ligne = {
+                'route': route,
+                'appels': len(valeurs),
+                'p50_ms': round(_centile(totaux, 50) * 1000, 2),
+                'p95_ms': round(_centile(totaux, 95) * 1000, 2),
+                'p99_ms': round(_centile(totaux, 99) * 1000, 2),
+                'requetes_sql_moyenne': round(sum(nombre for _, nombre, _ in valeurs) / len(valeurs), 1),
+            }
+            for categorie in CATEGORIES:
+                temps = sorted(detail[categorie] for _, _, detail in valeurs)
+                ligne[f'{categorie}_p95_ms'] = round(_centile(temps, 95) * 1000, 2)
+            rapport.append(ligne)
+        return rapport
+
+
+statistiques = StatistiquesRoutes()
+
+
+class InstrumentationMiddleware:
+    """
+    Mesure pour chaque requête le nombre de requêtes SQL, le temps passé en base, dans les appels
+    externes (Stripe, API adresse) et en sérialisation (sérialiseurs et rendu). Les résultats sont agrégés
+    par route et, si INSTRUMENTATION_SERVER_TIMING est activé, renvoyés dans l'en-tête Server-Timing.
+    Compatible avec les vues synchrones et asynchrones.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.server_timing = getattr(settings, 'INSTRUMENTATION_SERVER_TIMING', False)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        mesures = MesuresRequete()
+        jeton = _mesures_requete.set(mesures)
+        debut = time.perf_counter()
+        try:
+            with self._mesurer_sql():
+                response = self.get_response(request)
+        finally:
+            _mesures_requete.reset(jeton)
+        return self._terminer(request, response, mesures, time.perf_counter() - debut)
+
+    async def __acall__(self, request):
+        mesures = MesuresRequete()
+        jeton = _mesures_requete.set(mesures)
+        debut = time.perf_counter()
+        try:
+            with self._mesurer_sql():
+                response = await self.get_response(request)
+        finally:
+            _mesures_requete.reset(jeton)
+        return self._terminer(request, response, mesures, time.perf_counter() - debut)
+
+    @staticmethod
+    def _mesurer_sql():
+        pile = ExitStack()
+        for connexion in connections.all():
+            pile.enter_context(connexion.execute_wrapper(_mesurer_sql))
+        return pile
+
+    def _terminer(self, request, response, mesures, total):
+        match = getattr(request, 'resolver_match', None)
+        if match is not None:
+            statistiques.enregistrer(f"{request.method} {match.route}", total, mesures)
+
+        if self.server_timing:
+            response['Server-Timing'] = ', '.join(
+                [f'db;dur={mesures.temps["db"] * 1000:.2f};desc="{mesures.nombre_requetes_sql} requetes"']
+                + [f'{categorie};dur={mesures.temps[categorie] * 1000:.2f}' for categorie in CATEGORIES[1:]]
+                + [f'total;dur={total * 1000:.2f}']
+            )
+        return response
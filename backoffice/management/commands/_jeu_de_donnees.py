@@ -0,0 +1,145 @@
+"""Génération d'un jeu de données réaliste pour les mesures de performance (commandes de benchmark)."""
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import CommandError
+from django.db import connection
+from django.utils.timezone import now
+
+from backoffice.models import Client, Commande, CommandeProduit, Livreur, Paiement, Produit
+
+User = get_user_model()
+
+PREFIXE = 'bench'
+STATUTS_COMMANDE = ['en_cours', 'prise_en_charge', 'en_cours_de_livraison', 'livree']
+POIDS_STATUTS_COMMANDE = [5, 2, 3, 90]
+HOTES_LOCAUX = {'', 'localhost', '127.0.0.1', '::1'}
+AIDE_BASE_JETABLE = (
+    "Écrit en base : refuse de s'exécuter ailleurs que sur SQLite ou une base locale, sauf avec --base-jetable. "
+    "Base SQLite jetable : --settings Express_Food.settings_mesures (après migrate avec les mêmes réglages)."
+)
+
+
+def verifier_base_jetable(base_jetable=False):
+    """
+    Refuse d'écrire des données de mesure dans une base distante (celle de production dans les réglages du
+    projet) : seules SQLite et les bases locales sont acceptées, sauf confirmation explicite.
+    """
+    hote = connection.settings_dict.get('HOST') or ''
+    if base_jetable or connection.vendor == 'sqlite' or hote in HOTES_LOCAUX or hote.startswith('/'):
+        return
+    raise CommandError(
+        f"La base '{connection.settings_dict.get('NAME')}' sur {hote} n'est pas locale : les données de mesure "
+        "y seraient écrites. Utilisez --settings Express_Food.settings_mesures (SQLite jetable), une base locale, "
+        "ou --base-jetable si cette base peut être remplie de données fictives."
+    )
+
+
+def _derniers_ids(modele, nombre):
+    # bulk_create ne renvoie pas les identifiants sous MySQL : on relit les derniers créés
+    return list(reversed(modele.objects.order_by('-id').values_list('id', flat=True)[:nombre]))
+
+
+def _creer_par_lots(modele, objets, lot):
+    for debut in range(0, len(objets), lot):
+        modele.objects.bulk_create(objets[debut:debut + lot])
+
+
+def _creer_utilisateurs(role, nombre, mot_de_passe, lot):
+    debut = User.objects.filter(username__startswith=f'{PREFIXE}_{role}_').count()
+    _creer_par_lots(User, [
+        User(username=f'{PREFIXE}_{role}_{debut + i}', email=f'{PREFIXE}_{role}_{debut + i}@example.com', password=mot_de_passe)
+        for i in range(nombre)
+    ], lot)
+    return _derniers_ids(User, nombre)
+
+
+def generer(produits=0, clients=0, livreurs=0, commandes=0, lot=5000, graine=0, sortie=None):
+    """
+    Ajoute en base des produits, clients, livreurs et commandes (avec lignes et paiements) autour de
+    Montévrain. Les utilisateurs créés ont le mot de passe 'bench'. Renvoie les identifiants créés.
+    """
+    aleatoire = random.Random(graine)
+    mot_de_passe = make_password('bench')
+    ecrire = sortie.write if sortie else (lambda message: None)
+    cree = {}
+
+    if produits:
+        types = ['plat', 'dessert', 'boissons', 'pizza']
+        _creer_par_lots(Produit, [
+            Produit(nom_produit=f'Produit {i}', prix=Decimal(aleatoire.randint(150, 2500)) / 100,
+                    type_produit=aleatoire.choice(types),
+                    statut='disponible' if aleatoire.random() < 0.9 else 'indisponible')
+            for i in range(produits)
+        ], lot)
+        cree['produits'] = _derniers_ids(Produit, produits)
+        ecrire(f"{produits} produits créés")
+
+    if clients:
+        utilisateurs = _creer_utilisateurs('client', clients, mot_de_passe, lot)
+        _creer_par_lots(Client, [
+            Client(user_id=user_id, adresse=f'{aleatoire.randint(1, 200)} Avenue de Paris 77144 Montévrain',
+                   telephone='+33600000000',
+                   latitude=48.87 + aleatoire.uniform(-0.05, 0.05), longitude=2.75 + aleatoire.uniform(-0.05, 0.05))
+            for user_id in utilisateurs
+        ], lot)
+        cree['clients'] = _derniers_ids(Client, clients)
+        ecrire(f"{clients} clients créés")
+
+    if livreurs:
+        utilisateurs = _creer_utilisateurs('livreur', livreurs, mot_de_passe, lot)
+        positions = [(48.87 + aleatoire.uniform(-0.05, 0.05), 2.75 + aleatoire.uniform(-0.05, 0.05)) for _ in utilisateurs]
+        _creer_par_lots(Livreur, [
+            Livreur(user_id=user_id, statut='disponible' if aleatoire.random() < 0.5 else 'indisponible',
+                    latitude=latitude, longitude=longitude, position_geo=f'{latitude},{longitude}')
+            for user_id, (latitude, longitude) in zip(utilisateurs, positions)
+        ], lot)
+        cree['livreurs'] = _derniers_ids(Livreur, livreurs)
+        ecrire(f"{livreurs} livreurs créés")
+
+    if commandes:
+        ids_clients = cree.get('clients') or list(Client.objects.values_list('id', flat=True))
+        ids_livreurs = cree.get('livreurs') or list(Livreur.objects.values_list('id', flat=True))
+        prix = dict(Produit.objects.filter(statut='disponible').values_list('id', 'prix'))
+        ids_produits = list(prix)
+        maintenant = now()
+
+        for debut in range(0, commandes, lot):
+            taille = min(lot, commandes - debut)
+            objets, contenus = [], []
+            for _ in range(taille):
+                contenu = [
+                    (produit_id, aleatoire.randint(1, 3))
+                    for produit_id in aleatoire.sample(ids_produits, k=min(len(ids_produits), aleatoire.randint(1, 3)))
+                ]
+                total = sum((prix[produit_id] * quantite for produit_id, quantite in contenu), Decimal('0.00'))
+                contenus.append(contenu)
+                objets.append(Commande(
+                    client_id=aleatoire.choice(ids_clients), livreur_id=aleatoire.choice(ids_livreurs),
+                    date_commande=maintenant - timedelta(minutes=aleatoire.randint(0, 60 * 24 * 365)),
+                    statut=aleatoire.choices(STATUTS_COMMANDE, POIDS_STATUTS_COMMANDE)[0],
+                    montant_total=total,
+                    frais_livraison=Decimal('0.00') if total > Decimal('19.99') else Decimal('5.00'),
+                ))
+            Commande.objects.bulk_create(objets)
+
+            lignes, paiements = [], []
+            for commande_id, commande, contenu in zip(_derniers_ids(Commande, taille), objets, contenus):
+                lignes.extend(
+                    CommandeProduit(commande_id=commande_id, produit_id=produit_id, quantite=quantite)
+                    for produit_id, quantite in contenu
+                )
+                paiements.append(Paiement(
+                    commande_id=commande_id, montant=commande.montant_total + commande.frais_livraison,
+                    methode_paiement='stripe',
+                    statut_paiement='en_attente' if commande.statut == 'en_cours' else 'payee',
+                    date_paiement=commande.date_commande, payment_token=f'pi_{PREFIXE}_{commande_id}',
+                ))
+            CommandeProduit.objects.bulk_create(lignes, batch_size=lot)
+            Paiement.objects.bulk_create(paiements, batch_size=lot)
+            ecrire(f"{debut + taille}/{commandes} commandes créées")
+
+    return cree
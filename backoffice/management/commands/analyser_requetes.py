@@ -0,0 +1,72 @@
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from backoffice.models import Client, Commande, Livreur, Paiement, Produit
+
+from ._jeu_de_donnees import AIDE_BASE_JETABLE, generer, verifier_base_jetable
+
+User = get_user_model()
+
+
+def requetes_frequentes():
+    """Requêtes des chemins les plus sollicités de l'API, telles qu'émises par les vues."""
+    client = Client.objects.exclude(user=None).order_by('?').first()
+    livreur = Livreur.objects.exclude(user=None).order_by('?').first()
+    if client is None or livreur is None:
+        raise CommandError("Aucune donnée : utilisez --generer-commandes pour créer un jeu de données.")
+    commande = Commande.objects.filter(client=client).first()
+    jetons = list(Paiement.objects.exclude(payment_token=None).values_list('payment_token', flat=True)[:50])
+
+    return {
+        'commandes du client': Commande.objects.filter(client__user=client.user_id).order_by('-id')[:50],
+        'commandes du livreur': Commande.objects.filter(livreur__user=livreur.user_id).order_by('-id')[:50],
+        'commandes en cours récentes': Commande.objects.filter(statut='en_cours').order_by('-date_commande')[:50],
+        'livraisons actives du livreur': Commande.objects.filter(livreur=livreur, statut='en_cours_de_livraison'),
+        'livreurs disponibles': Livreur.objects.filter(statut='disponible')[:5],
+        'profil client': Client.objects.filter(user=client.user_id),
+        'paiement de la commande': Paiement.objects.filter(commande=commande),
+        'paiements en attente': Paiement.objects.filter(statut_paiement='en_attente').order_by('-id')[:50],
+        'paiements par token (webhook)': Paiement.objects.filter(payment_token__in=jetons),
+        'produits disponibles par type': Produit.objects.filter(statut='disponible', type_produit='pizza')[:50],
+        'version du catalogue': Produit.objects.order_by('-date_modification').values('date_modification')[:1],
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Mesure la latence et affiche le plan d'exécution des requêtes fréquentes. "
+        "Pour comparer avant/après les index : lancer la commande, revenir à la migration "
+        "0024_evenementstripe, relancer, puis réappliquer les migrations. "
+        f"Avec --generer-commandes : {AIDE_BASE_JETABLE}"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--generer-commandes', type=int, default=0,
+                            help="Crée d'abord ce nombre de commandes (avec clients, livreurs et produits proportionnels).")
+        parser.add_argument('--repetitions', type=int, default=20, help="Nombre d'exécutions de chaque requête.")
+        parser.add_argument('--sans-plan', action='store_true', help="N'affiche pas les plans d'exécution.")
+        parser.add_argument('--base-jetable', action='store_true',
+                            help="Autorise --generer-commandes sur une base distante qui peut recevoir des données fictives.")
+
+    def handle(self, *args, **options):
+        nombre = options['generer_commandes']
+        if nombre:
+            verifier_base_jetable(options['base_jetable'])
+            generer(produits=max(nombre // 100, 20), clients=max(nombre // 10, 10), livreurs=max(nombre // 200, 5),
+                    commandes=nombre, sortie=self.stdout)
+
+        for nom, queryset in requetes_frequentes().items():
+            durees = []
+            for _ in range(options['repetitions']):
+                debut = time.perf_counter()
+                list(queryset.all())
+                durees.append((time.perf_counter() - debut) * 1000)
+            durees.sort()
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f"{nom} : médiane {statistics.median(durees):.2f} ms, "
+                f"p95 {durees[int(0.95 * (len(durees) - 1))]:.2f} ms"))
+            if not options['sans_plan']:
+                self.stdout.write(queryset.explain())
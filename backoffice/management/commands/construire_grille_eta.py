@@ -0,0 +1,113 @@
+import csv
+import heapq
+import json
+import math
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from backoffice.index_livreurs import KM_PAR_DEGRE_LATITUDE, KM_PAR_DEGRE_LONGITUDE, distance_approx_km
+
+
+def lire_graphe(chemin):
+    """
+    Lit un graphe routier CSV (colonnes lat_a, lon_a, lat_b, lon_b, vitesse_kmh et, en option, sens_unique),
+    par exemple exporté d'OpenStreetMap. Renvoie {noeud: [(voisin, secondes), ...]}.
+    """
+    graphe = {}
+    with open(chemin, newline='', encoding='utf-8') as fichier:
+        for ligne in csv.DictReader(fichier):
+            a = (round(float(ligne['lat_a']), 6), round(float(ligne['lon_a']), 6))
+            b = (round(float(ligne['lat_b']), 6), round(float(ligne['lon_b']), 6))
+            secondes = distance_approx_km(*a, *b) / float(ligne['vitesse_kmh']) * 3600
+            graphe.setdefault(a, []).append((b, secondes))
+            graphe.setdefault(b, [])
+            if ligne.get('sens_unique', '0') not in ('1', 'true', 'oui'):
+                graphe[b].append((a, secondes))
+    return graphe
+
+
+def dijkstra(graphe, depart):
+    durees = {depart: 0.0}
+    file = [(0.0, depart)]
+    while file:
+        duree, noeud = heapq.heappop(file)
+        if duree > durees[noeud]:
+            continue
+        for voisin, secondes in graphe[noeud]:
+            nouvelle = duree + secondes
+            if nouvelle < durees.get(voisin, math.inf):
+                durees[voisin] = nouvelle
+                heapq.heappush(file, (nouvelle, voisin))
+    return durees
+
+
+class Command(BaseCommand):
+    help = (
+        "Précalcule les temps de parcours sur le réseau routier depuis le restaurant vers chaque point "
+        "d'une grille, pour le moteur d'ETA 'grille' (ETA_MOTEUR = 'grille', ETA_GRILLE_FICHIER)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('graphe', help="Fichier CSV du graphe routier.")
+        parser.add_argument('sortie', help="Fichier JSON de la grille à écrire.")
+        parser.add_argument('--rayon-km', type=float, default=10, help="Rayon couvert autour du restaurant.")
+        parser.add_argument('--pas', type=float, default=0.005, help="Pas de la grille en degrés.")
+        parser.add_argument('--vitesse-acces', type=float, default=15,
+                            help="Vitesse (km/h) entre un point de la grille et le nœud routier le plus proche.")
+        parser.add_argument('--distance-acces-max', type=float, default=1,
+                            help="Au-delà de cette distance (km) au réseau, le point est considéré inaccessible.")
+
+    def handle(self, *args, **options):
+        graphe = lire_graphe(options['graphe'])
+        if not graphe:
+            raise CommandError("Le graphe est vide.")
+        origine = (settings.RESTAURANT_LATITUDE, settings.RESTAURANT_LONGITUDE)
+        pas, vitesse_acces = options['pas'], options['vitesse_acces']
+
+        # Nœuds regroupés par case de la grille pour trouver rapidement le plus proche d'un point
+        cases = {}
+        for noeud in graphe:
+            cases.setdefault((math.floor(noeud[0] / pas), math.floor(noeud[1] / pas)), []).append(noeud)
+        km_par_case = pas * min(KM_PAR_DEGRE_LATITUDE, KM_PAR_DEGRE_LONGITUDE * math.cos(math.radians(origine[0])))
+        anneaux = math.ceil(options['distance_acces_max'] / km_par_case)
+
+        def plus_proche(latitude, longitude):
+            i, j = math.floor(latitude / pas), math.floor(longitude / pas)
+            candidats = [noeud for di in range(-anneaux, anneaux + 1) for dj in range(-anneaux, anneaux + 1)
+                         for noeud in cases.get((i + di, j + dj), ())]
+            if not candidats:
+                return None, math.inf
+            noeud = min(candidats, key=lambda n: distance_approx_km(latitude, longitude, *n))
+            return noeud, distance_approx_km(latitude, longitude, *noeud)
+
+        depart, distance_depart = plus_proche(*origine)
+        if depart is None or distance_depart > options['distance_acces_max']:
+            raise CommandError("Le restaurant est trop loin du réseau routier fourni.")
+        durees_noeuds = dijkstra(graphe, depart)
+        acces_depart = distance_depart / vitesse_acces * 3600
+
+        rayon_lat = options['rayon_km'] / KM_PAR_DEGRE_LATITUDE
+        rayon_lon = options['rayon_km'] / (KM_PAR_DEGRE_LONGITUDE * math.cos(math.radians(origine[0])))
+        lat_min, lon_min = origine[0] - rayon_lat, origine[1] - rayon_lon
+        lignes, colonnes = math.ceil(2 * rayon_lat / pas) + 1, math.ceil(2 * rayon_lon / pas) + 1
+
+        durees, inaccessibles = [], 0
+        for i in range(lignes):
+            for j in range(colonnes):
+                latitude, longitude = lat_min + i * pas, lon_min + j * pas
+                noeud, distance = plus_proche(latitude, longitude)
+                if noeud is None or distance > options['distance_acces_max'] or noeud not in durees_noeuds:
+                    durees.append(None)
+                    inaccessibles += 1
+                else:
+                    durees.append(round(acces_depart + durees_noeuds[noeud] + distance / vitesse_acces * 3600, 1))
+
+        with open(options['sortie'], 'w', encoding='utf-8') as fichier:
+            json.dump({
+                'origine': origine, 'lat_min': lat_min, 'lon_min': lon_min, 'pas': pas,
+                'lignes': lignes, 'colonnes': colonnes, 'durees': durees,
+                'profil_horaire': getattr(settings, 'ETA_PROFIL_HORAIRE', None),
+            }, fichier)
+        self.stdout.write(self.style.SUCCESS(
+            f"Grille de {lignes} × {colonnes} points écrite ({inaccessibles} inaccessibles, {len(graphe)} nœuds routiers)."))
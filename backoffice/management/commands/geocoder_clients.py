@@ -0,0 +1,55 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from backoffice.geocodage import APIAdresseIndisponible, rechercher_adresse, extraire_coordonnees
+from backoffice.models import Client
+
+
+class Command(BaseCommand):
+    help = (
+        "Renseigne la latitude et la longitude des clients existants à partir de leur adresse. À exécuter lors "
+        "du déploiement, avant la mise en service : sans coordonnées, le départ en livraison d'une commande est refusé."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lot', type=int, default=100, help="Nombre de clients enregistrés par requête.")
+        parser.add_argument('--limite', type=int, default=None, help="Nombre maximum de clients à traiter.")
+        parser.add_argument('--pause', type=float, default=0.0, help="Pause (en secondes) entre deux appels à l'API.")
+
+    def handle(self, *args, **options):
+        clients = (Client.objects
+                   .filter(latitude__isnull=True, adresse__isnull=False)
+                   .exclude(adresse='')
+                   .only('id', 'adresse')
+                   .order_by('id'))
+        if options['limite']:
+            clients = clients[:options['limite']]
+
+        a_enregistrer = []
+        geocodes = introuvables = 0
+        for client in clients.iterator(chunk_size=options['lot']):
+            try:
+                coordonnees = extraire_coordonnees(rechercher_adresse(client.adresse))
+            except APIAdresseIndisponible as erreur:
+                # Les clients déjà géocodés sont enregistrés ; relancer la commande reprendra les suivants
+                Client.objects.bulk_update(a_enregistrer, ['latitude', 'longitude'])
+                raise CommandError(f"{geocodes} client(s) géocodé(s) avant l'interruption : {erreur}")
+            if coordonnees:
+                client.latitude, client.longitude = coordonnees
+                a_enregistrer.append(client)
+                geocodes += 1
+            else:
+                introuvables += 1
+                self.stderr.write(f"Adresse introuvable pour le client {client.id} : {client.adresse}")
+
+            if len(a_enregistrer) >= options['lot']:
+                Client.objects.bulk_update(a_enregistrer, ['latitude', 'longitude'])
+                a_enregistrer = []
+            if options['pause']:
+                time.sleep(options['pause'])
+
+        if a_enregistrer:
+            Client.objects.bulk_update(a_enregistrer, ['latitude', 'longitude'])
+
+        self.stdout.write(self.style.SUCCESS(f"{geocodes} client(s) géocodé(s), {introuvables} adresse(s) introuvable(s)."))
@@ -0,0 +1,38 @@
+import csv
+import gzip
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from backoffice.index_adresses import construire_index
+
+
+def lire_extrait(chemin):
+    """Lignes d'un fichier CSV de la BAN (adresses-77.csv, éventuellement compressé en .gz, séparateur ';')."""
+    ouvrir = gzip.open if chemin.endswith('.gz') else open
+    with ouvrir(chemin, 'rt', newline='', encoding='utf-8') as fichier:
+        yield from csv.DictReader(fichier, delimiter=';')
+
+
+class Command(BaseCommand):
+    help = (
+        "Construit l'index local d'adresses (GEOCODAGE_INDEX_FICHIER) à partir d'extraits CSV de la Base "
+        "Adresse Nationale, téléchargeables sur adresse.data.gouv.fr (un fichier par département)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('sortie', help="Fichier de l'index à écrire.")
+        parser.add_argument('extraits', nargs='+', help="Fichiers CSV de la BAN.")
+
+    def handle(self, *args, **options):
+        for chemin in options['extraits']:
+            if not os.path.exists(chemin):
+                raise CommandError(f"Fichier introuvable : {chemin}")
+        lignes = (ligne for chemin in options['extraits'] for ligne in lire_extrait(chemin))
+        # Écrit à côté puis renommé : les processus qui ont ouvert l'ancien index continuent de le lire
+        temporaire = options['sortie'] + '.tmp'
+        adresses, voies = construire_index(lignes, temporaire)
+        os.replace(temporaire, options['sortie'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Index de {adresses} adresses et {voies} voies écrit dans {options['sortie']} "
+            f"({os.path.getsize(options['sortie']) // 1024} Ko)."))
@@ -0,0 +1,185 @@
+import json
+import random
+import statistics
+import time
+from unittest import mock
+
+import stripe
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from backoffice.geocodage import client_api_adresse
+from backoffice.models import Livreur, Produit
+
+from ._jeu_de_donnees import AIDE_BASE_JETABLE, PREFIXE, generer, verifier_base_jetable
+
+ETAPES = ['inscription', 'connexion', 'client', 'commande', 'lignes', 'paiement', 'verification', 'depart', 'livraison']
+
+
+def _reponse_api_adresse(url, params=None, **kwargs):
+    """Réponse factice de api-adresse.data.gouv.fr : une adresse trouvée autour de Montévrain."""
+    aleatoire = random.Random(params.get('q') if params else url)
+    reponse = mock.Mock(status_code=200)
+    reponse.json.return_value = {'features': [{
+        'geometry': {'coordinates': [2.75 + aleatoire.uniform(-0.05, 0.05), 48.87 + aleatoire.uniform(-0.05, 0.05)]},
+        'properties': {'label': params.get('q') if params else ''},
+    }]}
+    return reponse
+
+
+def _payment_intent(identifiant, **kwargs):
+    """PaymentIntent factice renvoyé à la place des appels à Stripe."""
+    return stripe.PaymentIntent.construct_from(
+        {'id': identifiant, 'client_secret': f'{identifiant}_secret', 'status': 'succeeded'}, 'sk_bench')
+
+
+class Parcours:
+    """Enchaîne les étapes d'une commande via l'API et mesure la durée et le nombre de requêtes SQL de chacune."""
+
+    def __init__(self, produits, graine):
+        self.produits = produits
+        self.aleatoire = random.Random(graine)
+        self.api = APIClient()
+        self.durees = {etape: [] for etape in ETAPES}
+        self.requetes = {etape: [] for etape in ETAPES}
+
+    def appeler(self, etape, methode, url, donnees=None, attendu=200, api=None):
+        api = api or self.api
+        with CaptureQueriesContext(connection) as requetes:
+            debut = time.perf_counter()
+            reponse = getattr(api, methode)(url, donnees, format='json')
+            duree = time.perf_counter() - debut
+        self.durees[etape].append(duree * 1000)
+        self.requetes[etape].append(len(requetes))
+        if reponse.status_code != attendu:
+            raise CommandError(f"Étape '{etape}' : réponse {reponse.status_code} au lieu de {attendu} ({reponse.content[:300]!r})")
+        return reponse.json() if reponse.content else None
+
+    def executer(self, numero):
+        identifiant = f'{PREFIXE}_parcours_{time.time_ns()}_{numero}'
+        self.api.credentials()
+        self.appeler('inscription', 'post', '/inscription/', {
+            'username': identifiant, 'email': f'{identifiant}@example.com', 'password': 'bench'}, attendu=201)
+        token = self.appeler('connexion', 'post', '/connexion/', {'username': identifiant, 'password': 'bench'})['token']
+        self.api.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+
+        self.appeler('client', 'post', '/clients/', {
+            'adresse': f'{self.aleatoire.randint(1, 200)} Avenue de Paris 77144 Montévrain',
+            'telephone': '+33600000000'}, attendu=201)
+        commande = self.appeler('commande', 'post', '/commandes/', {}, attendu=201)
+        lignes = self.aleatoire.sample(self.produits, k=min(len(self.produits), self.aleatoire.randint(1, 4)))
+        self.appeler('lignes', 'post', '/commande_produits/lot/', {
+            'commande': commande['id'],
+            'lignes': [{'produit': produit, 'quantite': self.aleatoire.randint(1, 3)} for produit in lignes]}, attendu=201)
+
+        self.appeler('paiement', 'post', f"/createpaiement/{commande['id']}/create_payment_intent/", attendu=201)
+        self.appeler('verification', 'post', f"/createpaiement/{commande['id']}/verify_payment/")
+
+        # Le livreur réservé pour la commande la prend en charge puis la livre
+        livreur = Livreur.objects.select_related('user').get(commande__pk=commande['id'])
+        api_livreur = APIClient()
+        api_livreur.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.get_or_create(user=livreur.user)[0].key}')
+        url = f"/commandes/{commande['id']}/"
+        self.appeler('depart', 'patch', url, {'statut': 'en_cours_de_livraison'}, api=api_livreur)
+        self.appeler('livraison', 'patch', url, {'statut': 'livree'}, api=api_livreur)
+
+    def resultats(self, duree_totale):
+        resultats = {}
+        for etape in ETAPES:
+            durees = sorted(self.durees[etape])
+            if not durees:
+                continue
+            resultats[etape] = {
+                'nombre': len(durees),
+                'debit': len(durees) / (sum(durees) / 1000),
+                'mediane_ms': statistics.median(durees),
+                'p95_ms': durees[int(0.95 * (len(durees) - 1))],
+                'requetes_max': max(self.requetes[etape]),
+                'requetes_moyenne': statistics.mean(self.requetes[etape]),
+            }
+        resultats['parcours'] = {'nombre': len(self.durees['livraison']),
+                                 'debit': len(self.durees['livraison']) / duree_totale}
+        return resultats
+
+
+class Command(BaseCommand):
+    help = (
+        "Mesure le parcours complet d'une commande via l'API (inscription, client, commande, lignes, paiement, "
+        "livraison) avec Stripe et l'API adresse simulés, et affiche débit, latence p95 et requêtes SQL par étape. "
+        f"{AIDE_BASE_JETABLE} "
+        "Volumes réalistes : --produits 10000 --clients 100000 --commandes 1000000."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--produits', type=int, default=0, help="Produits à créer avant la mesure.")
+        parser.add_argument('--clients', type=int, default=0, help="Clients à créer avant la mesure.")
+        parser.add_argument('--livreurs', type=int, default=0, help="Livreurs à créer avant la mesure.")
+        parser.add_argument('--commandes', type=int, default=0, help="Commandes historiques à créer avant la mesure.")
+        parser.add_argument('--parcours', type=int, default=100, help="Nombre de parcours de commande mesurés.")
+        parser.add_argument('--graine', type=int, default=0)
+        parser.add_argument('--sortie', help="Écrit les résultats dans ce fichier JSON.")
+        parser.add_argument('--reference', help="Fichier JSON d'une mesure précédente : échoue en cas de régression.")
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help="Hausse de latence p95 tolérée par rapport à la référence (0.25 = 25 %%).")
+        parser.add_argument('--base-jetable', action='store_true',
+                            help="Autorise l'écriture dans une base distante qui peut recevoir des données fictives.")
+
+    def handle(self, *args, **options):
+        verifier_base_jetable(options['base_jetable'])
+        generer(produits=options['produits'], clients=options['clients'], livreurs=options['livreurs'],
+                commandes=options['commandes'], graine=options['graine'], sortie=self.stdout)
+
+        produits = list(Produit.objects.filter(statut='disponible').values_list('id', flat=True)[:1000])
+        if not produits:
+            raise CommandError("Aucun produit disponible : utilisez --produits pour en créer.")
+        if not Livreur.objects.filter(statut='disponible').exists():
+            raise CommandError("Aucun livreur disponible : utilisez --livreurs pour en créer.")
+
+        parcours = Parcours(produits, options['graine'])
+        reglages = override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'], STRIPE_WEBHOOK_SECRET=None)
+        with reglages, \
+                mock.patch.object(client_api_adresse().session, 'get', side_effect=_reponse_api_adresse), \
+                mock.patch.object(stripe.PaymentIntent, 'create',
+                                  side_effect=lambda **kwargs: _payment_intent(f"pi_{PREFIXE}_{time.time_ns()}")), \
+                mock.patch.object(stripe.PaymentIntent, 'retrieve', side_effect=_payment_intent):
+            debut = time.perf_counter()
+            for numero in range(options['parcours']):
+                parcours.executer(numero)
+            resultats = parcours.resultats(time.perf_counter() - debut)
+
+        self.afficher(resultats)
+        if options['sortie']:
+            with open(options['sortie'], 'w', encoding='utf-8') as fichier:
+                json.dump(resultats, fichier, indent=2)
+        if options['reference']:
+            self.comparer(resultats, options['reference'], options['tolerance'])
+
+    def afficher(self, resultats):
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"{'étape':<14}{'req/s':>10}{'médiane ms':>12}{'p95 ms':>10}{'SQL moy.':>10}{'SQL max':>9}"))
+        for etape in ETAPES:
+            if etape in resultats:
+                r = resultats[etape]
+                self.stdout.write(f"{etape:<14}{r['debit']:>10.1f}{r['mediane_ms']:>12.2f}{r['p95_ms']:>10.2f}"
+                                  f"{r['requetes_moyenne']:>10.1f}{r['requetes_max']:>9}")
+        self.stdout.write(f"{resultats['parcours']['nombre']} parcours, {resultats['parcours']['debit']:.1f} parcours/s")
+
+    def comparer(self, resultats, chemin, tolerance):
+        with open(chemin, encoding='utf-8') as fichier:
+            reference = json.load(fichier)
+        regressions = []
+        for etape in ETAPES:
+            if etape not in resultats or etape not in reference:
+                continue
+            actuel, avant = resultats[etape], reference[etape]
+            if actuel['requetes_max'] > avant['requetes_max']:
+                regressions.append(f"{etape} : {avant['requetes_max']} → {actuel['requetes_max']} requêtes SQL")
+            if actuel['p95_ms'] > avant['p95_ms'] * (1 + tolerance):
+                regressions.append(f"{etape} : p95 {avant['p95_ms']:.2f} → {actuel['p95_ms']:.2f} ms")
+        if regressions:
+            raise CommandError("Régressions par rapport à la référence :\n" + "\n".join(regressions))
+        self.stdout.write(self.style.SUCCESS("Aucune régression par rapport à la référence."))
@@ -0,0 +1,58 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from backoffice.taches import executer_lot, purger_taches, reprendre_taches_bloquees, reserver
+
+
+class Command(BaseCommand):
+    help = (
+        "Exécute les tâches de fond enregistrées en base (variantes d'images, suppression de fichiers, "
+        "géocodage différé, événements Stripe). Plusieurs travailleurs peuvent tourner en parallèle."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', action='append', dest='files',
+                            help="File à traiter (option répétable ; toutes les files par défaut).")
+        parser.add_argument('--lot', type=int, default=10, help="Nombre de tâches réservées à la fois.")
+        parser.add_argument('--pause', type=float, default=1.0, help="Attente (secondes) lorsque la file est vide.")
+        parser.add_argument('--une-fois', action='store_true',
+                            help="S'arrête dès qu'il n'y a plus de tâche prête au lieu d'attendre les suivantes.")
+
+    def handle(self, *args, **options):
+        self.arret = False
+        # La tâche en cours se termine avant l'arrêt
+        precedents = {numero: signal.signal(numero, self.arreter) for numero in (signal.SIGTERM, signal.SIGINT)}
+        try:
+            reussies, echouees = self.boucle(options)
+        finally:
+            for numero, gestionnaire in precedents.items():
+                signal.signal(numero, gestionnaire)
+        self.stdout.write(self.style.SUCCESS(f"{reussies} tâche(s) exécutée(s), {echouees} échec(s)."))
+
+    def boucle(self, options):
+        reussies = echouees = 0
+        derniere_purge = None
+        while not self.arret:
+            if derniere_purge is None or time.monotonic() - derniere_purge > 3600:
+                purger_taches()
+                derniere_purge = time.monotonic()
+            reprendre_taches_bloquees()
+
+            taches = reserver(options['files'], options['lot'])
+            # Les tâches groupables réservées ensemble (événements Stripe) sont appliquées en un seul appel
+            lot_reussies, lot_echouees = executer_lot(taches)
+            reussies += lot_reussies
+            echouees += lot_echouees
+            if not taches:
+                if options['une_fois']:
+                    break
+                time.sleep(options['pause'])
+                # La connexion a pu expirer (CONN_MAX_AGE) ou être coupée pendant l'attente
+                close_old_connections()
+        return reussies, echouees
+
+    def arreter(self, *args):
+        self.arret = True
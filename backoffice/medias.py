@@ -0,0 +1,105 @@
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+
+# Fichiers dont le nom contient l'empreinte du contenu (voir models.chemin_image_produit) : jamais modifiés
+NOM_EMPREINTE = re.compile(r'_[0-9a-f]{12}(_\d+)?\.\w+$')
+TAILLE_BLOC = 64 * 1024
+
+
+def _plage(entete, taille):
+    """Renvoie (début, fin incluse) pour un en-tête Range à une seule plage, None s'il est ignoré, False s'il est invalide."""
+    correspondance = re.fullmatch(r'bytes=(\d*)-(\d*)', entete.strip())
+    if not correspondance or correspondance.groups() == ('', ''):
+        # Plusieurs plages ou syntaxe inconnue : le fichier complet est envoyé
+        return None
+    debut, fin = correspondance.groups()
+    if debut == '':
+        debut, fin = max(taille - int(fin), 0), taille - 1
+    else:
+        debut, fin = int(debut), min(int(fin), taille - 1) if fin else taille - 1
+    if debut >= taille or debut > fin:
+        return False
+    return debut, fin
+
+
+def _lire(chemin, debut, longueur):
+    with open(chemin, 'rb') as fichier:
+        fichier.seek(debut)
+        while longueur > 0:
+            bloc = fichier.read(min(TAILLE_BLOC, longueur))
+            if not bloc:
+                break
+            longueur -= len(bloc)
+            yield bloc
+
+
+@require_safe
+def servir_media(request, chemin):
+    """
+    Sert un fichier de MEDIA_ROOT. Avec MEDIA_SENDFILE, l'envoi est délégué au serveur frontal
+    (X-Sendfile pour Apache/lighttpd, X-Accel-Redirect pour nginx) ; sinon FileResponse laisse le
+    serveur WSGI utiliser sendfile. Gère les requêtes conditionnelles et les plages d'octets.
+    """
+    try:
+        chemin_absolu = safe_join(settings.MEDIA_ROOT, chemin)
+        statistiques = os.stat(chemin_absolu)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404("Fichier introuvable.")
+    if not os.path.isfile(chemin_absolu):
+        raise Http404("Fichier introuvable.")
+
+    taille = statistiques.st_size
+    etag = f'"{int(statistiques.st_mtime_ns):x}-{taille:x}"'
+    immuable = bool(NOM_EMPREINTE.search(chemin))
+    if immuable:
+        cache_control = 'public, max-age=31536000, immutable'
+    else:
+        cache_control = f"public, max-age={getattr(settings, 'MEDIA_CACHE_MAX_AGE', 3600)}"
+
+    response = get_conditional_response(request, etag=etag, last_modified=int(statistiques.st_mtime))
+    if response is None:
+        response = _reponse_fichier(request, chemin, chemin_absolu, taille, etag)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(statistiques.st_mtime)
+    response['Cache-Control'] = cache_control
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def _reponse_fichier(request, chemin, chemin_absolu, taille, etag):
+    type_contenu = mimetypes.guess_type(chemin_absolu)[0] or 'application/octet-stream'
+
+    mode = getattr(settings, 'MEDIA_SENDFILE', None)
+    if mode == 'x-accel-redirect':
+        # nginx sert lui-même le fichier (plages comprises) depuis un emplacement "internal"
+        response = HttpResponse(content_type=type_contenu)
+        response['X-Accel-Redirect'] = getattr(settings, 'MEDIA_ACCEL_PREFIX', '/media-interne/') + chemin
+        return response
+    if mode == 'x-sendfile':
+        response = HttpResponse(content_type=type_contenu)
+        response['X-Sendfile'] = chemin_absolu
+        return response
+
+    plage = None
+    if 'HTTP_RANGE' in request.META and request.META.get('HTTP_IF_RANGE', etag) == etag:
+        plage = _plage(request.META['HTTP_RANGE'], taille)
+    if plage is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{taille}'
+        return response
+    if plage:
+        debut, fin = plage
+        response = StreamingHttpResponse(_lire(chemin_absolu, debut, fin - debut + 1), status=206, content_type=type_contenu)
+        response['Content-Range'] = f'bytes {debut}-{fin}/{taille}'
+        response['Content-Length'] = str(fin - debut + 1)
+        return response
+    return FileResponse(open(chemin_absolu, 'rb'), content_type=type_contenu)
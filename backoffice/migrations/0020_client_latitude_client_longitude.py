@@ -0,0 +1,23 @@
+# Generated by Django 5.0.6 on 2026-10-17 17:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backoffice', '0019_alter_produit_date_creation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='client',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='client',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.0.6 on 2026-10-17 17:30
+
+from django.db import migrations, models
+
+
+def convertir_positions(apps, schema_editor):
+    # Reprend les positions texte "latitude,longitude" existantes dans les nouveaux champs numériques
+    Livreur = apps.get_model("backoffice", "Livreur")
+    a_enregistrer = []
+    for livreur in Livreur.objects.exclude(position_geo__isnull=True).exclude(position_geo=""):
+        try:
+            latitude, longitude = (float(valeur) for valeur in livreur.position_geo.replace(";", ",").split(","))
+        except ValueError:
+            continue
+        livreur.latitude, livreur.longitude = latitude, longitude
+        a_enregistrer.append(livreur)
+    Livreur.objects.bulk_update(a_enregistrer, ["latitude", "longitude"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("backoffice", "0020_client_latitude_client_longitude"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="livreur",
+            name="latitude",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="livreur",
+            name="longitude",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.RunPython(convertir_positions, migrations.RunPython.noop),
+    ]
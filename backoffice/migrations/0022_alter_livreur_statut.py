@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-17 17:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backoffice', '0021_livreur_latitude_livreur_longitude'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='livreur',
+            name='statut',
+            field=models.CharField(blank=True, choices=[('disponible', 'disponible'), ('reserve', 'Réservé'), ('en_cours_de_livraison', 'En cours de livraison'), ('indisponible', 'indisponible')], max_length=50, null=True),
+        ),
+    ]
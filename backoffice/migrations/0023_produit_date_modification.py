@@ -0,0 +1,23 @@
+# Generated by Django 5.0.6 on 2026-10-17 18:05
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("backoffice", "0022_alter_livreur_statut"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="produit",
+            name="date_modification",
+            field=models.DateTimeField(
+                auto_now=True,
+                default=django.utils.timezone.now,
+                verbose_name="Date de Modification",
+            ),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.0.6 on 2026-10-17 17:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backoffice', '0023_produit_date_modification'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EvenementStripe',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('identifiant', models.CharField(max_length=255, unique=True)),
+                ('type', models.CharField(max_length=100)),
+                ('date_reception', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
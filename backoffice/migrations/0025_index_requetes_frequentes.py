@@ -0,0 +1,45 @@
+# Generated by Django 5.0.6 on 2026-10-17 17:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backoffice', '0024_evenementstripe'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='commande',
+            index=models.Index(fields=['statut', 'date_commande'], name='commande_statut_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='commande',
+            index=models.Index(fields=['livreur', 'statut'], name='commande_livreur_statut_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='commandeproduit',
+            index=models.Index(fields=['commande', 'produit'], name='commandeproduit_cmd_prod_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='livreur',
+            index=models.Index(fields=['statut'], name='livreur_statut_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='paiement',
+            index=models.Index(fields=['statut_paiement'], name='paiement_statut_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='paiement',
+            index=models.Index(fields=['payment_token'], name='paiement_token_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='produit',
+            index=models.Index(fields=['statut', 'type_produit'], name='produit_statut_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='produit',
+            index=models.Index(fields=['date_modification'], name='produit_date_modif_idx'),
+        ),
+    ]
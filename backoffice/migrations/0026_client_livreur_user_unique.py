@@ -0,0 +1,46 @@
+# Generated by Django 5.0.6 on 2026-10-17 17:25
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fusionner_profils_en_double(apps, schema_editor):
+    # Un utilisateur avec plusieurs profils client ou livreur empêcherait la contrainte d'unicité : on garde
+    # le plus ancien et on lui rattache les commandes des autres avant de les supprimer
+    Commande = apps.get_model('backoffice', 'Commande')
+    for nom_modele, champ in (('Client', 'client'), ('Livreur', 'livreur')):
+        modele = apps.get_model('backoffice', nom_modele)
+        en_double = list(modele.objects.filter(user__isnull=False).values('user')
+                         .annotate(nombre=models.Count('id')).filter(nombre__gt=1).values_list('user', flat=True))
+        for user_id in en_double:
+            garde, *autres = modele.objects.filter(user_id=user_id).order_by('id').values_list('id', flat=True)
+            Commande.objects.filter(**{f'{champ}_id__in': autres}).update(**{f'{champ}_id': garde})
+            modele.objects.filter(id__in=autres).delete()
+
+
+class Migration(migrations.Migration):
+    # La fusion des profils est validée dans sa propre transaction avant les AlterField : l'index unique
+    # ne peut être créé que sur des données déjà dédoublonnées. Sous MySQL, le DDL n'est pas transactionnel
+    # (chaque ALTER TABLE valide implicitement la transaction en cours) : on ne prétend donc pas à une
+    # migration atomique, et un échec de l'AlterField laisse une fusion complète, relançable sans effet.
+    atomic = False
+
+    dependencies = [
+        ('backoffice', '0025_index_requetes_frequentes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(fusionner_profils_en_double, migrations.RunPython.noop, atomic=True),
+        migrations.AlterField(
+            model_name='client',
+            name='user',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='livreur',
+            name='user',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+    ]
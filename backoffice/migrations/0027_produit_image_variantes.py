@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-17 17:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backoffice', '0026_client_livreur_user_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='produit',
+            name='image_variantes',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.0.6 on 2026-10-17 17:40
+
+import backoffice.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backoffice', '0027_produit_image_variantes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='produit',
+            name='image',
+            field=models.ImageField(blank=True, null=True, upload_to=backoffice.models.chemin_image_produit),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.0.6 on 2026-10-17 17:45
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backoffice', '0028_produit_image_empreinte'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nom', models.CharField(max_length=100)),
+                ('file', models.CharField(default='defaut', max_length=50)),
+                ('arguments', models.JSONField(blank=True, default=dict)),
+                ('cle_idempotence', models.CharField(blank=True, max_length=255, null=True, unique=True)),
+                ('statut', models.CharField(choices=[('en_attente', 'En attente'), ('en_cours', 'En cours'), ('terminee', 'Terminée'), ('echouee', 'Échouée')], default='en_attente', max_length=20)),
+                ('tentatives', models.PositiveIntegerField(default=0)),
+                ('tentatives_max', models.PositiveIntegerField(default=5)),
+                ('executer_apres', models.DateTimeField(default=django.utils.timezone.now)),
+                ('date_creation', models.DateTimeField(auto_now_add=True)),
+                ('date_debut', models.DateTimeField(blank=True, null=True)),
+                ('date_fin', models.DateTimeField(blank=True, null=True)),
+                ('derniere_erreur', models.TextField(blank=True, default='')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['statut', 'file', 'executer_apres'], name='tache_statut_file_date_idx')],
+            },
+        ),
+    ]
@@ -1,17 +1,19 @@
 import datetime
+import hashlib
+import os
 from django.db import models
+from django.utils import timezone
 from django.conf import settings
-from django.db.models.signals import post_delete
-from django.dispatch import receiver
-from django.core.files.storage import default_storage
 from django.core.validators import RegexValidator
 
 class Client(models.Model):
-    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True)
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True)
     # nom = models.CharField(max_length=100, blank=True, null=True)
     # prenom = models.CharField(max_length=100, blank=True, null=True)
     # email = models.CharField(max_length=100, blank=True, null=True)
     adresse = models.CharField(max_length=255, blank=True, null=True)
+    latitude = models.FloatField(blank=True, null=True)
+    longitude = models.FloatField(blank=True, null=True)
     telephone = models.CharField(max_length=20, blank=True, null=True, validators=[
             RegexValidator(
                 regex='^\\+?1?\\d{9,15}$',  # Exemple de regex pour valider un numéro international
@@ -22,35 +24,75 @@ class Client(models.Model):
     def __str__(self):
         return f"{self.user}"
         # return f"{self.nom} {self.prenom}"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        client = super().from_db(db, field_names, values)
+        if {'adresse', 'latitude', 'longitude'} <= set(field_names):
+            client._adresse_enregistree = (client.adresse, client.latitude, client.longitude)
+        return client
+
+    def save(self, *args, **kwargs):
+        # Les coordonnées de l'ancienne adresse ne sont plus valables si l'adresse change sans qu'elles soient
+        # renseignées en même temps (administration, script) : geocodage.geocoder_nouvelle_adresse les recalcule.
+        # Les mises à jour par QuerySet.update() ne passent pas par ici.
+        adresse, latitude, longitude = getattr(self, '_adresse_enregistree', (self.adresse, None, None))
+        if self.adresse != adresse and (self.latitude, self.longitude) == (latitude, longitude):
+            self.latitude = self.longitude = None
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'latitude', 'longitude'}
+        super().save(*args, **kwargs)
+        self._adresse_enregistree = (self.adresse, self.latitude, self.longitude)
     
 class Livreur(models.Model):
     # nom = models.CharField(max_length=100, blank=True, null=True)
-    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True)
-    statut = models.CharField(max_length=50, choices=[('disponible', 'disponible'), ('en_cours_de_livraison', 'En cours de livraison'), ('indisponible', 'indisponible')], blank=True, null=True)
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True)
+    statut = models.CharField(max_length=50, choices=[('disponible', 'disponible'), ('reserve', 'Réservé'), ('en_cours_de_livraison', 'En cours de livraison'), ('indisponible', 'indisponible')], blank=True, null=True)
     position_geo = models.CharField(max_length=255, blank=True, null=True)
+    latitude = models.FloatField(blank=True, null=True)
+    longitude = models.FloatField(blank=True, null=True)
 
     def __str__(self):
         return f"{self.user}"
         # return self.nom
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['statut'], name='livreur_statut_idx'),
+        ]
     
 
+def chemin_image_produit(instance, filename):
+    """
+    Nom de fichier contenant l'empreinte du contenu (produits/pizza_3f2a9c1b7d4e.jpg) : une nouvelle image
+    a toujours un nouveau nom, ce qui permet de servir les images avec Cache-Control: immutable.
+    """
+    sha = hashlib.sha256()
+    for bloc in instance.image.chunks():
+        sha.update(bloc)
+    racine, extension = os.path.splitext(os.path.basename(filename))
+    return f'produits/{racine}_{sha.hexdigest()[:12]}{extension.lower()}'
+
 class Produit(models.Model):
     nom_produit = models.CharField(max_length=100, blank=True, null=True)
     description = models.TextField(blank=True, null=True)
     prix = models.DecimalField(max_digits=5, decimal_places=2, blank=True, null=True, default=0)
     type_produit = models.CharField(max_length=255, choices=[('plat', 'Plat'), ('dessert', 'Dessert'),('boissons', 'Boissons'),('pizza', 'Pizza')], default='plat', blank=True, null=True)
-    image = models.ImageField(upload_to='produits/', blank=True, null=True)
+    image = models.ImageField(upload_to=chemin_image_produit, blank=True, null=True)
+    # Versions redimensionnées de l'image (voir images.py) : {'source': ..., 'formats': {format: {largeur: fichier}}}
+    image_variantes = models.JSONField(default=dict, blank=True, editable=False)
     statut = models.CharField(max_length=20, choices=[('disponible', 'Disponible'), ('indisponible', 'Indisponible'),], default='disponible')
     date_creation = models.DateTimeField(auto_now_add=True, verbose_name="Date de Création")
+    date_modification = models.DateTimeField(auto_now=True, verbose_name="Date de Modification")
 
     def __str__(self):
         return self.nom_produit
 
-@receiver(post_delete, sender=Produit)
-def submission_delete(sender, instance, **kwargs):
-    # Supprime le fichier après la suppression de l'instance du modèle
-    if instance.image:
-        default_storage.delete(instance.image.path)
+    class Meta:
+        indexes = [
+            models.Index(fields=['statut', 'type_produit'], name='produit_statut_type_idx'),
+            models.Index(fields=['date_modification'], name='produit_date_modif_idx'),
+        ]
 
 class Commande(models.Model):
     client = models.ForeignKey(Client, on_delete=models.SET_NULL, null=True, blank=True)
@@ -64,6 +106,12 @@ class Commande(models.Model):
     def __str__(self):
         return f"Commande {self.id} - {self.statut}"
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['statut', 'date_commande'], name='commande_statut_date_idx'),
+            models.Index(fields=['livreur', 'statut'], name='commande_livreur_statut_idx'),
+        ]
+
 class CommandeProduit(models.Model):
     commande = models.ForeignKey(Commande, on_delete=models.CASCADE)
     produit = models.ForeignKey('Produit', on_delete=models.CASCADE)
@@ -72,6 +120,11 @@ class CommandeProduit(models.Model):
     def __str__(self):
         return f"{self.produit.nom_produit} x {self.quantite}"
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['commande', 'produit'], name='commandeproduit_cmd_prod_idx'),
+        ]
+
 class Paiement(models.Model):
     commande = models.ForeignKey(Commande, on_delete=models.SET_NULL, null=True, blank=True)
     montant = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
@@ -82,3 +135,42 @@ class Paiement(models.Model):
 
     def __str__(self):
         return f"Paiement {self.id} - {self.statut_paiement}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['statut_paiement'], name='paiement_statut_idx'),
+            models.Index(fields=['payment_token'], name='paiement_token_idx'),
+        ]
+
+class EvenementStripe(models.Model):
+    """Événement reçu par le webhook Stripe, conservé pour ne traiter chaque événement qu'une seule fois."""
+    identifiant = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=100)
+    date_reception = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.type} - {self.identifiant}"
+
+class Tache(models.Model):
+    """Tâche de fond enregistrée en base et exécutée par la commande travailleur_taches (voir taches.py)."""
+    nom = models.CharField(max_length=100)
+    file = models.CharField(max_length=50, default='defaut')
+    arguments = models.JSONField(default=dict, blank=True)
+    # Une seule tâche par clé : enfiler deux fois la même opération ne l'exécute qu'une fois
+    cle_idempotence = models.CharField(max_length=255, unique=True, blank=True, null=True)
+    statut = models.CharField(max_length=20, choices=[('en_attente', 'En attente'), ('en_cours', 'En cours'), ('terminee', 'Terminée'), ('echouee', 'Échouée')], default='en_attente')
+    tentatives = models.PositiveIntegerField(default=0)
+    tentatives_max = models.PositiveIntegerField(default=5)
+    executer_apres = models.DateTimeField(default=timezone.now)
+    date_creation = models.DateTimeField(auto_now_add=True)
+    date_debut = models.DateTimeField(blank=True, null=True)
+    date_fin = models.DateTimeField(blank=True, null=True)
+    derniere_erreur = models.TextField(blank=True, default='')
+
+    def __str__(self):
+        return f"{self.nom} {self.id} - {self.statut}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['statut', 'file', 'executer_apres'], name='tache_statut_file_date_idx'),
+        ]
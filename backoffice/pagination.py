@@ -0,0 +1,12 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class PaginationCurseur(CursorPagination):
+    """
+    Pagination par curseur sur une clé stable et indexée (l'identifiant, du plus récent au plus ancien).
+    Le temps de réponse ne dépend pas de la profondeur de la page, contrairement à OFFSET.
+    """
+    ordering = '-id'
+    page_size_query_param = 'taille'
+    max_page_size = getattr(settings, 'PAGINATION_TAILLE_MAX', 200)
@@ -0,0 +1,136 @@
+import asyncio
+import weakref
+
+import stripe
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from rest_framework.exceptions import APIException
+
+from .authentication import authentifier
+from .evenements import publier_commande
+from .instrumentation import mesurer
+from .models import Commande, Paiement
+from .webhooks import evenements_en_retard
+
+# Un client par boucle d'événements : le pool httpx est lié à la boucle qui l'a créé. Sous WSGI, chaque
+# appel d'une vue asynchrone tourne dans une nouvelle boucle ; le client disparaît avec elle.
+_clients_stripe = weakref.WeakKeyDictionary()
+
+
+def client_stripe():
+    """
+    Client Stripe asynchrone de la boucle d'événements en cours : les connexions HTTP vers Stripe
+    sont gardées ouvertes (pool httpx) et réutilisées d'un paiement à l'autre dans cette boucle.
+    """
+    boucle = asyncio.get_running_loop()
+    client = _clients_stripe.get(boucle)
+    if client is None:
+        adresses = {'api': settings.STRIPE_API_BASE} if getattr(settings, 'STRIPE_API_BASE', None) else {}
+        client = _clients_stripe[boucle] = stripe.StripeClient(
+            settings.STRIPE_SECRET_KEY,
+            http_client=stripe.HTTPXClient(timeout=getattr(settings, 'STRIPE_TIMEOUT', 10)),
+            base_addresses=adresses,
+        )
+    return client
+
+
+async def _commande_autorisee(request, pk):
+    """Renvoie (commande, None) si l'utilisateur peut payer la commande, sinon (None, réponse d'erreur)."""
+    try:
+        user = await sync_to_async(authentifier)(request)
+    except APIException as e:
+        return None, JsonResponse({'detail': str(e.detail)}, status=e.status_code)
+    if not user.is_authenticated:
+        return None, JsonResponse({'detail': "Informations d'authentification non fournies."}, status=401)
+
+    try:
+        commande = await Commande.objects.select_related('client__user', 'livreur').aget(pk=pk)
+    except Commande.DoesNotExist:
+        return None, JsonResponse({'detail': "Aucune commande ne correspond à l'identifiant fourni."}, status=404)
+    if not commande.client or not commande.livreur:
+        return None, JsonResponse({'detail': "La commande est incomplète et ne peut être traitée."}, status=404)
+    if not (user == commande.client.user or user.is_staff):
+        return None, JsonResponse({'error': "Permission denied."}, status=403)
+    return commande, None
+
+
+@csrf_exempt
+@require_POST
+async def create_payment_intent_async(request, pk):
+    """Version asynchrone de CommandePaiementViewSet.create_payment_intent."""
+    commande, erreur = await _commande_autorisee(request, pk)
+    if erreur:
+        return erreur
+
+    paiement, created = await Paiement.objects.aget_or_create(
+        commande=commande,
+        defaults={'montant': commande.montant_total + commande.frais_livraison}
+    )
+    if not created and paiement.statut_paiement == 'payee':
+        return JsonResponse({'error': "Paiement déjà effectué."}, status=400)
+
+    # Calcul du montant à charger (centimes)
+    amount = int((commande.montant_total + commande.frais_livraison) * 100)
+
+    try:
+        with mesurer('externe'):
+            intent = await client_stripe().payment_intents.create_async(params={
+                'amount': amount,
+                'currency': 'eur',
+                'metadata': {'commande_id': commande.id},
+            })
+    except stripe.StripeError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    paiement.payment_token = intent.id
+    paiement.methode_paiement = 'stripe'
+    paiement.statut_paiement = 'en_attente'
+    await paiement.asave()
+
+    return JsonResponse({'client_secret': intent['client_secret']}, status=201)
+
+
+@csrf_exempt
+@require_POST
+async def verify_payment_async(request, pk):
+    """Version asynchrone de CommandePaiementViewSet.verify_payment."""
+    commande, erreur = await _commande_autorisee(request, pk)
+    if erreur:
+        return erreur
+
+    try:
+        paiement = await Paiement.objects.aget(commande=commande)
+    except Paiement.DoesNotExist:
+        return JsonResponse({'error': 'Paiement non trouvé pour cette commande.'}, status=404)
+
+    if paiement.statut_paiement == 'payee':
+        if settings.STRIPE_WEBHOOK_SECRET:
+            # Paiement confirmé par le webhook Stripe
+            return JsonResponse({'status': 'success', 'message': 'Paiement vérifié et commande mise à jour.'})
+        return JsonResponse({'error': 'Paiement déjà vérifié.'}, status=400)
+    if not paiement.payment_token:
+        return JsonResponse({'error': 'Aucun token de paiement associé à cette commande.'}, status=404)
+
+    if settings.STRIPE_WEBHOOK_SECRET and not await evenements_en_retard().aexists():
+        # Le statut est mis à jour par le webhook : pas d'appel à Stripe ici
+        if paiement.statut_paiement == 'annule':
+            return JsonResponse({'status': 'failed', 'message': 'Paiement non réussi.'})
+        return JsonResponse({'status': 'pending', 'message': 'Paiement en attente de confirmation.'})
+
+    try:
+        with mesurer('externe'):
+            intent = await client_stripe().payment_intents.retrieve_async(paiement.payment_token)
+    except stripe.StripeError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    if intent.status == 'succeeded':
+        paiement.statut_paiement = 'payee'
+        commande.statut = 'prise_en_charge'
+        await paiement.asave()
+        await commande.asave()
+        await sync_to_async(publier_commande)(commande)
+        return JsonResponse({'status': 'success', 'message': 'Paiement vérifié et commande mise à jour.'})
+    return JsonResponse({'status': 'failed', 'message': 'Paiement non réussi.'})
@@ -0,0 +1,139 @@
+import atexit
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from rest_framework.exceptions import APIException
+
+from .authentication import authentifier
+from .cache_local import CacheLRU
+from .index_livreurs import index_livreurs
+from .models import Livreur
+from .profils import livreur_de
+
+logger = logging.getLogger(__name__)
+
+
+class TamponPositions:
+    """
+    Dernière position connue de chaque livreur, gardée en mémoire et écrite en base périodiquement :
+    les positions reçues entre deux écritures sont regroupées en un bulk_update par lot.
+    """
+
+    def __init__(self):
+        self._positions = {}
+        self._verrou = threading.Lock()
+        self._thread = None
+
+    def enregistrer(self, livreur_id, latitude, longitude):
+        with self._verrou:
+            self._positions[livreur_id] = (latitude, longitude)
+            en_attente = len(self._positions)
+        # La recherche du livreur le plus proche utilise tout de suite la nouvelle position
+        index_livreurs.deplacer(livreur_id, latitude, longitude)
+        self._demarrer()
+        if en_attente >= getattr(settings, 'POSITIONS_TAILLE_LOT', 1000):
+            self.ecrire()
+
+    def ecrire(self):
+        """Écrit en base les positions en attente. Renvoie le nombre de livreurs mis à jour."""
+        with self._verrou:
+            positions, self._positions = self._positions, {}
+        if not positions:
+            return 0
+        try:
+            Livreur.objects.bulk_update(
+                [Livreur(pk=livreur_id, latitude=latitude, longitude=longitude, position_geo=f'{latitude},{longitude}')
+                 for livreur_id, (latitude, longitude) in positions.items()],
+                ['latitude', 'longitude', 'position_geo'],
+                batch_size=getattr(settings, 'POSITIONS_TAILLE_LOT', 1000),
+            )
+        except Exception:
+            # Lot remis en attente pour la prochaine écriture, sans écraser les positions reçues entre-temps
+            with self._verrou:
+                self._positions = {**positions, **self._positions}
+            raise
+        return len(positions)
+
+    def _demarrer(self):
+        intervalle = getattr(settings, 'POSITIONS_INTERVALLE_ECRITURE', 5)
+        if self._thread is not None or not intervalle:
+            return
+        with self._verrou:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._boucle, args=(intervalle,), daemon=True,
+                                                name='ecriture-positions')
+                self._thread.start()
+
+    def _boucle(self, intervalle):
+        while True:
+            time.sleep(intervalle)
+            close_old_connections()
+            try:
+                self.ecrire()
+            except Exception:
+                logger.exception("Échec de l'écriture des positions des livreurs")
+
+
+tampon_positions = TamponPositions()
+# Les positions en attente ne sont pas perdues à l'arrêt normal du processus
+atexit.register(tampon_positions.ecrire)
+
+# Identifiant du profil livreur de chaque utilisateur, pour ne pas le relire en base à chaque position
+_livreurs_par_utilisateur = CacheLRU(getattr(settings, 'POSITIONS_CACHE_TAILLE', 10000))
+
+
+def _livreur_id(user):
+    livreur_id = _livreurs_par_utilisateur.get(user.pk)
+    if livreur_id is None:
+        livreur = livreur_de(user)
+        if livreur is None:
+            return None
+        livreur_id = livreur.pk
+        _livreurs_par_utilisateur.set(user.pk, livreur_id, 300)
+    return livreur_id
+
+
+def _lire_position(donnees):
+    latitude, longitude = float(donnees['latitude']), float(donnees['longitude'])
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError
+    return latitude, longitude
+
+
+@csrf_exempt
+@require_POST
+def position_livreur(request):
+    """
+    Reçoit la position du livreur connecté : {"latitude": ..., "longitude": ...}, ou un lot de positions
+    enregistrées hors connexion {"positions": [{"latitude": ..., "longitude": ..., "horodatage": ...}, ...]}
+    dont seule la plus récente est gardée. La position est écrite en base de façon différée.
+    """
+    try:
+        user = authentifier(request)
+    except APIException as e:
+        return JsonResponse({'detail': str(e.detail)}, status=e.status_code)
+    if not user.is_authenticated:
+        return JsonResponse({'detail': "Informations d'authentification non fournies."}, status=401)
+    livreur_id = _livreur_id(user)
+    if livreur_id is None:
+        return JsonResponse({'detail': "Aucun livreur associé à cet utilisateur."}, status=404)
+
+    try:
+        donnees = json.loads(request.body)
+        if 'positions' in donnees:
+            positions = sorted(donnees['positions'], key=lambda position: position.get('horodatage', 0))
+            latitude, longitude = _lire_position(positions[-1])
+        else:
+            latitude, longitude = _lire_position(donnees)
+    except (ValueError, KeyError, TypeError, IndexError, AttributeError):
+        return JsonResponse({'error': "Position invalide : latitude et longitude numériques attendues."}, status=400)
+
+    tampon_positions.enregistrer(livreur_id, latitude, longitude)
+    return HttpResponse(status=204)
@@ -0,0 +1,25 @@
+from .models import Client, Livreur
+
+
+def client_de(user):
+    """
+    Renvoie le profil client de l'utilisateur, ou None s'il n'en a pas.
+    Le résultat (même absent) est gardé en cache sur l'instance `user` par l'accesseur inverse :
+    le profil n'est donc chargé qu'une fois par requête, et aucune fois si l'authentification l'a déjà joint.
+    """
+    if not user or not user.is_authenticated:
+        return None
+    try:
+        return user.client
+    except Client.DoesNotExist:
+        return None
+
+
+def livreur_de(user):
+    """Renvoie le profil livreur de l'utilisateur, ou None s'il n'en a pas (mis en cache comme client_de)."""
+    if not user or not user.is_authenticated:
+        return None
+    try:
+        return user.livreur
+    except Livreur.DoesNotExist:
+        return None
@@ -3,14 +3,23 @@ from rest_framework.exceptions import ValidationError, PermissionDenied
 from django.utils.timezone import now
 from .models import Client, Commande, CommandeProduit, Produit, Livreur, Paiement
 from django.contrib.auth import get_user_model
-from django.db.models.signals import pre_delete
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.db.models.lookups import GreaterThan
+from django.db.models.signals import post_delete
 from django.dispatch import receiver
 from decimal import Decimal
-import requests
+from .geocodage import APIAdresseIndisponible, rechercher_adresse, extraire_coordonnees
+from .index_livreurs import parser_position, reserver_livreur
+from .instrumentation import SerialisationMesureeMixin
+from .evenements import publier_commande
+from .profils import client_de
 
 User = get_user_model()
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SerialisationMesureeMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'email', 'password']
@@ -66,19 +75,16 @@ class UserSerializer(serializers.ModelSerializer):
 
 
 def verifier_adresse(adresse):
-    """Utilise l'API de l'adresse pour vérifier l'exactitude d'une adresse donnée."""
-    url = "https://api-adresse.data.gouv.fr/search"
-    params = {'q': adresse, 'limit': 1}  # Limite à un résultat
-    response = requests.get(url, params=params)
-    data = response.json()
-    return data
-
-class ClientSerializer(serializers.ModelSerializer):
+    """Utilise l'API de l'adresse (via le cache de géocodage) pour vérifier l'exactitude d'une adresse donnée."""
+    return rechercher_adresse(adresse)
+
+class ClientSerializer(SerialisationMesureeMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
 
     class Meta:
         model = Client
         fields = '__all__'
+        read_only_fields = ('latitude', 'longitude')  # Renseignés à partir de l'adresse validée
 
     def validate(self, data):
         """
@@ -86,7 +92,7 @@ class ClientSerializer(serializers.ModelSerializer):
         """
         request = self.context.get('request')
         if request and request.method == 'POST':
-            existing_client = Client.objects.filter(user=request.user).exists()
+            existing_client = client_de(request.user) is not None
             if existing_client:
                 raise ValidationError("Un client est déjà associé à cet utilisateur.")
 
@@ -103,14 +109,27 @@ class ClientSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Une adresse est requise.")
         
         # Vérifier l'adresse via l'API
-        data = verifier_adresse(value)
-        if not data['features']:
+        try:
+            data = verifier_adresse(value)
+        except APIAdresseIndisponible:
+            # API indisponible : l'adresse est enregistrée telle quelle, sans coordonnées, et géocodée plus tard
+            # en tâche de fond (voir Client.save et geocodage.geocoder_nouvelle_adresse)
+            return value
+        if not data.get('features'):
             raise serializers.ValidationError("Adresse non valide ou introuvable.")
         
-        # Vous pouvez ici choisir de retourner les données complètes de l'API ou simplement la valeur validée
+        # Conserver les coordonnées pour ne pas avoir à géocoder de nouveau l'adresse lors de la livraison
+        self._coordonnees = extraire_coordonnees(data)
+
         adresse_complete = data['features'][0]['properties']['label']
         return adresse_complete  # Retourne l'adresse validée et formatée par l'API
 
+    def _ajouter_coordonnees(self, validated_data):
+        coordonnees = getattr(self, '_coordonnees', None)
+        if 'adresse' in validated_data and coordonnees:
+            validated_data['latitude'], validated_data['longitude'] = coordonnees
+        return validated_data
+
     def validate_telephone(self, value):
         """ Valide que le téléphone n'est pas vide. """
         if not value:
@@ -124,23 +143,85 @@ class ClientSerializer(serializers.ModelSerializer):
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             user = request.user
-            return Client.objects.create(user=user, **validated_data)
+            return Client.objects.create(user=user, **self._ajouter_coordonnees(validated_data))
         else:
             raise ValidationError("L'utilisateur doit être connecté pour créer un client.")
+
+    def update(self, instance, validated_data):
+        return super().update(instance, self._ajouter_coordonnees(validated_data))
         
-class ProduitSerializer(serializers.ModelSerializer):
+class ProduitSerializer(SerialisationMesureeMixin, serializers.ModelSerializer):
+    image_variantes = serializers.SerializerMethodField()
+
     class Meta:
         model = Produit
         fields = '__all__'
+
+    def get_image_variantes(self, produit):
+        """Versions redimensionnées de l'image, au format srcset par format d'image : {"webp": "url 160w, url 320w", ...}."""
+        request = self.context.get('request')
+        srcset = {}
+        for format_image, fichiers in (produit.image_variantes or {}).get('formats', {}).items():
+            urls = []
+            for largeur, nom in sorted(fichiers.items(), key=lambda element: int(element[0])):
+                url = default_storage.url(nom)
+                urls.append(f"{request.build_absolute_uri(url) if request else url} {largeur}w")
+            srcset[format_image] = ', '.join(urls)
+        return srcset
         
-class LivreurSerializer(serializers.ModelSerializer):
+class LivreurSerializer(SerialisationMesureeMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
     
     class Meta:
         model = Livreur
         fields = '__all__'
+
+    def validate(self, data):
+        """
+        Garde la position texte et les coordonnées numériques cohérentes entre elles.
+        """
+        if data.get('position_geo'):
+            position = parser_position(data['position_geo'])
+            if position is None:
+                raise ValidationError("La position doit être au format 'latitude,longitude'.")
+            data['latitude'], data['longitude'] = position
+        elif data.get('latitude') is not None and data.get('longitude') is not None:
+            data['position_geo'] = f"{data['latitude']},{data['longitude']}"
+        return data
         
-class CommandeProduitSerializer(serializers.ModelSerializer):
+def recalculer_total_commande(commande):
+    """
+    Recalcule en base le montant total de la commande (somme quantité × prix des lignes), les frais de
+    livraison et le montant du paiement. Le calcul est fait par la base en trois requêtes quel que soit le
+    nombre de lignes, et deux modifications simultanées du panier ne peuvent pas perdre de mise à jour.
+    """
+    montant = DecimalField(max_digits=10, decimal_places=2)
+    total_lignes = Coalesce(
+        Subquery(CommandeProduit.objects
+                 .filter(commande=OuterRef('pk'))
+                 .values('commande')
+                 .annotate(total=Sum(F('quantite') * F('produit__prix'), output_field=montant))
+                 .values('total')),
+        Value(Decimal('0.00')),
+        output_field=montant,
+    )
+    # Frais de livraison offerts si le montant total dépasse 19.99
+    Commande.objects.filter(pk=commande.pk).update(
+        montant_total=total_lignes,
+        frais_livraison=Case(
+            When(GreaterThan(total_lignes, Decimal('19.99')), then=Value(Decimal('0.00'))),
+            default=Value(Decimal('5.00')),
+            output_field=montant,
+        ),
+    )
+    Paiement.objects.filter(commande=commande).update(montant=Subquery(
+        Commande.objects.filter(pk=OuterRef('commande')).values(
+            montant_du=F('montant_total') + F('frais_livraison'))[:1]
+    ))
+    commande.refresh_from_db(fields=['montant_total', 'frais_livraison'])
+
+
+class CommandeProduitSerializer(SerialisationMesureeMixin, serializers.ModelSerializer):
     # commande_detail = CommandeSerializer(source='commande', read_only=True)  # Utilisé pour la lecture
     # commande = serializers.PrimaryKeyRelatedField(queryset=Commande.objects.all(), write_only=True)  # Utilisé pour l'écriture
 
@@ -179,33 +260,6 @@ class CommandeProduitSerializer(serializers.ModelSerializer):
             raise ValidationError("Ce produit n'est pas disponible pour le moment.")
         return value
 
-    def update_instance_total(self, instance, created=False):
-        if instance.commande.montant_total is None:
-            instance.commande.montant_total = Decimal('0.00')
-
-        amount_change = instance.quantite * instance.produit.prix
-        if created:
-            instance.commande.montant_total += amount_change
-        else:
-            # Recalculer le total en parcourant tous les produits de la commande
-            total = sum(cp.quantite * cp.produit.prix for cp in instance.commande.commandeproduit_set.all())
-            instance.commande.montant_total = total
-
-        # Mise à jour des frais de livraison si le montant total dépasse 19.99
-        if instance.commande.montant_total > Decimal('19.99'):
-            instance.commande.frais_livraison = Decimal('0.00')
-        else:
-            # Rétablir les frais de livraison par défaut si nécessaire
-            instance.commande.frais_livraison = Decimal('5.00')
-
-        paiement = Paiement.objects.get(commande=instance.commande)
-        if paiement:
-            paiement.montant = instance.commande.montant_total + instance.commande.frais_livraison
-            instance.commande.paiement = paiement
-            paiement.save()
-            
-        instance.commande.save()
-
     def check_payment_and_status(self, commande):
         # Récupérer un paiement existant ou en créer un nouveau si nécessaire
         paiement, created = Paiement.objects.get_or_create(
@@ -240,7 +294,7 @@ class CommandeProduitSerializer(serializers.ModelSerializer):
 
         # Créer l'instance après validation
         instance = super().create(validated_data)
-        self.update_instance_total(instance, created=True)
+        recalculer_total_commande(instance.commande)
         
         return instance
 
@@ -254,33 +308,84 @@ class CommandeProduitSerializer(serializers.ModelSerializer):
 
         # Mettre à jour l'instance après validation
         instance = super().update(instance, validated_data)
-        self.update_instance_total(instance)
+        recalculer_total_commande(instance.commande)
         return instance
 
-    @receiver(pre_delete, sender=CommandeProduit)
-    def adjust_command_on_delete(sender, instance, **kwargs):
+    @receiver(post_delete, sender=CommandeProduit)
+    def adjust_command_on_delete(sender, instance, origin=None, **kwargs):
+        # Inutile de recalculer le total d'une commande en cours de suppression
+        if isinstance(origin, Commande):
+            return
+        # Recalculer le montant total, les frais de livraison et le paiement sans la ligne supprimée
+        recalculer_total_commande(Commande(pk=instance.commande_id))
 
-        # Diminuer le montant total de la commande
-        commande = instance.commande
-        produit_price = instance.produit.prix
-        quantity = instance.quantite
-        commande.montant_total -= produit_price * quantity
+class LigneCommandeSerializer(serializers.Serializer):
+    produit = serializers.IntegerField()
+    quantite = serializers.IntegerField(min_value=1)
 
-        # Mise à jour des frais de livraison
-        if commande.montant_total > Decimal('19.99'):
-            commande.frais_livraison = Decimal('0.00')
-        else:
-            commande.frais_livraison = Decimal('5.00')
 
-        paiement = Paiement.objects.get(commande=commande)
-        if not paiement:
-            paiement.montant = commande.montant_total + commande.frais_livraison
-            commande.paiement = paiement
-            paiement.save()
+class CommandeProduitLotSerializer(SerialisationMesureeMixin, serializers.Serializer):
+    """
+    Ajoute plusieurs produits à une commande en une seule requête : la disponibilité est vérifiée
+    en une requête, les lignes sont insérées avec bulk_create et le total n'est recalculé qu'une fois.
+    """
+    commande = serializers.PrimaryKeyRelatedField(queryset=Commande.objects.select_related('client__user'))
+    lignes = LigneCommandeSerializer(many=True, allow_empty=False)
 
-        commande.save()
+    def validate(self, data):
+        commande = data['commande']
+        ids = [ligne['produit'] for ligne in data['lignes']]
+        if len(ids) != len(set(ids)):
+            raise serializers.ValidationError("Un même produit ne peut apparaître qu'une fois.")
+
+        produits = Produit.objects.in_bulk(ids)
+        inconnus = [produit_id for produit_id in ids if produit_id not in produits]
+        if inconnus:
+            raise serializers.ValidationError(f"Produits introuvables : {inconnus}")
+        indisponibles = [produit.nom_produit for produit in produits.values() if produit.statut != 'disponible']
+        if indisponibles:
+            raise serializers.ValidationError(f"Ces produits ne sont pas disponibles pour le moment : {indisponibles}")
+
+        deja_presents = CommandeProduit.objects.filter(commande=commande, produit__in=ids).values_list('produit_id', flat=True)
+        if deja_presents:
+            raise serializers.ValidationError(f"Ces produits sont déjà inclus dans la commande : {list(deja_presents)}")
+
+        data['produits'] = produits
+        return data
 
-class CommandeSerializer(serializers.ModelSerializer):
+    @transaction.atomic
+    def create(self, validated_data):
+        # Verrouiller la commande pour que deux ajouts simultanés ne se marchent pas dessus
+        commande = Commande.objects.select_for_update().get(pk=validated_data['commande'].pk)
+        CommandeProduitSerializer().check_payment_and_status(commande)
+
+        produits = validated_data['produits']
+        CommandeProduit.objects.bulk_create([
+            CommandeProduit(commande=commande, produit=produits[ligne['produit']], quantite=ligne['quantite'])
+            for ligne in validated_data['lignes']
+        ])
+        # bulk_create ne renseigne pas les identifiants sur toutes les bases (MySQL) : lignes relues
+        lignes = list(CommandeProduit.objects.filter(commande=commande, produit_id__in=list(produits))
+                      .select_related('produit').order_by('id'))
+
+        # Recalcul du total, des frais de livraison et du paiement une seule fois pour toutes les lignes
+        recalculer_total_commande(commande)
+
+        validated_data['commande'] = commande
+        validated_data['lignes'] = lignes
+        return validated_data
+
+    def to_representation(self, instance):
+        commande = instance['commande']
+        return {
+            'commande': commande.pk,
+            'montant_total': str(commande.montant_total),
+            'frais_livraison': str(commande.frais_livraison),
+            'lignes': CommandeProduitSerializer(instance['lignes'], many=True, context=self.context).data,
+        }
+
+
+class CommandeSerializer(SerialisationMesureeMixin, serializers.ModelSerializer):
     client = ClientSerializer(read_only=True)
     livreur = LivreurSerializer(read_only=True)
     produits = CommandeProduitSerializer(source='commandeproduit_set', many=True, read_only=True)
@@ -290,19 +395,19 @@ class CommandeSerializer(serializers.ModelSerializer):
         fields = '__all__'
         read_only_fields = ('date_commande', 'frais_livraison', 'montant_total', 'temps_estime_livraison')  # Rend ces champs en lecture seule
 
+    @transaction.atomic
     def create(self, validated_data):
         user = self.context['request'].user
         
         # Trouver le client associé à l'utilisateur
-        client = Client.objects.get(user=user)
+        client = client_de(user)
+        if client is None:
+            raise ValidationError("Aucun client associé à cet utilisateur.")
         
-        # Trouver un livreur disponible
-        try:
-            livreur = Livreur.objects.filter(statut='disponible').first()
-            if not livreur:
-                raise ValidationError("Aucun livreur disponible actuellement.")
-        except Livreur.DoesNotExist:
-            raise ValidationError("Erreur lors de la recherche d'un livreur disponible.")
+        # Réserver le livreur disponible le plus proche du client (ou n'importe quel livreur disponible)
+        livreur = reserver_livreur(client.latitude, client.longitude)
+        if not livreur:
+            raise ValidationError("Aucun livreur disponible actuellement.")
         
         # Définir les valeurs par défaut
         validated_data['client'] = client
@@ -368,6 +473,8 @@ class CommandeSerializer(serializers.ModelSerializer):
                 
 
         instance.save()
+        # Les clients et livreurs abonnés au flux de la commande reçoivent le nouveau statut
+        publier_commande(instance)
         return instance
     
     def perform_destroy(self, instance):
@@ -377,7 +484,7 @@ class CommandeSerializer(serializers.ModelSerializer):
         
         super().perform_destroy(instance)
 
-class PaiementSerializer(serializers.ModelSerializer):
+class PaiementSerializer(SerialisationMesureeMixin, serializers.ModelSerializer):
     commande = CommandeSerializer(read_only=True)
     class Meta:
         model = Paiement
@@ -0,0 +1,214 @@
+import logging
+import random
+import traceback
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, F
+from django.utils.timezone import now
+
+from .models import Tache
+
+logger = logging.getLogger(__name__)
+
+# Fonctions exécutables par les travailleurs, par nom de tâche
+_registre = {}
+
+
+def tache(nom, file='defaut', tentatives_max=None, groupable=False):
+    """
+    Décorateur enregistrant une fonction comme tâche de fond, à enfiler avec enfiler(fonction, *args).
+    Les arguments sont conservés en JSON : on passe des identifiants plutôt que des instances.
+    Une tâche groupable reçoit une liste pour seul argument : le travailleur fusionne les tâches de ce nom
+    réservées ensemble en un seul appel (voir executer_lot).
+    """
+    def enregistrer(fonction):
+        fonction.nom_tache = nom
+        fonction.file_tache = file
+        fonction.tentatives_max = tentatives_max
+        fonction.groupable = groupable
+        _registre[nom] = fonction
+        return fonction
+    return enregistrer
+
+
+def enfiler(fonction, *args, cle_idempotence=None, delai=0, **kwargs):
+    """
+    Enregistre une tâche dans la transaction en cours : elle n'est visible des travailleurs qu'une fois la
+    transaction validée et disparaît si celle-ci est annulée. Si une tâche de même clé d'idempotence est
+    en attente, en cours ou terminée, rien n'est ajouté et c'est elle qui est renvoyée ; si elle a échoué,
+    elle est réarmée (nouveaux arguments, compteur de tentatives remis à zéro).
+    """
+    tache = Tache(
+        nom=fonction.nom_tache,
+        file=fonction.file_tache,
+        arguments={'args': list(args), 'kwargs': kwargs},
+        cle_idempotence=cle_idempotence,
+        tentatives_max=fonction.tentatives_max or getattr(settings, 'TACHES_TENTATIVES', 5),
+        executer_apres=now() + timedelta(seconds=delai),
+    )
+    if cle_idempotence:
+        existante = Tache.objects.filter(cle_idempotence=cle_idempotence).first()
+        if existante is None:
+            try:
+                with transaction.atomic():
+                    tache.save()
+            except IntegrityError:
+                # Enfilée au même moment par une autre requête
+                existante = Tache.objects.get(cle_idempotence=cle_idempotence)
+        if existante is not None:
+            if existante.statut != 'echouee' or not _rearmer(existante, tache):
+                return existante
+            tache = existante
+    else:
+        tache.save()
+
+    if getattr(settings, 'TACHES_EXECUTION_IMMEDIATE', False) and not delai:
+        transaction.on_commit(lambda: _demarrer(tache) and executer(tache))
+    return tache
+
+
+def _rearmer(existante, tache):
+    """Remet en attente une tâche échouée avec les valeurs de `tache` ; False si une autre requête l'a déjà fait."""
+    champs = {
+        'arguments': tache.arguments, 'tentatives_max': tache.tentatives_max,
+        'executer_apres': tache.executer_apres, 'statut': 'en_attente', 'tentatives': 0,
+        'date_debut': None, 'date_fin': None, 'derniere_erreur': '',
+    }
+    if not Tache.objects.filter(pk=existante.pk, statut='echouee').update(**champs):
+        existante.refresh_from_db()
+        return False
+    for champ, valeur in champs.items():
+        setattr(existante, champ, valeur)
+    return True
+
+
+def _demarrer(tache, instant=None):
+    """Passe la tâche 'en_cours' si elle est toujours en attente ; renvoie False si un autre travailleur l'a prise."""
+    instant = instant or now()
+    if not Tache.objects.filter(pk=tache.pk, statut='en_attente').update(
+            statut='en_cours', date_debut=instant, tentatives=F('tentatives') + 1):
+        return False
+    tache.statut, tache.date_debut, tache.tentatives = 'en_cours', instant, tache.tentatives + 1
+    return True
+
+
+def reserver(files=None, nombre=10):
+    """
+    Réserve jusqu'à `nombre` tâches prêtes, les plus anciennes d'abord, sans dépasser TACHES_CONCURRENCE
+    (nombre de tâches simultanées par file, tous travailleurs confondus). Avec SKIP LOCKED, plusieurs
+    travailleurs se partagent la file sans s'attendre.
+    """
+    limites = getattr(settings, 'TACHES_CONCURRENCE', {})
+    instant = now()
+    with transaction.atomic():
+        en_cours = dict(Tache.objects.filter(statut='en_cours', file__in=list(limites))
+                        .values_list('file').annotate(total=Count('id')))
+        places = {file: limite - en_cours.get(file, 0) for file, limite in limites.items()}
+        pretes = (Tache.objects
+                  .filter(statut='en_attente', executer_apres__lte=instant)
+                  .exclude(file__in=[file for file, libres in places.items() if libres <= 0])
+                  .order_by('executer_apres', 'id'))
+        if files:
+            pretes = pretes.filter(file__in=files)
+        if connection.features.has_select_for_update_skip_locked:
+            pretes = pretes.select_for_update(skip_locked=True)
+
+        reservees = []
+        for tache in pretes[:nombre]:
+            if tache.file in places:
+                if places[tache.file] <= 0:
+                    continue
+                places[tache.file] -= 1
+            if _demarrer(tache, instant):
+                reservees.append(tache)
+    return reservees
+
+
+def _delai_nouvel_essai(tentatives):
+    """Attente exponentielle (TACHES_DELAI_INITIAL doublé à chaque échec), avec une part aléatoire."""
+    delai = min(getattr(settings, 'TACHES_DELAI_INITIAL', 5) * 2 ** (tentatives - 1),
+                getattr(settings, 'TACHES_DELAI_MAX', 3600))
+    return delai * random.uniform(0.5, 1)
+
+
+def executer(tache):
+    """
+    Exécute une tâche réservée. En cas d'erreur, elle est reprogrammée après un délai croissant, puis
+    marquée 'echouee' après tentatives_max essais. Renvoie True si la tâche a réussi.
+    """
+    fonction = _registre.get(tache.nom)
+    try:
+        if fonction is None:
+            raise LookupError(f"Tâche inconnue : {tache.nom}")
+        fonction(*tache.arguments.get('args', []), **tache.arguments.get('kwargs', {}))
+    except Exception:
+        erreur = traceback.format_exc()
+        if fonction is not None and tache.tentatives < tache.tentatives_max:
+            logger.warning("Échec de la tâche %s (essai %s/%s)", tache, tache.tentatives, tache.tentatives_max)
+            Tache.objects.filter(pk=tache.pk).update(
+                statut='en_attente', derniere_erreur=erreur,
+                executer_apres=now() + timedelta(seconds=_delai_nouvel_essai(tache.tentatives)))
+        else:
+            logger.error("Abandon de la tâche %s après %s essai(s)", tache, tache.tentatives)
+            Tache.objects.filter(pk=tache.pk).update(statut='echouee', derniere_erreur=erreur, date_fin=now())
+        return False
+    Tache.objects.filter(pk=tache.pk).update(statut='terminee', derniere_erreur='', date_fin=now())
+    return True
+
+
+def executer_lot(taches):
+    """
+    Exécute des tâches réservées ; celles d'une même tâche groupable sont fusionnées en un seul appel
+    (listes concaténées). Si cet appel échoue, elles sont exécutées une par une : seule la fautive est
+    reprogrammée. Renvoie le nombre de tâches réussies et échouées.
+    """
+    seules, groupes = [], defaultdict(list)
+    for tache in taches:
+        if getattr(_registre.get(tache.nom), 'groupable', False):
+            groupes[tache.nom].append(tache)
+        else:
+            seules.append(tache)
+
+    reussies = echouees = 0
+    for nom, groupe in groupes.items():
+        if len(groupe) > 1 and _executer_groupe(_registre[nom], groupe):
+            reussies += len(groupe)
+        else:
+            seules.extend(groupe)
+    for tache in seules:
+        if executer(tache):
+            reussies += 1
+        else:
+            echouees += 1
+    return reussies, echouees
+
+
+def _executer_groupe(fonction, groupe):
+    elements = [element for tache in groupe for element in tache.arguments.get('args', [[]])[0]]
+    try:
+        fonction(elements)
+    except Exception:
+        logger.warning("Échec du lot %s (%s tâches), exécution une par une", fonction.nom_tache, len(groupe),
+                       exc_info=True)
+        return False
+    Tache.objects.filter(pk__in=[tache.pk for tache in groupe]).update(
+        statut='terminee', derniere_erreur='', date_fin=now())
+    return True
+
+
+def reprendre_taches_bloquees():
+    """Remet en attente les tâches restées 'en_cours' trop longtemps (travailleur arrêté en pleine exécution)."""
+    bloquees = Tache.objects.filter(
+        statut='en_cours', date_debut__lt=now() - timedelta(seconds=getattr(settings, 'TACHES_DELAI_BLOCAGE', 600)))
+    abandonnees = bloquees.filter(tentatives__gte=F('tentatives_max')).update(
+        statut='echouee', derniere_erreur="Travailleur interrompu pendant l'exécution.", date_fin=now())
+    return bloquees.update(statut='en_attente') + abandonnees
+
+
+def purger_taches():
+    """Supprime les tâches terminées depuis plus de TACHES_CONSERVATION_JOURS (leurs clés d'idempotence sont libérées)."""
+    limite = now() - timedelta(days=getattr(settings, 'TACHES_CONSERVATION_JOURS', 7))
+    return Tache.objects.filter(statut='terminee', date_fin__lt=limite).delete()[0]
@@ -1,3 +1,1474 @@
-from django.test import TestCase
+import base64
+import hashlib
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+import requests
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import close_old_connections, connection
+from django.test import TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from . import geocodage, index_adresses, positions, taches
+from .cache_local import CacheLRU
+from .models import Client, Commande, CommandeProduit, Livreur, Paiement, Produit, Tache
+
+
+@skipUnlessDBFeature('has_select_for_update_skip_locked')
+class ReservationLivreurTests(TransactionTestCase):
+    """Des commandes créées en parallèle doivent obtenir des livreurs tous différents."""
+
+    nombre_commandes = 8
+
+    def setUp(self):
+        self.utilisateurs = []
+        for i in range(self.nombre_commandes):
+            user = User.objects.create_user(username=f'client{i}', password='motdepasse')
+            Client.objects.create(user=user, adresse='1 rue de Paris', telephone='+33600000000',
+                                  latitude=48.87, longitude=2.75)
+            self.utilisateurs.append(user)
+        for i in range(self.nombre_commandes):
+            livreur_user = User.objects.create_user(username=f'livreur{i}', password='motdepasse')
+            Livreur.objects.create(user=livreur_user, statut='disponible',
+                                   latitude=48.87 + i * 0.001, longitude=2.75)
+
+    def test_commandes_paralleles_livreurs_distincts(self):
+        depart = threading.Barrier(self.nombre_commandes)
+        reponses = []
+        verrou = threading.Lock()
+
+        def commander(user):
+            client = APIClient()
+            client.force_authenticate(user)
+            depart.wait()
+            try:
+                reponse = client.post('/commandes/', {}, format='json')
+                with verrou:
+                    reponses.append(reponse.status_code)
+            finally:
+                close_old_connections()
+
+        threads = [threading.Thread(target=commander, args=(user,)) for user in self.utilisateurs]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(reponses, [201] * self.nombre_commandes)
+        livreurs = list(Commande.objects.values_list('livreur_id', flat=True))
+        self.assertEqual(len(livreurs), self.nombre_commandes)
+        self.assertEqual(len(set(livreurs)), self.nombre_commandes)
+        self.assertFalse(Livreur.objects.filter(statut='disponible').exists())
+
+
+class RequetesCommandesTests(TestCase):
+    """Le nombre de requêtes pour lister les commandes ne doit pas dépendre du nombre de commandes."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='client', password='motdepasse')
+        self.client_profil = Client.objects.create(user=self.user, adresse='1 rue de Paris', telephone='+33600000000')
+        livreur_user = User.objects.create_user(username='livreur', password='motdepasse')
+        self.livreur = Livreur.objects.create(user=livreur_user, statut='disponible')
+        self.produits = [Produit.objects.create(nom_produit=f'Produit {i}', prix=5) for i in range(3)]
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def creer_commandes(self, nombre):
+        for _ in range(nombre):
+            commande = Commande.objects.create(client=self.client_profil, livreur=self.livreur)
+            for produit in self.produits:
+                CommandeProduit.objects.create(commande=commande, produit=produit, quantite=2)
+
+    def compter_requetes(self, url):
+        with CaptureQueriesContext(connection) as requetes:
+            reponse = self.api.get(url)
+        self.assertEqual(reponse.status_code, 200)
+        return len(requetes)
+
+    def test_liste_commandes_nombre_de_requetes_constant(self):
+        self.creer_commandes(2)
+        peu = self.compter_requetes('/commandes/')
+        self.creer_commandes(10)
+        self.assertEqual(self.compter_requetes('/commandes/'), peu)
+
+    def test_liste_paiements_nombre_de_requetes_constant(self):
+        self.creer_commandes(2)
+        for commande in Commande.objects.all():
+            commande.paiement_set.create(montant=10)
+        peu = self.compter_requetes('/paiements/')
+        self.creer_commandes(10)
+        for commande in Commande.objects.filter(paiement__isnull=True):
+            commande.paiement_set.create(montant=10)
+        self.assertEqual(self.compter_requetes('/paiements/'), peu)
+
+
+class FauxStripe(BaseHTTPRequestHandler):
+    """Serveur Stripe local : crée des PaymentIntent et les renvoie comme réussis."""
+    # Connexions gardées ouvertes entre deux réponses, comme l'API Stripe
+    protocol_version = 'HTTP/1.1'
+
+    def repondre(self, donnees):
+        corps = json.dumps(donnees).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(corps)))
+        self.end_headers()
+        self.wfile.write(corps)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.repondre({'id': 'pi_test', 'object': 'payment_intent', 'status': 'requires_payment_method',
+                       'client_secret': 'pi_test_secret'})
+
+    def do_GET(self):
+        self.repondre({'id': self.path.rsplit('/', 1)[-1], 'object': 'payment_intent', 'status': 'succeeded',
+                       'client_secret': 'pi_test_secret'})
+
+    def log_message(self, *args):
+        pass
+
+
+class PaiementAsyncTests(TestCase):
+    """Création et vérification asynchrones d'un paiement contre un faux serveur Stripe."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.serveur = ThreadingHTTPServer(('127.0.0.1', 0), FauxStripe)
+        threading.Thread(target=cls.serveur.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.serveur.shutdown()
+        cls.serveur.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='client', password='motdepasse')
+        client_profil = Client.objects.create(user=self.user, adresse='1 rue de Paris', telephone='+33600000000')
+        livreur = Livreur.objects.create(user=User.objects.create_user(username='livreur'), statut='reserve')
+        self.commande = Commande.objects.create(client=client_profil, livreur=livreur, montant_total=20, frais_livraison=0)
+        self.entetes = {'Authorization': f'Token {Token.objects.create(user=self.user).key}'}
+        reglages = override_settings(STRIPE_API_BASE=f'http://127.0.0.1:{self.serveur.server_port}')
+        reglages.enable()
+        self.addCleanup(reglages.disable)
+
+    async def test_creation_puis_verification(self):
+        reponse = await self.async_client.post(f'/api/commandes/{self.commande.pk}/create_payment_intent/', headers=self.entetes)
+        self.assertEqual(reponse.status_code, 201)
+        self.assertEqual(reponse.json(), {'client_secret': 'pi_test_secret'})
+
+        reponse = await self.async_client.post(f'/api/commandes/{self.commande.pk}/verify_payment/', headers=self.entetes)
+        self.assertEqual(reponse.json()['status'], 'success')
+        paiement = await Paiement.objects.select_related('commande').aget(commande=self.commande)
+        self.assertEqual(paiement.statut_paiement, 'payee')
+        self.assertEqual(paiement.payment_token, 'pi_test')
+        self.assertEqual(paiement.commande.statut, 'prise_en_charge')
+
+    def test_appels_successifs_sous_wsgi(self):
+        # Client de test synchrone : chaque appel de la vue asynchrone a sa propre boucle d'événements, comme sous WSGI
+        for _ in range(3):
+            reponse = self.client.post(f'/api/commandes/{self.commande.pk}/create_payment_intent/', headers=self.entetes)
+            self.assertEqual(reponse.status_code, 201, reponse.content)
+
+    async def test_authentification_obligatoire(self):
+        reponse = await self.async_client.post(f'/api/commandes/{self.commande.pk}/create_payment_intent/')
+        self.assertEqual(reponse.status_code, 401)
+
+
+class AuthentificationTokenTests(TestCase):
+    """Le token est résolu depuis le cache, et un token révoqué n'est plus accepté."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='client', password='motdepasse')
+        Client.objects.create(user=self.user, adresse='1 rue de Paris', telephone='+33600000000')
+        self.token = Token.objects.create(user=self.user)
+        self.api = APIClient()
+        self.api.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_token_en_cache(self):
+        self.assertEqual(self.api.get('/clients/client/').status_code, 200)
+        with CaptureQueriesContext(connection) as requetes:
+            self.assertEqual(self.api.get('/clients/client/').status_code, 200)
+        # Seul le profil client est lu : ni la table des tokens ni celle des utilisateurs
+        self.assertEqual(len(requetes), 1)
+
+    def test_token_revoque(self):
+        self.assertEqual(self.api.get('/clients/client/').status_code, 200)
+        self.token.delete()
+        self.assertEqual(self.api.get('/clients/client/').status_code, 401)
+
+    def test_utilisateur_desactive(self):
+        self.assertEqual(self.api.get('/clients/client/').status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.api.get('/clients/client/').status_code, 401)
+
+    def revoquer_dans_un_autre_processus(self):
+        from . import authentication
+
+        # Suppression faite par un autre processus : rien n'est retiré des caches de celui-ci
+        with mock.patch.object(authentication, 'invalider_token'):
+            self.token.delete()
+        # ... et le cache local a expiré (AUTH_TOKEN_CACHE_TTL_LOCAL)
+        authentication._cache_local.clear()
+
+    def test_revocation_sans_cache_partage(self):
+        # "default" est un LocMemCache, propre au processus : le second niveau est ignoré
+        self.assertEqual(self.api.get('/clients/client/').status_code, 200)
+        self.revoquer_dans_un_autre_processus()
+        self.assertEqual(self.api.get('/clients/client/').status_code, 401)
+
+    @override_settings(AUTH_TOKEN_CACHE_ALIAS='geocodage')
+    def test_cache_partage(self):
+        from django.core.cache import caches
+        from . import authentication
+
+        self.addCleanup(caches['geocodage'].clear)
+        self.assertEqual(self.api.get('/clients/client/').status_code, 200)
+        authentication._cache_local.clear()
+        with CaptureQueriesContext(connection) as requetes:
+            self.assertEqual(self.api.get('/clients/client/').status_code, 200)
+        self.assertFalse([requete for requete in requetes if 'authtoken_token' in requete['sql']])
+
+    def test_authentification_basique(self):
+        self.user.set_password('motdepasse')
+        self.user.save()
+        api = APIClient()
+        api.credentials(HTTP_AUTHORIZATION='Basic ' + base64.b64encode(b'client:motdepasse').decode())
+        self.assertEqual(api.get('/clients/client/').status_code, 200)
+
+
+class ParcoursCommandeTests(TestCase):
+    """Le parcours complet d'une commande passe de bout en bout avec un nombre borné de requêtes SQL."""
+
+    def test_parcours_complet(self):
+        with tempfile.TemporaryDirectory() as dossier:
+            chemin = os.path.join(dossier, 'resultats.json')
+            call_command('mesurer_parcours_commande', produits=20, livreurs=3, parcours=3, sortie=chemin, stdout=io.StringIO())
+            with open(chemin, encoding='utf-8') as fichier:
+                resultats = json.load(fichier)
+        self.assertEqual(resultats['parcours']['nombre'], 3)
+        self.assertLessEqual(resultats['lignes']['requetes_max'], 15)
+        self.assertLessEqual(resultats['commande']['requetes_max'], 10)
+
+    def test_refus_base_distante(self):
+        from django.core.management.base import CommandError
+
+        # Réglages du projet : base MySQL distante
+        with mock.patch.object(connection, 'vendor', 'mysql'), \
+                mock.patch.dict(connection.settings_dict, {'HOST': 'mysql-projetipssi.alwaysdata.net'}):
+            for commande, options in (('mesurer_parcours_commande', {'produits': 20}),
+                                      ('analyser_requetes', {'generer_commandes': 100})):
+                with self.subTest(commande=commande), self.assertRaisesMessage(CommandError, '--base-jetable'):
+                    call_command(commande, stdout=io.StringIO(), **options)
+            self.assertFalse(Produit.objects.exists())
+
+            with mock.patch.dict(connection.settings_dict, {'HOST': '127.0.0.1'}):
+                call_command('analyser_requetes', generer_commandes=100, repetitions=1, sans_plan=True,
+                             stdout=io.StringIO())
+        self.assertTrue(Produit.objects.exists())
+
+
+class FluxCommandeTests(TestCase):
+    """Le flux SSE envoie l'état courant de la commande puis chaque changement de statut."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='client', password='motdepasse')
+        client_profil = Client.objects.create(user=self.user, adresse='1 rue de Paris', telephone='+33600000000')
+        livreur = Livreur.objects.create(user=User.objects.create_user(username='livreur'), statut='reserve')
+        self.commande = Commande.objects.create(client=client_profil, livreur=livreur, montant_total=20, frais_livraison=0)
+        Paiement.objects.create(commande=self.commande, montant=20, statut_paiement='payee')
+        self.token = Token.objects.create(user=self.user).key
+
+    def changer_statut(self, statut):
+        from .serializers import CommandeSerializer
+        with self.captureOnCommitCallbacks(execute=True):
+            commande = Commande.objects.select_related('livreur').get(pk=self.commande.pk)
+            CommandeSerializer().update(commande, {'statut': statut})
+
+    async def test_flux_statuts(self):
+        reponse = await self.async_client.get(f'/api/commandes/{self.commande.pk}/evenements/?token={self.token}')
+        self.assertEqual(reponse.status_code, 200)
+        self.assertEqual(reponse['Content-Type'], 'text/event-stream')
+        flux = aiter(reponse.streaming_content)
+        self.assertIn(b'"statut": "en_cours"', await anext(flux))
+
+        await sync_to_async(self.changer_statut)('prise_en_charge')
+        self.assertIn(b'"statut": "prise_en_charge"', await anext(flux))
+        await flux.aclose()
+
+    async def test_flux_reserve_aux_participants(self):
+        autre = await sync_to_async(User.objects.create_user)(username='autre')
+        token = await sync_to_async(lambda: Token.objects.create(user=autre).key)()
+        reponse = await self.async_client.get(f'/api/commandes/{self.commande.pk}/evenements/',
+                                              headers={'Authorization': f'Token {token}'})
+        self.assertEqual(reponse.status_code, 403)
+
+    def test_flux_indisponible_sous_wsgi(self):
+        reponse = self.client.get(f'/api/commandes/{self.commande.pk}/evenements/?token={self.token}')
+        self.assertEqual(reponse.status_code, 501)
+        self.assertEqual(reponse.json()['suivi'], f'/commandes/{self.commande.pk}/')
+
+
+@override_settings(POSITIONS_INTERVALLE_ECRITURE=0)
+class PositionLivreurTests(TestCase):
+    """Les positions sont acceptées sans écriture immédiate, puis écrites en base en une requête groupée."""
+
+    def setUp(self):
+        self.livreurs = [
+            Livreur.objects.create(user=User.objects.create_user(username=f'livreur{i}'), statut='disponible')
+            for i in range(3)
+        ]
+        self.clients_api = []
+        for livreur in self.livreurs:
+            api = APIClient()
+            api.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=livreur.user).key}')
+            self.clients_api.append(api)
+
+    def test_positions_ecrites_par_lot(self):
+        for i, api in enumerate(self.clients_api):
+            api.post('/api/livreurs/position/', {'latitude': 48.87, 'longitude': 2.75 + i / 100}, format='json')
+        with CaptureQueriesContext(connection) as requetes:
+            reponse = self.clients_api[0].post('/api/livreurs/position/', {'positions': [
+                {'latitude': 48.80, 'longitude': 2.70, 'horodatage': 2},
+                {'latitude': 48.00, 'longitude': 2.00, 'horodatage': 1},
+            ]}, format='json')
+        self.assertEqual(reponse.status_code, 204)
+        self.assertEqual(len(requetes), 0)
+        self.assertIsNone(Livreur.objects.get(pk=self.livreurs[0].pk).latitude)
+
+        with CaptureQueriesContext(connection) as requetes:
+            self.assertEqual(positions.tampon_positions.ecrire(), 3)
+        self.assertEqual(len(requetes), 1)
+        livreur = Livreur.objects.get(pk=self.livreurs[0].pk)
+        self.assertEqual((livreur.latitude, livreur.longitude, livreur.position_geo), (48.80, 2.70, '48.8,2.7'))
+
+    def test_lot_conserve_si_ecriture_echoue(self):
+        from django.db import OperationalError
+
+        for i, api in enumerate(self.clients_api[:2]):
+            api.post('/api/livreurs/position/', {'latitude': 48.87, 'longitude': 2.75 + i / 100}, format='json')
+
+        def coupure(*args, **kwargs):
+            # Position reçue pendant l'écriture, avant l'échec : elle prime sur celle du lot
+            positions.tampon_positions.enregistrer(self.livreurs[0].pk, 48.90, 2.80)
+            raise OperationalError("connexion perdue")
+
+        with mock.patch.object(Livreur.objects, 'bulk_update', side_effect=coupure):
+            with self.assertRaises(OperationalError):
+                positions.tampon_positions.ecrire()
+        self.assertEqual(positions.tampon_positions.ecrire(), 2)
+        self.assertEqual(list(Livreur.objects.filter(pk__in=[l.pk for l in self.livreurs[:2]])
+                              .order_by('pk').values_list('latitude', 'longitude')),
+                         [(48.90, 2.80), (48.87, 2.76)])
+
+    def test_position_invalide(self):
+        reponse = self.clients_api[0].post('/api/livreurs/position/', {'latitude': 'nord'}, format='json')
+        self.assertEqual(reponse.status_code, 400)
+
+
+class MoteurETATests(TestCase):
+    """La grille précalculée suit le réseau routier ; hors de la grille, le moteur à vol d'oiseau prend le relais."""
+
+    def setUp(self):
+        self.dossier = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dossier.cleanup)
+        # Route en L depuis le restaurant : 0,02° vers le nord puis 0,02° vers l'est, à 36 km/h
+        lat, lon = 48.8733, 2.7488
+        points = [(lat + i * 0.002, lon) for i in range(11)] + [(lat + 0.02, lon + i * 0.002) for i in range(1, 11)]
+        graphe = os.path.join(self.dossier.name, 'graphe.csv')
+        with open(graphe, 'w', encoding='utf-8') as fichier:
+            fichier.write('lat_a,lon_a,lat_b,lon_b,vitesse_kmh\n')
+            for a, b in zip(points, points[1:]):
+                fichier.write(f'{a[0]},{a[1]},{b[0]},{b[1]},36\n')
+        self.grille = os.path.join(self.dossier.name, 'grille.json')
+        call_command('construire_grille_eta', graphe, self.grille, rayon_km=4, pas=0.002, stdout=io.StringIO())
+
+    def test_grille_suit_la_route(self):
+        from .eta import MoteurGrille, MoteurVolOiseau
+        moteur = MoteurGrille(self.grille)
+        moteur.profil_horaire = [1.0] * 24
+        # Au bout du L : environ 3,7 km de route à 36 km/h, à la précision de la grille près
+        secondes = moteur.secondes_hors_trafic(48.8733, 2.7488, 48.8933, 2.7688)
+        self.assertAlmostEqual(secondes, 370, delta=30)
+        # Hors de la grille ou depuis une autre origine : vol d'oiseau
+        secours = MoteurVolOiseau()
+        self.assertEqual(moteur.secondes_hors_trafic(48.8733, 2.7488, 49.5, 2.7488),
+                         secours.secondes_hors_trafic(48.8733, 2.7488, 49.5, 2.7488))
+        self.assertEqual(moteur.secondes_hors_trafic(48.80, 2.70, 48.8933, 2.7688),
+                         secours.secondes_hors_trafic(48.80, 2.70, 48.8933, 2.7688))
+
+    def test_calcul_matriciel(self):
+        from .eta import MoteurGrille
+        moteur = MoteurGrille(self.grille)
+        origines = [(48.8733, 2.7488), (48.80, 2.70)]
+        destinations = [(48.8933, 2.7688), (48.88, 2.75), (49.5, 2.7488)]
+        matrice = moteur.matrice_secondes(origines, destinations)
+        for i, origine in enumerate(origines):
+            for j, destination in enumerate(destinations):
+                self.assertAlmostEqual(matrice[i, j], moteur.duree(*origine, *destination).total_seconds(), places=6)
+
+    def test_moteur_abstrait(self):
+        from .eta import MoteurETA
+        with self.assertRaises(TypeError):
+            MoteurETA()
+
+
+class DispatchTests(TestCase):
+    """Le tableau de dispatch donne, pour chaque commande active, le livreur disponible le plus rapide."""
+
+    def setUp(self):
+        client_profil = Client.objects.create(user=User.objects.create_user(username='client'), adresse='1 rue de Paris',
+                                              telephone='+33600000000', latitude=48.88, longitude=2.76)
+        assigne = Livreur.objects.create(user=User.objects.create_user(username='assigne'), statut='reserve',
+                                         latitude=48.95, longitude=2.90)
+        self.proche = Livreur.objects.create(user=User.objects.create_user(username='proche'), statut='disponible',
+                                             latitude=48.874, longitude=2.749)
+        Livreur.objects.create(user=User.objects.create_user(username='loin'), statut='disponible',
+                               latitude=48.80, longitude=2.60)
+        self.commande = Commande.objects.create(client=client_profil, livreur=assigne, montant_total=20, frais_livraison=0)
+        Commande.objects.create(client=client_profil, livreur=assigne, montant_total=20, frais_livraison=0, statut='livree')
+        self.api = APIClient()
+        self.api.force_authenticate(User.objects.create_user(username='admin', is_staff=True))
+
+    def test_meilleur_livreur(self):
+        with CaptureQueriesContext(connection) as requetes:
+            reponse = self.api.get('/commandes/dispatch/')
+        self.assertEqual(reponse.status_code, 200)
+        lignes = reponse.json()['commandes']
+        self.assertEqual([ligne['id'] for ligne in lignes], [self.commande.pk])
+        self.assertEqual(lignes[0]['meilleur_livreur'], self.proche.pk)
+        self.assertLess(lignes[0]['minutes_meilleur_livreur'], lignes[0]['minutes_livreur'])
+        self.assertEqual(reponse.json()['livreurs_disponibles'], 2)
+        self.assertLessEqual(len(requetes), 2)
+
+    def test_reserve_aux_administrateurs(self):
+        self.api.force_authenticate(self.commande.client.user)
+        self.assertEqual(self.api.get('/commandes/dispatch/').status_code, 403)
+
+    def test_un_livreur_par_commande(self):
+        from datetime import timedelta
+        from django.utils.timezone import now
+
+        plus_recente = Commande.objects.create(client=self.commande.client, montant_total=20, frais_livraison=0)
+        Commande.objects.filter(pk=self.commande.pk).update(date_commande=now())
+        Commande.objects.filter(pk=plus_recente.pk).update(date_commande=now() + timedelta(minutes=5))
+        lignes = {ligne['id']: ligne for ligne in self.api.get('/commandes/dispatch/').json()['commandes']}
+        # La commande la plus ancienne a le livreur le plus rapide, l'autre le suivant
+        self.assertEqual(lignes[self.commande.pk]['meilleur_livreur'], self.proche.pk)
+        self.assertNotIn(lignes[plus_recente.pk]['meilleur_livreur'], (None, self.proche.pk))
+        self.assertGreater(lignes[plus_recente.pk]['minutes_meilleur_livreur'],
+                           lignes[self.commande.pk]['minutes_meilleur_livreur'])
+
+
+class VariantesImageTests(TestCase):
+    """Les variantes d'une image produit sont générées à l'envoi, exposées en srcset et supprimées avec le produit."""
+
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        reglages = override_settings(MEDIA_ROOT=self.media.name, TACHES_EXECUTION_IMMEDIATE=True,
+                                     PRODUIT_IMAGE_LARGEURS=[160, 320, 2000], PRODUIT_IMAGE_FORMATS=['webp', 'jpeg'])
+        reglages.enable()
+        self.addCleanup(reglages.disable)
+
+    def test_variantes(self):
+        from PIL import Image
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        contenu = io.BytesIO()
+        Image.new('RGB', (800, 600), 'red').save(contenu, 'PNG')
+        with self.captureOnCommitCallbacks(execute=True):
+            produit = Produit.objects.create(nom_produit='Pizza', prix=10,
+                                             image=SimpleUploadedFile('pizza.png', contenu.getvalue()))
+        produit.refresh_from_db()
+        formats = produit.image_variantes['formats']
+        self.assertEqual(set(formats), {'webp', 'jpeg'})
+        # Pas d'agrandissement au-delà de la largeur de l'original
+        self.assertEqual(set(formats['webp']), {'160', '320'})
+        with Image.open(os.path.join(self.media.name, formats['webp']['320'])) as variante:
+            self.assertEqual(variante.size, (320, 240))
+
+        api = APIClient()
+        api.force_authenticate(User.objects.create_user(username='client'))
+        srcset = api.get(f'/produits/{produit.pk}/').json()['image_variantes']
+        self.assertRegex(srcset['webp'], r'^http://testserver/media/produits/pizza_[0-9a-f]{12}_160\.webp 160w, .*_320\.webp 320w$')
+
+        fichiers = [os.path.join(self.media.name, nom) for variantes in formats.values() for nom in variantes.values()]
+        with self.captureOnCommitCallbacks(execute=True):
+            produit.delete()
+        self.assertFalse(any(os.path.exists(fichier) for fichier in fichiers))
+
+
+class ServiceMediasTests(TestCase):
+    """Les images produits ont un nom unique par contenu et sont servies avec cache immuable, 304 et plages d'octets."""
+
+    def setUp(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        reglages = override_settings(MEDIA_ROOT=self.media.name, PRODUIT_IMAGE_FORMATS=[])
+        reglages.enable()
+        self.addCleanup(reglages.disable)
+        self.contenu = bytes(range(256)) * 40
+        self.produit = Produit.objects.create(nom_produit='Pizza', image=SimpleUploadedFile('Pizza.JPG', self.contenu))
+        self.url = f'/media/{self.produit.image.name}'
+
+    def test_nom_avec_empreinte(self):
+        self.assertRegex(self.produit.image.name, r'^produits/Pizza_[0-9a-f]{12}\.jpg$')
+
+    def test_fichier_complet_et_conditionnel(self):
+        reponse = self.client.get(self.url)
+        self.assertEqual(reponse.status_code, 200)
+        self.assertEqual(b''.join(reponse.streaming_content), self.contenu)
+        self.assertEqual(reponse['Cache-Control'], 'public, max-age=31536000, immutable')
+        reponse = self.client.get(self.url, headers={'If-None-Match': reponse['ETag']})
+        self.assertEqual(reponse.status_code, 304)
+
+    def test_plages(self):
+        reponse = self.client.get(self.url, headers={'Range': 'bytes=100-199'})
+        self.assertEqual(reponse.status_code, 206)
+        self.assertEqual(reponse['Content-Range'], f'bytes 100-199/{len(self.contenu)}')
+        self.assertEqual(b''.join(reponse.streaming_content), self.contenu[100:200])
+        reponse = self.client.get(self.url, headers={'Range': 'bytes=-10'})
+        self.assertEqual(b''.join(reponse.streaming_content), self.contenu[-10:])
+        self.assertEqual(self.client.get(self.url, headers={'Range': 'bytes=999999-'}).status_code, 416)
+
+    def test_envoi_delegue_et_chemins_interdits(self):
+        with override_settings(MEDIA_SENDFILE='x-accel-redirect'):
+            reponse = self.client.get(self.url)
+        self.assertEqual(reponse['X-Accel-Redirect'], f'/media-interne/{self.produit.image.name}')
+        self.assertEqual(self.client.get('/media/../manage.py').status_code, 404)
+
+
+executions_test = []
+
+
+@taches.tache('tests.instable', file='tests', tentatives_max=2)
+def tache_instable(valeur, echouer=False):
+    if echouer:
+        raise RuntimeError("échec demandé")
+    executions_test.append(valeur)
+
+
+@taches.tache('tests.groupee', file='tests_lot', groupable=True)
+def tache_groupee(valeurs):
+    if 'échec' in valeurs:
+        raise RuntimeError("échec demandé")
+    executions_test.extend(valeurs)
+
+
+@override_settings(TACHES_CONCURRENCE={'tests': 1})
+class FileTachesTests(TestCase):
+    """File de tâches : idempotence, nouvel essai différé puis abandon, limite de concurrence et travailleur."""
+
+    def setUp(self):
+        executions_test.clear()
+
+    def test_cle_idempotence(self):
+        premiere = taches.enfiler(tache_instable, 1, cle_idempotence='unique')
+        self.assertEqual(taches.enfiler(tache_instable, 2, cle_idempotence='unique').pk, premiere.pk)
+        self.assertEqual(Tache.objects.count(), 1)
+
+    def test_cle_idempotence_apres_echec(self):
+        premiere = taches.enfiler(tache_instable, 1, echouer=True, cle_idempotence='unique')
+        Tache.objects.filter(pk=premiere.pk).update(statut='echouee', tentatives=2, derniere_erreur='échec')
+        # Une tâche échouée ne bloque pas la clé : elle est réarmée avec les nouveaux arguments
+        reprise = taches.enfiler(tache_instable, 2, cle_idempotence='unique')
+        self.assertEqual(reprise.pk, premiere.pk)
+        reprise.refresh_from_db()
+        self.assertEqual((reprise.statut, reprise.tentatives, reprise.derniere_erreur), ('en_attente', 0, ''))
+        tache, = taches.reserver()
+        self.assertTrue(taches.executer(tache))
+        self.assertEqual(executions_test, [2])
+        self.assertEqual(Tache.objects.count(), 1)
+
+    def test_nouvel_essai_puis_abandon(self):
+        taches.enfiler(tache_instable, 1, echouer=True)
+        tache, = taches.reserver()
+        self.assertFalse(taches.executer(tache))
+        tache.refresh_from_db()
+        self.assertEqual((tache.statut, tache.tentatives), ('en_attente', 1))
+        self.assertIn("échec demandé", tache.derniere_erreur)
+        # Reprogrammée plus tard : pas encore prête
+        self.assertEqual(taches.reserver(), [])
+
+        Tache.objects.update(executer_apres=tache.date_creation)
+        tache, = taches.reserver()
+        taches.executer(tache)
+        tache.refresh_from_db()
+        self.assertEqual((tache.statut, tache.tentatives), ('echouee', 2))
+
+    def test_limite_de_concurrence(self):
+        for valeur in range(3):
+            taches.enfiler(tache_instable, valeur)
+        premiere, = taches.reserver(nombre=10)
+        self.assertEqual(taches.reserver(nombre=10), [])
+        taches.executer(premiere)
+        self.assertEqual(len(taches.reserver(nombre=10)), 1)
+
+    def test_lot_en_echec_rejoue_une_par_une(self):
+        for valeur in (1, 2, 3):
+            taches.enfiler(tache_groupee, [valeur])
+        Tache.objects.filter(arguments__args=[[2]]).update(arguments={'args': [['échec']], 'kwargs': {}})
+        taches.executer_lot(taches.reserver(['tests_lot']))
+        self.assertEqual(executions_test, [1, 3])
+        self.assertEqual(sorted(Tache.objects.values_list('statut', flat=True)), ['en_attente', 'terminee', 'terminee'])
+
+    def test_travailleur(self):
+        for valeur in range(3):
+            taches.enfiler(tache_instable, valeur)
+        call_command('travailleur_taches', '--une-fois', stdout=io.StringIO())
+        self.assertEqual(executions_test, [0, 1, 2])
+        self.assertEqual(Tache.objects.filter(statut='terminee').count(), 3)
+
+
+@override_settings(GEOCODAGE_CACHE_ALIAS='default', GEOCODAGE_DISJONCTEUR_SEUIL=2, GEOCODAGE_BUDGET_NOUVEAUX_ESSAIS=0)
+class ClientAPIAdresseTests(TestCase):
+    """API adresse en panne : disjoncteur, réponse expirée du cache en secours, géocodage différé du client."""
+
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+        geocodage._cache_local.clear()
+        self.client_api = geocodage.ClientAPIAdresse()
+        remplacement = mock.patch.object(geocodage, '_client', self.client_api)
+        remplacement.start()
+        self.addCleanup(remplacement.stop)
+        self.appels = mock.patch.object(self.client_api.session, 'get', side_effect=requests.ConnectTimeout()).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_disjoncteur(self):
+        for _ in range(2):
+            with self.assertRaises(geocodage.APIAdresseIndisponible):
+                geocodage.rechercher_adresse('1 rue de Paris')
+        # Circuit ouvert : plus aucun appel à l'API
+        with self.assertRaises(geocodage.APIAdresseIndisponible):
+            geocodage.rechercher_adresse('1 rue de Paris')
+        self.assertEqual(self.appels.call_count, 2)
+        self.assertEqual(self.client_api.etat()['disjoncteur'], 'ouvert')
+
+        # Après le délai, un appel d'essai réussi referme le circuit
+        self.client_api.disjoncteur._ouvert_depuis -= self.client_api.disjoncteur.delai
+        self.appels.side_effect = None
+        self.appels.return_value = mock.Mock(status_code=200, json=lambda: {'features': []})
+        self.assertEqual(geocodage.rechercher_adresse('1 rue de Paris'), {'features': []})
+        etat = self.client_api.etat()
+        self.assertEqual((etat['disjoncteur'], etat['refus_disjoncteur'], etat['echecs']), ('ferme', 1, 2))
+
+    def test_reponse_expiree_en_secours(self):
+        from django.core.cache import cache
+
+        donnees = {'features': [{'geometry': {'coordinates': [2.75, 48.87]}, 'properties': {'label': '1 Rue de Paris'}}]}
+        cache.set('geocodage:' + hashlib.sha1(b'1 rue de paris').hexdigest(),
+                  {'donnees': donnees, 'expiration': 0}, None)
+        self.assertEqual(geocodage.rechercher_adresse('1 rue de Paris'), donnees)
+        self.assertEqual(self.client_api.etat()['cache_perime'], 1)
+
+    def test_geocodage_differe(self):
+        api = APIClient()
+        api.force_authenticate(User.objects.create_user(username='client'))
+        reponse = api.post('/clients/', {'adresse': '1 rue de Paris', 'telephone': '+33600000000'})
+        self.assertEqual(reponse.status_code, 201)
+        client = Client.objects.get()
+        self.assertIsNone(client.latitude)
+        tache = Tache.objects.get()
+        self.assertEqual((tache.nom, tache.arguments['args']), ('geocodage.client', [client.pk]))
+
+
+class IndexAdressesTests(TestCase):
+    """Index BAN local : recherche exacte ou approchée, au format de l'API adresse, sans appel réseau."""
+
+    def setUp(self):
+        dossier = tempfile.TemporaryDirectory()
+        self.addCleanup(dossier.cleanup)
+        extrait = os.path.join(dossier.name, 'adresses-77.csv')
+        with open(extrait, 'w', encoding='utf-8') as fichier:
+            fichier.write('id;numero;rep;nom_voie;code_postal;nom_commune;lon;lat\n')
+            for numero in range(1, 40):
+                fichier.write(f"77307_{numero};{numero};;Avenue de l'Europe;77144;Montévrain;2.7{numero:02d};48.87\n")
+            fichier.write("77307_b;3;bis;Avenue de l'Europe;77144;Montévrain;2.8;48.88\n")
+            fichier.write('77058_1;1;;Rue de Paris;77600;Bussy-Saint-Georges;2.70;48.84\n')
+        chemin = os.path.join(dossier.name, 'adresses.idx')
+        call_command('indexer_adresses', chemin, extrait, stdout=io.StringIO())
+
+        reglages = override_settings(GEOCODAGE_INDEX_FICHIER=chemin)
+        reglages.enable()
+        self.addCleanup(reglages.disable)
+        mock.patch.object(index_adresses, '_index', None).start()
+        self.addCleanup(mock.patch.stopall)
+        self.api = mock.patch.object(geocodage.client_api_adresse().session, 'get').start()
+
+    def premier_resultat(self, adresse):
+        donnees = geocodage.rechercher_adresse(adresse)
+        return donnees['features'][0] if donnees['features'] else None
+
+    def test_recherche(self):
+        resultat = self.premier_resultat("12 avenue de l'Europe 77144 MONTEVRAIN")
+        self.assertEqual(resultat['properties']['label'], "12 Avenue de l'Europe 77144 Montévrain")
+        self.assertEqual(resultat['geometry']['coordinates'], [2.712, 48.87])
+        # Abréviation, code postal absent : recherche approchée par trigrammes
+        self.assertEqual(self.premier_resultat('3 bis av de l europe montevrain')['properties']['label'],
+                         "3 bis Avenue de l'Europe 77144 Montévrain")
+        # Numéro inconnu : position de la voie
+        self.assertEqual(self.premier_resultat("99 Avenue de l'Europe 77144 Montévrain")['properties']['type'], 'street')
+        self.api.assert_not_called()
+
+    def test_adresse_absente(self):
+        self.api.return_value = mock.Mock(status_code=200, json=lambda: {'features': []})
+        self.assertIsNone(self.premier_resultat('5 chemin des Vignes 13100 Aix-en-Provence'))
+        self.assertEqual(self.api.call_count, 1)
+        with override_settings(GEOCODAGE_INDEX_SEUL=True):
+            self.assertIsNone(self.premier_resultat('5 chemin des Vignes 13100 Aix'))
+        self.assertEqual(self.api.call_count, 1)
+
+
+def reponse_api_adresse(statut=200, features=()):
+    return mock.Mock(status_code=statut, json=lambda: {'features': list(features)} if statut == 200 else {'code': statut})
+
+
+ADRESSE_TROUVEE = {'geometry': {'coordinates': [2.75, 48.87]}, 'properties': {'label': '1 Rue de Paris 77144 Montévrain'}}
+
+
+@override_settings(GEOCODAGE_CACHE_ALIAS='default', GEOCODAGE_CACHE_TTL=3600, GEOCODAGE_CACHE_TTL_NEGATIF=60)
+class CacheGeocodageTests(TestCase):
+    """Cache des réponses de l'API adresse : durées de vie, erreurs non mises en cache, cache persistant indisponible."""
+
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+        geocodage._cache_local.clear()
+        mock.patch.object(geocodage, '_client', geocodage.ClientAPIAdresse()).start()
+        self.addCleanup(mock.patch.stopall)
+        self.api = mock.patch.object(geocodage._client.session, 'get').start()
+
+    def test_cache_lru_expiration(self):
+        cache_lru = CacheLRU(taille_max=2)
+        with mock.patch.object(geocodage.time, 'monotonic', return_value=1000):
+            cache_lru.set('a', 1, ttl=10)
+            cache_lru.set('b', 2, ttl=100)
+            self.assertEqual(cache_lru.get('a'), 1)
+            # 'a' vient d'être lue : c'est 'b' qui est évincée
+            cache_lru.set('c', 3, ttl=100)
+            self.assertIsNone(cache_lru.get('b'))
+        with mock.patch.object(geocodage.time, 'monotonic', return_value=1011):
+            self.assertIsNone(cache_lru.get('a'))
+            self.assertEqual(cache_lru.get('c'), 3)
+
+    def test_duree_de_vie_selon_resultat(self):
+        from django.core.cache import cache
+
+        self.api.side_effect = [reponse_api_adresse(features=[ADRESSE_TROUVEE]), reponse_api_adresse()]
+        maintenant = 1_000_000
+        with mock.patch.object(geocodage.time, 'time', return_value=maintenant), \
+                mock.patch.object(geocodage.time, 'monotonic', return_value=maintenant):
+            geocodage.rechercher_adresse('1 rue de Paris')
+            geocodage.rechercher_adresse('999 rue Inconnue')
+            for adresse, ttl in (('1 rue de paris', 3600), ('999 rue inconnue', 60)):
+                entree = cache.get('geocodage:' + hashlib.sha1(adresse.encode()).hexdigest())
+                self.assertEqual(entree['expiration'], maintenant + ttl)
+                self.assertEqual(geocodage._cache_local._entrees[adresse][0], maintenant + ttl)
+            # Servie depuis le cache local, sans nouvel appel
+            geocodage.rechercher_adresse('1 Rue de Paris')
+        self.assertEqual(self.api.call_count, 2)
+
+    def test_erreur_api_non_mise_en_cache(self):
+        from django.core.cache import cache
+
+        self.api.return_value = reponse_api_adresse(400)
+        self.assertEqual(geocodage.rechercher_adresse('1 rue de Paris'), {'code': 400})
+        geocodage.rechercher_adresse('1 rue de Paris')
+        self.assertEqual(self.api.call_count, 2)
+        self.assertIsNone(cache.get('geocodage:' + hashlib.sha1(b'1 rue de paris').hexdigest()))
+
+    def test_cache_persistant_indisponible(self):
+        from django.db import DatabaseError
+
+        cache_en_panne = mock.Mock(**{'get.side_effect': DatabaseError, 'set.side_effect': DatabaseError})
+        self.api.return_value = reponse_api_adresse(features=[ADRESSE_TROUVEE])
+        with mock.patch.object(geocodage, '_cache_persistant', return_value=cache_en_panne):
+            self.assertEqual(geocodage.rechercher_adresse('1 rue de Paris')['features'], [ADRESSE_TROUVEE])
+            geocodage.rechercher_adresse('1 rue de Paris')
+        self.assertEqual(self.api.call_count, 1)
+
+
+@override_settings(GEOCODAGE_CACHE_ALIAS='default')
+class CoordonneesClientTests(TestCase):
+    """Coordonnées du client : enregistrées à la validation de l'adresse, effacées si elle change, rattrapage."""
+
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+        geocodage._cache_local.clear()
+        mock.patch.object(geocodage, '_client', geocodage.ClientAPIAdresse()).start()
+        self.addCleanup(mock.patch.stopall)
+        self.api = mock.patch.object(geocodage._client.session, 'get',
+                                     return_value=reponse_api_adresse(features=[ADRESSE_TROUVEE])).start()
+
+    def test_coordonnees_enregistrees_a_la_validation(self):
+        api = APIClient()
+        api.force_authenticate(User.objects.create_user(username='client'))
+        reponse = api.post('/clients/', {'adresse': '1 rue de Paris', 'telephone': '+33600000000'})
+        self.assertEqual(reponse.status_code, 201)
+        client = Client.objects.get()
+        self.assertEqual((client.adresse, client.latitude, client.longitude),
+                         (ADRESSE_TROUVEE['properties']['label'], 48.87, 2.75))
+        self.assertFalse(Tache.objects.exists())
+
+    def test_changement_d_adresse_hors_api(self):
+        client = Client.objects.create(adresse='1 rue de Paris', latitude=48.87, longitude=2.75)
+        client = Client.objects.get(pk=client.pk)
+        client.telephone = '+33600000000'
+        client.save()
+        self.assertEqual(client.latitude, 48.87)
+
+        client.adresse = '2 rue de Lyon'
+        client.save(update_fields=['adresse'])
+        client.refresh_from_db()
+        self.assertIsNone(client.latitude)
+        tache = Tache.objects.get()
+        self.assertTrue(taches._demarrer(tache))
+        taches.executer(tache)
+        client.refresh_from_db()
+        self.assertEqual((client.latitude, client.longitude), (48.87, 2.75))
+
+    def test_commande_de_rattrapage(self):
+        clients = Client.objects.bulk_create([Client(adresse=f'{numero} rue de Paris') for numero in range(3)])
+        Client.objects.filter(pk=clients[0].pk).update(adresse='')
+        sortie = io.StringIO()
+        call_command('geocoder_clients', stdout=sortie, stderr=io.StringIO())
+        self.assertIn('2 client(s) géocodé(s)', sortie.getvalue())
+        self.assertEqual(Client.objects.filter(latitude=48.87).count(), 2)
+
+
+class ReservationUnLivreurTests(TestCase):
+    """Une réservation ne verrouille qu'un livreur à la fois et passe au suivant si un candidat est déjà pris."""
+
+    def setUp(self):
+        from .index_livreurs import index_livreurs
+
+        index_livreurs.vider()
+        self.addCleanup(index_livreurs.vider)
+        self.livreurs = [Livreur.objects.create(statut='disponible', latitude=48.87 + i * 0.01, longitude=2.75)
+                         for i in range(4)]
+
+    def test_une_ligne_verrouillee_par_essai(self):
+        from django.db import transaction
+        from .index_livreurs import index_livreurs, reserver_livreur
+
+        index_livreurs.charger()
+        with transaction.atomic(), CaptureQueriesContext(connection) as requetes:
+            self.assertEqual(reserver_livreur(48.87, 2.75), self.livreurs[0])
+        selections = [requete['sql'] for requete in requetes.captured_queries
+                      if requete['sql'].startswith('SELECT') and 'backoffice_livreur' in requete['sql']]
+        self.assertTrue(selections)
+        self.assertTrue(all(sql.rstrip().endswith('LIMIT 1') for sql in selections), selections)
+
+    def test_candidat_verrouille_par_une_autre_commande(self):
+        from .index_livreurs import _verrouiller_disponible, reserver_livreur
+
+        essais = []
+
+        def verrouiller(livreurs):
+            essais.append(livreurs)
+            # Le plus proche est verrouillé par une commande concurrente : SKIP LOCKED ne le renvoie pas
+            return None if len(essais) == 1 else _verrouiller_disponible(livreurs)
+
+        with mock.patch('backoffice.index_livreurs._verrouiller_disponible', side_effect=verrouiller):
+            self.assertEqual(reserver_livreur(48.87, 2.75), self.livreurs[1])
+        self.assertEqual(len(essais), 2)
+        self.assertEqual(Livreur.objects.filter(statut='disponible').count(), 3)
+
+
+class IndexLivreursTests(TestCase):
+    """Choix du livreur le plus proche et mise à jour de l'index malgré les écritures qui l'ignorent."""
+
+    def setUp(self):
+        from .index_livreurs import index_livreurs
+
+        self.index = index_livreurs
+        self.index.vider()
+        self.addCleanup(self.index.vider)
+        # Du plus proche au plus éloigné de (48.87, 2.75), créés dans l'ordre inverse des identifiants
+        self.loin, self.moyen, self.proche = (
+            Livreur.objects.create(statut='disponible', latitude=48.87 + ecart, longitude=2.75)
+            for ecart in (0.05, 0.02, 0.001))
+
+    def reserver(self):
+        from .index_livreurs import reserver_livreur
+
+        return reserver_livreur(48.87, 2.75)
+
+    def test_livreur_le_plus_proche(self):
+        self.assertEqual(self.reserver(), self.proche)
+        self.assertEqual(self.reserver(), self.moyen)
+        self.assertEqual(self.reserver(), self.loin)
+        self.assertIsNone(self.reserver())
+
+    def test_index_perime_reservation_ailleurs(self):
+        self.index.charger()
+        # Réservé par un autre processus : aucun signal, l'index croit le livreur encore disponible
+        Livreur.objects.filter(pk=self.proche.pk).update(statut='reserve')
+        self.assertEqual(self.reserver(), self.moyen)
+        self.assertNotIn(self.proche.pk, self.index.plus_proches(48.87, 2.75))
+
+    def test_index_perime_tous_candidats_pris(self):
+        from .index_livreurs import reserver_livreur
+
+        self.index.charger()
+        Livreur.objects.filter(pk__in=[self.proche.pk, self.moyen.pk]).update(statut='reserve')
+        # Candidats de l'index tous pris : on continue par distance, pas par identifiant
+        self.assertEqual(reserver_livreur(48.87, 2.75, nombre_candidats=2), self.loin)
+
+    def test_index_recharge_apres_ttl(self):
+        self.index.charger()
+        Livreur.objects.filter(pk=self.loin.pk).update(latitude=48.8701)
+        self.assertEqual(self.index.plus_proches(48.87, 2.75, 1), [self.proche.pk])
+        with override_settings(INDEX_LIVREURS_TTL=0):
+            self.assertEqual(self.index.plus_proches(48.87, 2.75, 1), [self.loin.pk])
+
+    def test_position_recue_hors_index(self):
+        Livreur.objects.filter(pk=self.loin.pk).update(statut='en_cours_de_livraison')
+        self.index.charger()
+        # Position reçue pendant la livraison, pas encore écrite en base par le tampon
+        self.index.deplacer(self.loin.pk, 48.8702, 2.75)
+        self.loin.refresh_from_db()
+        self.loin.statut = 'disponible'
+        self.loin.save()
+        self.assertEqual(self.index.plus_proches(48.87, 2.75, 1), [self.loin.pk])
+
+
+@override_settings(GEOCODAGE_CACHE_ALIAS='default', GEOCODAGE_BUDGET_NOUVEAUX_ESSAIS=1)
+class NouveauxEssaisAPIAdresseTests(TestCase):
+    """Un seul nouvel essai par recherche, après une attente aléatoire, même avec un budget disponible."""
+
+    def setUp(self):
+        self.client_api = geocodage.ClientAPIAdresse()
+        self.appels = mock.patch.object(self.client_api.session, 'get', side_effect=requests.ConnectTimeout()).start()
+        self.attentes = mock.patch.object(geocodage.time, 'sleep').start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_un_seul_nouvel_essai(self):
+        self.assertGreaterEqual(self.client_api.budget, 5)
+        with self.assertRaises(geocodage.APIAdresseIndisponible):
+            self.client_api.rechercher('1 rue de Paris')
+        self.assertEqual(self.appels.call_count, 2)
+        self.assertEqual(self.client_api.etat()['nouveaux_essais'], 1)
+        (attente,), _ = self.attentes.call_args
+        self.assertTrue(0 < attente <= self.client_api.attente_nouvel_essai)
+
+    def test_nouvel_essai_reussi(self):
+        self.appels.side_effect = [requests.ConnectTimeout(), mock.Mock(status_code=200, json=lambda: {'features': []})]
+        self.assertEqual(self.client_api.rechercher('1 rue de Paris'), (200, {'features': []}))
+        self.assertEqual(self.client_api.etat()['disjoncteur'], 'ferme')
+
+
+class CatalogueTests(TestCase):
+    """ETag du catalogue : 304 tant que rien ne change, nouvelle version après création, modification ou suppression."""
+
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+        self.produits = [Produit.objects.create(nom_produit=nom, prix=10) for nom in ('Pizza', 'Tiramisu')]
+
+    def lire(self, etag=None):
+        reponse = self.client.get('/produits/', headers={'If-None-Match': etag} if etag else {})
+        noms = None
+        if reponse.status_code == 200:
+            donnees = reponse.json()
+            noms = sorted(produit['nom_produit'] for produit in donnees.get('results', donnees))
+        return reponse, noms
+
+    def test_etag_et_304(self):
+        reponse, noms = self.lire()
+        self.assertEqual(noms, ['Pizza', 'Tiramisu'])
+        self.assertEqual(reponse['Cache-Control'], 'no-cache')
+        self.assertNotIn('Last-Modified', reponse)
+        with self.assertNumQueries(0):
+            reponse_304, _ = self.lire(reponse['ETag'])
+        self.assertEqual(reponse_304.status_code, 304)
+        self.assertEqual(reponse_304['ETag'], reponse['ETag'])
+
+    def verifier_invalidation(self, modifier, attendus):
+        reponse, _ = self.lire()
+        modifier()
+        nouvelle, noms = self.lire(reponse['ETag'])
+        self.assertEqual(nouvelle.status_code, 200)
+        self.assertNotEqual(nouvelle['ETag'], reponse['ETag'])
+        self.assertEqual(noms, attendus)
+
+    def test_invalidation_creation(self):
+        self.verifier_invalidation(lambda: Produit.objects.create(nom_produit='Soda'), ['Pizza', 'Soda', 'Tiramisu'])
+
+    def test_invalidation_modification(self):
+        def renommer():
+            self.produits[0].nom_produit = 'Calzone'
+            self.produits[0].save()
+        self.verifier_invalidation(renommer, ['Calzone', 'Tiramisu'])
+
+    def test_invalidation_suppression(self):
+        # Le produit supprimé n'est pas le dernier modifié : seule la suppression change la version
+        self.verifier_invalidation(self.produits[0].delete, ['Tiramisu'])
+
+    def test_modification_par_un_autre_processus(self):
+        from . import catalogue
+
+        reponse, _ = self.lire()
+        # Modification faite par un autre processus : le cache de celui-ci n'est pas invalidé
+        with mock.patch.object(catalogue, 'invalider_catalogue'):
+            Produit.objects.create(nom_produit='Soda')
+        self.assertEqual(self.lire(reponse['ETag'])[0].status_code, 304)
+        # Au-delà de CATALOGUE_VERSION_TTL, le jeton est recalculé en base
+        with mock.patch('time.time', return_value=time.time() + 6):
+            nouvelle, noms = self.lire(reponse['ETag'])
+        self.assertEqual(nouvelle.status_code, 200)
+        self.assertEqual(noms, ['Pizza', 'Soda', 'Tiramisu'])
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET='whsec_test', TACHES_EXECUTION_IMMEDIATE=True)
+class WebhookStripeTests(TestCase):
+    """Webhook Stripe : signature vérifiée, événements traités une seule fois, paiement et commande mis à jour."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='client')
+        client_profil = Client.objects.create(user=self.user, adresse='1 rue de Paris', telephone='+33600000000')
+        livreur = Livreur.objects.create(user=User.objects.create_user(username='livreur'), statut='reserve')
+        self.commande = Commande.objects.create(client=client_profil, livreur=livreur, montant_total=20, frais_livraison=0)
+        self.paiement = Paiement.objects.create(commande=self.commande, montant=20, payment_token='pi_test')
+
+    def envoyer(self, identifiant, type_evenement, signature=None):
+        import hmac
+
+        corps = json.dumps({'id': identifiant, 'object': 'event', 'type': type_evenement,
+                            'data': {'object': {'id': 'pi_test', 'object': 'payment_intent'}}})
+        instant = int(time.time())
+        if signature is None:
+            signature = hmac.new(b'whsec_test', f'{instant}.{corps}'.encode('utf-8'), hashlib.sha256).hexdigest()
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/stripe/webhook/', corps, content_type='application/json',
+                                    headers={'Stripe-Signature': f't={instant},v1={signature}'})
+
+    def statuts(self):
+        self.paiement.refresh_from_db()
+        self.commande.refresh_from_db()
+        return self.paiement.statut_paiement, self.commande.statut
+
+    def test_signature_invalide(self):
+        self.assertEqual(self.envoyer('evt_1', 'payment_intent.succeeded', signature='0' * 64).status_code, 400)
+        self.assertFalse(Tache.objects.filter(file='stripe').exists())
+        self.assertEqual(self.statuts(), ('en_attente', 'en_cours'))
+
+    def test_paiement_reussi(self):
+        self.assertEqual(self.envoyer('evt_1', 'payment_intent.succeeded').status_code, 200)
+        self.assertEqual(self.statuts(), ('payee', 'prise_en_charge'))
+        self.assertEqual(Tache.objects.get(file='stripe').statut, 'terminee')
+
+    def test_paiement_echoue_puis_reussi(self):
+        self.envoyer('evt_1', 'payment_intent.payment_failed')
+        self.assertEqual(self.statuts(), ('annule', 'en_cours'))
+        # Un échec reçu après la confirmation ne l'annule pas
+        Paiement.objects.filter(pk=self.paiement.pk).update(statut_paiement='payee')
+        self.envoyer('evt_2', 'payment_intent.payment_failed')
+        self.assertEqual(self.statuts()[0], 'payee')
+
+    def test_evenement_en_double(self):
+        from .models import EvenementStripe
+        from .webhooks import appliquer_evenements
+
+        self.envoyer('evt_1', 'payment_intent.succeeded')
+        self.envoyer('evt_1', 'payment_intent.succeeded')
+        self.assertEqual(Tache.objects.filter(file='stripe').count(), 1)
+        # Événement rejoué hors de la file (par exemple tâche reprise) : ignoré grâce à EvenementStripe
+        Paiement.objects.filter(pk=self.paiement.pk).update(statut_paiement='en_attente')
+        evenement = {'id': 'evt_1', 'type': 'payment_intent.succeeded', 'data': {'object': {'id': 'pi_test'}}}
+        self.assertEqual(appliquer_evenements([evenement]), 0)
+        self.assertEqual(self.statuts()[0], 'en_attente')
+        self.assertEqual(EvenementStripe.objects.count(), 1)
+
+    @override_settings(TACHES_EXECUTION_IMMEDIATE=False)
+    def test_evenements_appliques_par_lot(self):
+        from .models import EvenementStripe
+        from .webhooks import appliquer_evenements
+
+        for identifiant in ('evt_1', 'evt_2', 'evt_3'):
+            self.envoyer(identifiant, 'payment_intent.succeeded')
+        appels = []
+
+        def appliquer(evenements):
+            appels.append(sorted(evenement['id'] for evenement in evenements))
+            return appliquer_evenements(evenements)
+        appliquer.nom_tache, appliquer.groupable = appliquer_evenements.nom_tache, True
+
+        with mock.patch.dict(taches._registre, {appliquer_evenements.nom_tache: appliquer}):
+            call_command('travailleur_taches', '--une-fois', '--file', 'stripe', stdout=io.StringIO())
+        self.assertEqual(appels, [['evt_1', 'evt_2', 'evt_3']])
+        self.assertEqual(set(Tache.objects.filter(file='stripe').values_list('statut', flat=True)), {'terminee'})
+        self.assertEqual(EvenementStripe.objects.count(), 3)
+        self.assertEqual(self.statuts(), ('payee', 'prise_en_charge'))
+
+    def test_verification_sans_travailleur(self):
+        from datetime import timedelta
+        from django.utils.timezone import now
+        from .webhooks import appliquer_evenements
+
+        api = APIClient()
+        api.force_authenticate(self.user)
+        url = f'/createpaiement/{self.commande.pk}/verify_payment/'
+        intention = mock.patch('stripe.PaymentIntent.retrieve', return_value=mock.Mock(status='succeeded')).start()
+        self.addCleanup(mock.patch.stopall)
+        # Travailleur en service : le webhook fait foi, pas d'appel à Stripe
+        self.assertEqual(api.post(url).json()['status'], 'pending')
+        intention.assert_not_called()
+
+        # Événement en attente depuis trop longtemps : Stripe est interrogé directement
+        with override_settings(TACHES_EXECUTION_IMMEDIATE=False):
+            taches.enfiler(appliquer_evenements, [], cle_idempotence='stripe:evt_ancien')
+        Tache.objects.filter(file='stripe').update(executer_apres=now() - timedelta(minutes=10))
+        self.assertEqual(api.post(url).json()['status'], 'success')
+        intention.assert_called_once_with('pi_test')
+        self.assertEqual(self.statuts(), ('payee', 'prise_en_charge'))
+
+
+class AjoutLotProduitsTests(TestCase):
+    """Ajout de plusieurs produits à une commande en une requête (POST /commande_produits/lot/)."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='client')
+        client_profil = Client.objects.create(user=self.user, adresse='1 rue de Paris', telephone='+33600000000')
+        self.commande = Commande.objects.create(client=client_profil, montant_total=0, frais_livraison=0)
+        self.pizza = Produit.objects.create(nom_produit='Pizza', prix=12)
+        self.tiramisu = Produit.objects.create(nom_produit='Tiramisu', prix=6)
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def ajouter(self, lignes, commande=None):
+        return self.api.post('/commande_produits/lot/', {'commande': (commande or self.commande).pk, 'lignes': lignes},
+                             format='json')
+
+    def test_ajout_identifiants_et_total(self):
+        # Comme sur MySQL : bulk_create ne renvoie pas les identifiants des lignes insérées
+        with mock.patch.object(type(connection.features), 'can_return_rows_from_bulk_insert', False):
+            reponse = self.ajouter([{'produit': self.pizza.pk, 'quantite': 2}, {'produit': self.tiramisu.pk, 'quantite': 1}])
+        self.assertEqual(reponse.status_code, 201)
+        lignes = {ligne['id']: ligne for ligne in reponse.json()['lignes']}
+        self.assertEqual(set(lignes), set(CommandeProduit.objects.values_list('id', flat=True)))
+        self.assertEqual(sorted((ligne['produit_detail']['nom_produit'], ligne['quantite']) for ligne in lignes.values()),
+                         [('Pizza', 2), ('Tiramisu', 1)])
+        # 2 × 12 + 6 = 30 : livraison offerte au-delà de 19.99
+        self.assertEqual((reponse.json()['montant_total'], reponse.json()['frais_livraison']), ('30.00', '0.00'))
+        self.commande.refresh_from_db()
+        self.assertEqual((self.commande.montant_total, self.commande.frais_livraison), (30, 0))
+        self.assertEqual(Paiement.objects.get(commande=self.commande).montant, 30)
+
+    def test_produit_en_double(self):
+        reponse = self.ajouter([{'produit': self.pizza.pk, 'quantite': 1}, {'produit': self.pizza.pk, 'quantite': 2}])
+        self.assertEqual(reponse.status_code, 400)
+        self.assertFalse(CommandeProduit.objects.exists())
+
+    def test_produit_deja_dans_la_commande(self):
+        self.ajouter([{'produit': self.pizza.pk, 'quantite': 1}])
+        self.assertEqual(self.ajouter([{'produit': self.pizza.pk, 'quantite': 1}]).status_code, 400)
+        self.assertEqual(CommandeProduit.objects.count(), 1)
+
+    def test_produit_inconnu(self):
+        reponse = self.ajouter([{'produit': self.pizza.pk, 'quantite': 1}, {'produit': 999, 'quantite': 1}])
+        self.assertEqual(reponse.status_code, 400)
+        self.assertFalse(CommandeProduit.objects.exists())
+
+    def test_commande_d_un_autre_client(self):
+        autre = Client.objects.create(user=User.objects.create_user(username='autre'), adresse='2 rue de Paris',
+                                      telephone='+33600000001')
+        commande = Commande.objects.create(client=autre, montant_total=0, frais_livraison=0)
+        self.assertEqual(self.ajouter([{'produit': self.pizza.pk, 'quantite': 1}], commande).status_code, 403)
+        self.assertFalse(CommandeProduit.objects.exists())
+
+
+class TotalCommandeTests(TestCase):
+    """Le total calculé par la base après ajout, modification ou suppression d'une ligne suit l'ancien calcul Python."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='client')
+        client_profil = Client.objects.create(user=self.user, adresse='1 rue de Paris', telephone='+33600000000')
+        self.commande = Commande.objects.create(client=client_profil, montant_total=0, frais_livraison=0)
+        self.pizza = Produit.objects.create(nom_produit='Pizza', prix='12.50')
+        self.soda = Produit.objects.create(nom_produit='Soda', prix='2.30')
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def verifier_total(self):
+        from decimal import Decimal
+
+        # Calcul fait auparavant en Python, ligne par ligne
+        total = sum((ligne.quantite * ligne.produit.prix for ligne in
+                     CommandeProduit.objects.filter(commande=self.commande).select_related('produit')), Decimal('0.00'))
+        frais = Decimal('0.00') if total > Decimal('19.99') else Decimal('5.00')
+        self.commande.refresh_from_db()
+        self.assertEqual((self.commande.montant_total, self.commande.frais_livraison), (total, frais))
+        self.assertEqual(Paiement.objects.get(commande=self.commande).montant, total + frais)
+        return total, frais
+
+    def test_ajout_modification_suppression(self):
+        from decimal import Decimal
+
+        reponse = self.api.post('/commande_produits/', {'commande': self.commande.pk, 'produit': self.soda.pk, 'quantite': 3})
+        self.assertEqual(reponse.status_code, 201)
+        self.assertEqual(self.verifier_total(), (Decimal('6.90'), Decimal('5.00')))
+
+        reponse = self.api.post('/commande_produits/', {'commande': self.commande.pk, 'produit': self.pizza.pk, 'quantite': 1})
+        self.assertEqual(reponse.status_code, 201)
+        self.assertEqual(self.verifier_total(), (Decimal('19.40'), Decimal('5.00')))
+
+        # Passage au-dessus de 19.99 : livraison offerte
+        reponse = self.api.put(f"/commande_produits/{reponse.json()['id']}/",
+                               {'commande': self.commande.pk, 'produit': self.pizza.pk, 'quantite': 2})
+        self.assertEqual(reponse.status_code, 200)
+        self.assertEqual(self.verifier_total(), (Decimal('31.90'), Decimal('0.00')))
+
+        ligne = CommandeProduit.objects.get(produit=self.soda)
+        self.assertEqual(self.api.delete(f'/commande_produits/{ligne.pk}/').status_code, 204)
+        self.assertEqual(self.verifier_total(), (Decimal('25.00'), Decimal('0.00')))
+
+        CommandeProduit.objects.get().delete()
+        self.assertEqual(self.verifier_total(), (Decimal('0.00'), Decimal('5.00')))
+
+
+@override_settings(INSTRUMENTATION_SERVER_TIMING=True)
+class InstrumentationTests(TestCase):
+    """En-tête Server-Timing et rapport par route, sans modifier les classes de sérialiseurs de DRF."""
+
+    def setUp(self):
+        from .instrumentation import statistiques
+
+        Produit.objects.create(nom_produit='Pizza', prix=10)
+        self.admin = User.objects.create_user(username='admin', is_staff=True)
+        sauvegarde = statistiques._echantillons.copy()
+        statistiques._echantillons.clear()
+        self.addCleanup(lambda: (statistiques._echantillons.clear(), statistiques._echantillons.update(sauvegarde)))
+
+    def test_server_timing(self):
+        from django.core.cache import cache
+        from .serializers import ProduitSerializer
+
+        cache.clear()
+        representation = ProduitSerializer.to_representation
+
+        def representation_lente(serialiseur, instance):
+            time.sleep(0.02)
+            return representation(serialiseur, instance)
+
+        with mock.patch.object(ProduitSerializer, 'to_representation', representation_lente):
+            reponse = self.client.get('/produits/')
+        self.assertEqual(reponse.status_code, 200)
+        mesures = {partie.split(';')[0].strip(): partie for partie in reponse['Server-Timing'].split(',')}
+        self.assertEqual(set(mesures), {'db', 'externe', 'serialisation', 'total'})
+        self.assertRegex(mesures['db'], r'desc="[1-9]\d* requetes"')
+        # Le temps passé dans les sérialiseurs est compté, pas seulement l'encodage JSON
+        duree = float(re.search(r'dur=([\d.]+)', mesures['serialisation']).group(1))
+        self.assertGreaterEqual(duree, 20)
+        self.assertLessEqual(duree, float(re.search(r'dur=([\d.]+)', mesures['total']).group(1)))
+
+    def test_rendu_mesure_sans_modifier_drf(self):
+        from rest_framework import serializers
+        from .instrumentation import JSONRendererMesure, mesurer
+
+        self.assertFalse(hasattr(serializers.Serializer.data.fget, 'instrumentee'))
+        with mock.patch('backoffice.instrumentation.mesurer', wraps=mesurer) as mesure:
+            reponse = self.client.get('/produits/')
+        self.assertIsInstance(reponse.accepted_renderer, JSONRendererMesure)
+        mesure.assert_any_call('serialisation')
+
+    def test_rapport(self):
+        self.client.get('/produits/')
+        self.client.get('/produits/')
+        self.client.force_login(self.admin)
+        rapport = self.client.get('/api/performances/').json()
+        ligne = next(ligne for ligne in rapport if ligne['route'] == 'GET ^produits/$')
+        self.assertEqual(ligne['appels'], 2)
+        for cle in ('requetes_sql_moyenne', 'p50_ms', 'p95_ms', 'p99_ms', 'db_p95_ms', 'externe_p95_ms', 'serialisation_p95_ms'):
+            self.assertIn(cle, ligne)
+
+
+class PaginationTests(TestCase):
+    """Pagination par curseur : paramètre taille, plafond, ordre stable par identifiant décroissant."""
+
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+        Produit.objects.bulk_create([Produit(nom_produit=f'Produit {i}', prix=10) for i in range(7)])
+        self.api = APIClient()
+        self.api.force_authenticate(User.objects.create_user(username='admin', is_staff=True))
+
+    def pages(self, url):
+        while url:
+            donnees = self.api.get(url).json()
+            yield donnees
+            url = donnees['next']
+
+    def test_taille(self):
+        donnees = self.api.get('/produits/', {'taille': 2}).json()
+        self.assertEqual(set(donnees), {'next', 'previous', 'results'})
+        self.assertEqual(len(donnees['results']), 2)
+        self.assertIsNotNone(donnees['next'])
+        self.assertEqual(len(self.api.get('/produits/').json()['results']), 7)
+
+    def test_taille_plafonnee(self):
+        Produit.objects.bulk_create([Produit(nom_produit=f'Lot {i}', prix=10) for i in range(200)])
+        self.assertEqual(len(self.api.get('/produits/', {'taille': 500}).json()['results']), 200)
+
+    def test_ordre_stable_entre_pages(self):
+        attendus = list(Produit.objects.order_by('-id').values_list('id', flat=True))
+        vus = []
+        for numero, page in enumerate(self.pages('/produits/?taille=3')):
+            vus += [produit['id'] for produit in page['results']]
+            if numero == 0:
+                # Un produit ajouté pendant le parcours ne décale pas les pages suivantes
+                Produit.objects.create(nom_produit='Nouveau', prix=10)
+        self.assertEqual(vus, attendus)
+
+    def test_listes_au_nouveau_format(self):
+        client_profil = Client.objects.create(user=User.objects.create_user(username='client'), adresse='1 rue de Paris',
+                                              telephone='+33600000000')
+        Livreur.objects.create(user=User.objects.create_user(username='livreur'), statut='disponible')
+        commande = Commande.objects.create(client=client_profil, montant_total=20, frais_livraison=0)
+        Paiement.objects.create(commande=commande, montant=20)
+        for url in ('/produits/', '/clients/', '/livreurs/', '/commandes/', '/paiements/'):
+            with self.subTest(url=url):
+                reponse = self.api.get(url)
+                self.assertEqual(reponse.status_code, 200)
+                self.assertEqual(set(reponse.json()), {'next', 'previous', 'results'})
+                self.assertTrue(reponse.json()['results'])
+
+
+class IndexTests(TestCase):
+    """Les index déclarés dans Meta.indexes sont créés par les migrations et utilisés par les requêtes fréquentes."""
+
+    def test_index_crees(self):
+        from django.apps import apps
+
+        with connection.cursor() as curseur:
+            for modele in apps.get_app_config('backoffice').get_models():
+                contraintes = connection.introspection.get_constraints(curseur, modele._meta.db_table)
+                for index in modele._meta.indexes:
+                    with self.subTest(index=index.name):
+                        self.assertIn(index.name, contraintes)
+                        colonnes = [modele._meta.get_field(champ).column for champ in index.fields]
+                        self.assertEqual(contraintes[index.name]['columns'], colonnes)
+
+    def test_migrations_a_jour(self):
+        # Échoue si un index (ou tout autre changement des modèles) n'a pas de migration
+        call_command('makemigrations', 'backoffice', '--check', '--dry-run', stdout=io.StringIO())
+
+    def test_plan_recherche_webhook(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest("Plan d'exécution propre à SQLite")
+        plan = Paiement.objects.filter(payment_token__in=['pi_test']).exclude(statut_paiement='payee').explain()
+        self.assertIn('paiement_token_idx', plan)
+
+
+class MigrationIndexTests(TransactionTestCase):
+    """La migration des index s'applique (et s'annule) sur une base existante."""
+
+    def test_migration_0025(self):
+        from django.db.migrations.executor import MigrationExecutor
+
+        def migrer(cible):
+            executeur = MigrationExecutor(connection)
+            executeur.loader.build_graph()
+            executeur.migrate([('backoffice', cible)])
+
+        def index_paiement():
+            with connection.cursor() as curseur:
+                return connection.introspection.get_constraints(curseur, Paiement._meta.db_table)
+
+        derniere = MigrationExecutor(connection).loader.graph.leaf_nodes('backoffice')[0][1]
+        self.addCleanup(migrer, derniere)
+        migrer('0024_evenementstripe')
+        self.assertNotIn('paiement_token_idx', index_paiement())
+        migrer('0025_index_requetes_frequentes')
+        self.assertIn('paiement_token_idx', index_paiement())
+
+
+class ProfilsTests(TestCase):
+    """Le profil client ou livreur est lu en une requête au plus, puis gardé sur l'utilisateur."""
+
+    def setUp(self):
+        Client.objects.create(user=User.objects.create_user(username='client'), adresse='1 rue de Paris',
+                              telephone='+33600000000')
+        Livreur.objects.create(user=User.objects.create_user(username='livreur'), statut='disponible')
+        User.objects.create_user(username='admin', is_staff=True)
+
+    def verifier(self, username, est_client, est_livreur):
+        from .profils import client_de, livreur_de
+
+        user = User.objects.get(username=username)
+        with self.assertNumQueries(2):
+            self.assertEqual(client_de(user) is not None, est_client)
+            self.assertEqual(livreur_de(user) is not None, est_livreur)
+        # Profil (ou absence de profil) gardé en cache sur l'instance
+        with self.assertNumQueries(0):
+            client_de(user)
+            livreur_de(user)
+
+    def test_client(self):
+        self.verifier('client', True, False)
+
+    def test_livreur(self):
+        self.verifier('livreur', False, True)
+
+    def test_administrateur(self):
+        self.verifier('admin', False, False)
+
+    def test_profil_joint_par_l_authentification(self):
+        from .profils import client_de
+
+        user = User.objects.select_related('client').get(username='client')
+        with self.assertNumQueries(0):
+            self.assertIsNotNone(client_de(user))
+
+
+class MigrationProfilsUniquesTests(TransactionTestCase):
+    """La migration 0026 fusionne les profils en double avant d'imposer un profil par utilisateur."""
+
+    def test_fusion_des_doublons(self):
+        from django.db.migrations.executor import MigrationExecutor
+
+        def migrer(cible):
+            executeur = MigrationExecutor(connection)
+            executeur.loader.build_graph()
+            executeur.migrate([('backoffice', cible)])
+            return executeur.loader.project_state(('backoffice', cible)).apps
+
+        derniere = MigrationExecutor(connection).loader.graph.leaf_nodes('backoffice')[0][1]
+        self.addCleanup(migrer, derniere)
+        apps = migrer('0025_index_requetes_frequentes')
+        ClientAncien = apps.get_model('backoffice', 'Client')
+        LivreurAncien = apps.get_model('backoffice', 'Livreur')
+        CommandeAncienne = apps.get_model('backoffice', 'Commande')
+        user_id = User.objects.create_user(username='double').pk
+        clients = [ClientAncien.objects.create(user_id=user_id, adresse='1 rue de Paris') for _ in range(3)]
+        livreurs = [LivreurAncien.objects.create(user_id=user_id, statut='disponible') for _ in range(2)]
+        commande = CommandeAncienne.objects.create(client=clients[2], livreur=livreurs[1], montant_total=20)
+
+        migrer('0026_client_livreur_user_unique')
+        self.assertEqual(list(Client.objects.values_list('pk', flat=True)), [clients[0].pk])
+        self.assertEqual(list(Livreur.objects.values_list('pk', flat=True)), [livreurs[0].pk])
+        commande = Commande.objects.get(pk=commande.pk)
+        self.assertEqual((commande.client_id, commande.livreur_id), (clients[0].pk, livreurs[0].pk))
@@ -1,6 +1,19 @@
 from django.urls import path
-from .views import create_payment_intent
+from .views import create_payment_intent, etat_api_adresse, rapport_performances
+from .paiements_async import create_payment_intent_async, verify_payment_async
+from .evenements import flux_commande
+from .positions import position_livreur
+from .webhooks import stripe_webhook
 
 urlpatterns = [
     path('create-payment-intent/', create_payment_intent, name='create-payment-intent'),
+    path('stripe/webhook/', stripe_webhook, name='stripe-webhook'),
+    path('livreurs/position/', position_livreur, name='position-livreur'),
+    path('performances/', rapport_performances, name='rapport-performances'),
+    path('performances/api-adresse/', etat_api_adresse, name='etat-api-adresse'),
+    # Versions asynchrones (ASGI) des actions de paiement de CommandePaiementViewSet
+    path('commandes/<int:pk>/create_payment_intent/', create_payment_intent_async, name='create-payment-intent-async'),
+    path('commandes/<int:pk>/verify_payment/', verify_payment_async, name='verify-payment-async'),
+    # Flux des changements de statut d'une commande (Server-Sent Events, serveur ASGI), 501 sous WSGI
+    path('commandes/<int:pk>/evenements/', flux_commande, name='flux-commande'),
 ]
@@ -1,20 +1,27 @@
 import stripe
-import requests
-from datetime import datetime, timedelta
 from django.shortcuts import render
 from django.http import HttpResponse, Http404
 from django.contrib.auth.models import User
 from .models import Client, Commande, CommandeProduit, Produit, Livreur, Paiement
-from .serializers import UserSerializer, ClientSerializer, CommandeSerializer, CommandeProduitSerializer, ProduitSerializer, LivreurSerializer, PaiementSerializer
+from .geocodage import client_api_adresse
+from .catalogue import reponse_catalogue
+from .dispatch import tableau_dispatch
+from .eta import moteur_eta
+from .evenements import publier_commande
+from .instrumentation import mesurer, statistiques
+from .profils import client_de, livreur_de
+from .serializers import UserSerializer, ClientSerializer, CommandeSerializer, CommandeProduitSerializer, CommandeProduitLotSerializer, ProduitSerializer, LivreurSerializer, PaiementSerializer
+from .webhooks import evenements_en_retard
 from rest_framework import viewsets, mixins, generics, status
-from rest_framework.permissions import AllowAny, IsAuthenticated, IsAuthenticatedOrReadOnly
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated, IsAuthenticatedOrReadOnly
 from rest_framework.response import Response
 from rest_framework.status import HTTP_201_CREATED
 from rest_framework.exceptions import PermissionDenied, NotFound, ValidationError
 from rest_framework.decorators import action
 from django.conf import settings
 from django.http import JsonResponse
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, permission_classes
+from django.db.models import Prefetch, Q
 
 
 stripe.api_key = settings.STRIPE_SECRET_KEY
@@ -154,14 +161,7 @@ class ClientViewSet(viewsets.ModelViewSet):
         user = self.request.user
         pk = self.kwargs.get('pk')
 
-        if pk == 'client':
-            # Cas où 'pk' est explicitement 'client', renvoyer le client de l'utilisateur connecté
-            try:
-                return Client.objects.get(user=user)
-            except Client.DoesNotExist:
-                raise NotFound("Aucun client associé à cet utilisateur.")
-
-        if pk:
+        if pk and pk != 'client':
             if user.is_staff:
                 # L'administrateur peut accéder à n'importe quel client
                 return super().get_object()
@@ -169,24 +169,24 @@ class ClientViewSet(viewsets.ModelViewSet):
                 # L'utilisateur essaie d'accéder à un client par ID, vérifier si c'est son ID
                 try:
                     pk = int(pk)  # S'assurer que pk est un entier
-                    client = Client.objects.get(pk=pk, user=user)
-                    return client
-                except Client.DoesNotExist:
-                    raise PermissionDenied("Vous n'avez pas la permission de voir ce client.")
                 except ValueError:
                     raise ValidationError("L'identifiant doit être un nombre.")
-        else:
-            # Aucun ID fourni, retourner le client de l'utilisateur connecté
-            try:
-                return Client.objects.get(user=user)
-            except Client.DoesNotExist:
-                raise NotFound("Aucun client associé à cet utilisateur.")
+                client = client_de(user)
+                if client is None or client.pk != pk:
+                    raise PermissionDenied("Vous n'avez pas la permission de voir ce client.")
+                return client
+
+        # 'pk' vaut 'client' ou est absent : renvoyer le client de l'utilisateur connecté
+        client = client_de(user)
+        if client is None:
+            raise NotFound("Aucun client associé à cet utilisateur.")
+        return client
 
     def get_queryset(self):
         if self.request.user.is_staff:
-            return Client.objects.all()
+            return Client.objects.select_related('user')
         else:
-            return Client.objects.filter(user=self.request.user)
+            return Client.objects.select_related('user').filter(user=self.request.user)
         
     def perform_update(self, serializer):
         client = serializer.instance
@@ -204,39 +204,14 @@ class ClientViewSet(viewsets.ModelViewSet):
             raise PermissionDenied("Vous n'avez pas la permission de supprimer ce client.")
         
 
-def get_coordinates(address):
-    """ Récupère les coordonnées géographiques d'une adresse en utilisant l'API adresse.data.gouv.fr """
-    url = 'https://api-adresse.data.gouv.fr/search'
-    params = {'q': address}
-    response = requests.get(url, params=params)
-    data = response.json()
-    if data['features']:
-        coordinates = data['features'][0]['geometry']['coordinates']
-        return coordinates[::-1]  # Inverser pour obtenir (latitude, longitude)
-    return None
-
-def calculate_estimated_arrival_time(lat1, lon1, lat2, lon2, speed_kmph=50):
-    """ Calcule l'heure d'arrivée estimée en fonction des coordonnées de départ et d'arrivée """
-    from math import radians, sin, cos, sqrt, atan2
-
-    # Rayon de la Terre
-    R = 6371.0
-
-    lat1, lon1, lat2, lon2 = map(radians, [lat1, lon1, lat2, lon2])
-    dlon = lon2 - lon1
-    dlat = lat2 - lat1
-
-    a = sin(dlat / 2)**2 + cos(lat1) * cos(lat2) * sin(dlon / 2)**2
-    c = 2 * atan2(sqrt(a), sqrt(1 - a))
-
-    distance = R * c
-    travel_time_hours = distance / speed_kmph
-    travel_time = timedelta(hours=travel_time_hours)
-
-    # Obtenir l'heure actuelle et ajouter le temps de trajet pour calculer l'heure d'arrivée
-    now = datetime.now()
-    estimated_arrival_time = now + travel_time
-    return estimated_arrival_time.strftime("%H:%M:%S")
+def commandes_detaillees():
+    """
+    Commandes avec tout ce que CommandeSerializer imbrique (client, livreur, utilisateurs, lignes et produits),
+    chargé en un nombre constant de requêtes.
+    """
+    return (Commande.objects
+            .select_related('client__user', 'livreur__user')
+            .prefetch_related(Prefetch('commandeproduit_set', queryset=CommandeProduit.objects.select_related('produit'))))
 
 class CommandeViewSet(viewsets.ModelViewSet):
     queryset = Commande.objects.all()
@@ -248,7 +223,7 @@ class CommandeViewSet(viewsets.ModelViewSet):
         pk = self.kwargs.get('pk')
 
         try:
-            commande = Commande.objects.get(pk=pk)
+            commande = commandes_detaillees().get(pk=pk)
             # Assurez-vous que les objets client et livreur ne sont pas nuls
             if not commande.client or not commande.livreur:
                 raise Http404("La commande est incomplète et ne peut être traitée.")
@@ -264,13 +239,11 @@ class CommandeViewSet(viewsets.ModelViewSet):
         user = self.request.user
         if user.is_staff:
             # Si l'utilisateur est un administrateur, retourner toutes les commandes
-            return Commande.objects.all()
+            return commandes_detaillees()
         else:
             # Sinon, retourner les commandes où l'utilisateur est soit le client soit le livreur
-            commandes_as_client = Commande.objects.filter(client__user=user)
-            commandes_as_livreur = Commande.objects.filter(livreur__user=user)
-            # Utiliser 'union' pour combiner les deux QuerySets sans doublons
-            return commandes_as_client.union(commandes_as_livreur)
+            # (un filtre OR plutôt qu'une union, qui empêcherait le prefetch)
+            return commandes_detaillees().filter(Q(client__user=user) | Q(livreur__user=user))
 
 
     def perform_update(self, serializer):
@@ -288,11 +261,13 @@ class CommandeViewSet(viewsets.ModelViewSet):
 
         if new_statut == 'en_cours_de_livraison' and commande.statut != 'en_cours_de_livraison':
             if commande.livreur and commande.client.adresse:
-                # Supposons que get_coordinates et calculate_estimated_arrival_time sont des fonctions définies pour interagir avec une API ou calculer les coordonnées/temps
-                origin_coords = get_coordinates("14 Avenue de l'Europe 77144 Montévrain")
-                destination_coords = get_coordinates(commande.client.adresse)
-                if origin_coords and destination_coords:
-                    arrival_time = calculate_estimated_arrival_time(*origin_coords, *destination_coords)
+                # Les coordonnées sont enregistrées à la validation de l'adresse : aucun appel à l'API ici
+                client = commande.client
+                if client.latitude is not None and client.longitude is not None:
+                    arrival_time = moteur_eta().heure_arrivee(
+                        settings.RESTAURANT_LATITUDE, settings.RESTAURANT_LONGITUDE,
+                        client.latitude, client.longitude,
+                    )
                     serializer.validated_data['temps_estime_livraison'] = arrival_time
                 else:
                     raise ValidationError("Impossible de récupérer les coordonnées pour le calcul de l'heure d'arrivée.")
@@ -302,9 +277,22 @@ class CommandeViewSet(viewsets.ModelViewSet):
         else:
             raise PermissionDenied("Vous n'avez pas la permission de modifier cette commande.")
 
+    @action(detail=False, methods=['get'], permission_classes=[IsAdminUser], url_path='dispatch')
+    def dispatch_commandes(self, request):
+        """
+        Tableau de bord du dispatch : pour chaque commande active, le temps d'arrivée estimé avec son livreur
+        et avec le meilleur livreur disponible. Les durées de tous les couples livreur × commande sont
+        calculées en une seule opération matricielle.
+        """
+        return Response(tableau_dispatch())
+
     def perform_destroy(self, instance):
         user = self.request.user
         if user.is_staff or instance.client.user == user:
+            # Libérer le livreur réservé pour cette commande
+            if instance.livreur and instance.livreur.statut == 'reserve':
+                instance.livreur.statut = 'disponible'
+                instance.livreur.save()
             instance.delete()
         else:
             raise PermissionDenied("Vous n'avez pas la permission de supprimer cette commande.")
@@ -315,10 +303,11 @@ class CommandeProduitViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
+        commande_produits = CommandeProduit.objects.select_related('produit', 'commande__client__user')
         if self.request.user.is_staff:
-            return CommandeProduit.objects.all()
+            return commande_produits
         else:
-            return CommandeProduit.objects.filter(commande__client__user=self.request.user)
+            return commande_produits.filter(commande__client__user=self.request.user)
         
     def perform_create(self, serializer):
         # Ici, vous pouvez ajouter une logique pour vérifier si l'utilisateur a le droit de créer une entrée
@@ -328,6 +317,17 @@ class CommandeProduitViewSet(viewsets.ModelViewSet):
         else:
             raise PermissionDenied("Vous n'avez pas la permission de créer cette entrée.")
 
+    @action(detail=False, methods=['post'], url_path='lot')
+    def creer_lot(self, request):
+        """Ajoute plusieurs produits (produit, quantite) à une même commande en une seule requête."""
+        serializer = CommandeProduitLotSerializer(data=request.data, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        commande = serializer.validated_data['commande']
+        if not (request.user == commande.client.user or request.user.is_staff):
+            raise PermissionDenied("Vous n'avez pas la permission de créer cette entrée.")
+        serializer.save()
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
     def perform_update(self, serializer):
         commande = serializer.instance.commande
         if self.request.user == commande.client.user or self.request.user.is_staff:
@@ -352,6 +352,13 @@ class ProduitViewSet(mixins.RetrieveModelMixin,
     serializer_class = ProduitSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
 
+    # Le catalogue change rarement : les réponses sont servies depuis le cache, avec un ETag
+    def list(self, request, *args, **kwargs):
+        return reponse_catalogue(request, lambda: super(ProduitViewSet, self).list(request, *args, **kwargs).data, Response)
+
+    def retrieve(self, request, *args, **kwargs):
+        return reponse_catalogue(request, lambda: super(ProduitViewSet, self).retrieve(request, *args, **kwargs).data, Response)
+
 class LivreurViewSet(mixins.RetrieveModelMixin,  # Permet la récupération d'un livreur spécifique par son ID
                      mixins.ListModelMixin,      # Permet de lister tous les livreurs
                      mixins.UpdateModelMixin,
@@ -366,9 +373,9 @@ class LivreurViewSet(mixins.RetrieveModelMixin,  # Permet la récupération d'un
     def get_queryset(self):
         # Permet aux administrateurs de voir tous les livreurs, mais les livreurs peuvent seulement se voir eux-mêmes
         if self.request.user.is_staff:
-            return Livreur.objects.all()
+            return Livreur.objects.select_related('user')
         else:
-            return Livreur.objects.filter(user=self.request.user)
+            return Livreur.objects.select_related('user').filter(user=self.request.user)
         
     def get_object(self):
         """
@@ -379,14 +386,7 @@ class LivreurViewSet(mixins.RetrieveModelMixin,  # Permet la récupération d'un
         user = self.request.user
         pk = self.kwargs.get('pk')
 
-        if pk == 'livreur':
-            # Cas où 'pk' est explicitement 'livreur', renvoyer le livreur de l'utilisateur connecté
-            try:
-                return Livreur.objects.get(user=user)
-            except Livreur.DoesNotExist:
-                raise NotFound("Aucun livreur associé à cet utilisateur.")
-
-        if pk:
+        if pk and pk != 'livreur':
             if user.is_staff:
                 # L'administrateur peut accéder à n'importe quel livreur
                 return super().get_object()
@@ -394,44 +394,29 @@ class LivreurViewSet(mixins.RetrieveModelMixin,  # Permet la récupération d'un
                 # L'utilisateur essaie d'accéder à un livreur par ID, vérifier si c'est son ID
                 try:
                     pk = int(pk)  # S'assurer que pk est un entier
-                    livreur = Livreur.objects.get(pk=pk, user=user)
-                    return livreur
-                except Livreur.DoesNotExist:
-                    raise PermissionDenied("Vous n'avez pas la permission de voir cet utilisateur.")
                 except ValueError:
                     raise ValidationError("L'identifiant doit être un nombre.")
-        else:
-            # Aucun ID fourni, retourner le livreur de l'utilisateur connecté
-            try:
-                return Livreur.objects.get(user=user)
-            except Livreur.DoesNotExist:
-                raise NotFound("Aucun livreur associé à cet utilisateur.")
+                livreur = livreur_de(user)
+                if livreur is None or livreur.pk != pk:
+                    raise PermissionDenied("Vous n'avez pas la permission de voir cet utilisateur.")
+                return livreur
+
+        # 'pk' vaut 'livreur' ou est absent : renvoyer le livreur de l'utilisateur connecté
+        livreur = livreur_de(user)
+        if livreur is None:
+            raise NotFound("Aucun livreur associé à cet utilisateur.")
+        return livreur
         
     def perform_update(self, serializer):
         user = self.request.user
-        pk = self.kwargs.get('pk')
-        
-        # Récupération du livreur, soit par l'utilisateur connecté soit par pk
-        if pk == 'livreur':
-            try:
-                livreur = Livreur.objects.get(user=user)
-            except Livreur.DoesNotExist:
-                raise NotFound("Aucun livreur associé à cet utilisateur.")
-        else:
-            if pk and user.is_staff:
-                livreur = super().get_object()
-            elif pk:
-                try:
-                    pk = int(pk)  # S'assurer que pk est un entier
-                    livreur = Livreur.objects.get(pk=pk, user=user)
-                except ValueError:
-                    raise ValidationError("L'identifiant doit être un nombre.")
-                except Livreur.DoesNotExist:
-                    raise PermissionDenied("Vous n'avez pas la permission de voir ce livreur.")
+        # Le livreur a déjà été récupéré (et les droits vérifiés) par get_object
+        livreur = serializer.instance
 
         # Vérification du statut actuel du livreur avant autorisation de mise à jour
         if livreur.statut == 'en_cours_de_livraison':
             raise ValidationError("Le livreur est en cours de livraison et ne peut pas modifier son statut.")
+        if livreur.statut == 'reserve':
+            raise ValidationError("Le livreur est réservé pour une commande et ne peut pas modifier son statut.")
 
         # Vérifie si l'utilisateur est l'administrateur ou le livreur associé
         if user != livreur.user and not user.is_staff:
@@ -453,10 +438,12 @@ class PaiementViewSet(mixins.RetrieveModelMixin,  # Permet la récupération d'u
 
     def get_queryset(self):
         # Permet aux administrateurs de voir tous les paiements, mais les utilisateurs réguliers ne voient que leurs paiements
+        paiements = Paiement.objects.select_related('commande__client__user', 'commande__livreur__user').prefetch_related(
+            Prefetch('commande__commandeproduit_set', queryset=CommandeProduit.objects.select_related('produit')))
         if self.request.user.is_staff:
-            return Paiement.objects.all()
+            return paiements
         else:
-            return Paiement.objects.filter(commande__client__user=self.request.user)
+            return paiements.filter(commande__client__user=self.request.user)
         
         
 class CommandePaiementViewSet(CommandeViewSet, viewsets.ModelViewSet):
@@ -495,11 +482,12 @@ class CommandePaiementViewSet(CommandeViewSet, viewsets.ModelViewSet):
             amount = int((commande.montant_total + commande.frais_livraison) * 100)
 
             # Création d'un PaymentIntent
-            intent = stripe.PaymentIntent.create(
-                amount=amount,
-                currency='eur',
-                metadata={'commande_id': commande.id}
-            )
+            with mesurer('externe'):
+                intent = stripe.PaymentIntent.create(
+                    amount=amount,
+                    currency='eur',
+                    metadata={'commande_id': commande.id}
+                )
 
             # Mise à jour ou création du paiement
             paiement.payment_token = intent.id
@@ -523,13 +511,23 @@ class CommandePaiementViewSet(CommandeViewSet, viewsets.ModelViewSet):
             paiement = Paiement.objects.get(commande=commande)
 
             if paiement.statut_paiement == 'payee':
+                if settings.STRIPE_WEBHOOK_SECRET:
+                    # Paiement confirmé par le webhook Stripe
+                    return Response({'status': 'success', 'message': 'Paiement vérifié et commande mise à jour.'})
                 return Response({'error': 'Paiement déjà vérifié.'}, status=status.HTTP_400_BAD_REQUEST)
 
             if not paiement.payment_token:
                 return Response({'error': 'Aucun token de paiement associé à cette commande.'}, status=status.HTTP_404_NOT_FOUND)
 
+            if settings.STRIPE_WEBHOOK_SECRET and not evenements_en_retard().exists():
+                # Le statut est mis à jour par le webhook : pas d'appel à Stripe ici
+                if paiement.statut_paiement == 'annule':
+                    return Response({'status': 'failed', 'message': 'Paiement non réussi.'})
+                return Response({'status': 'pending', 'message': 'Paiement en attente de confirmation.'})
+
             # Utilisez Stripe pour vérifier le statut du PaymentIntent
-            intent = stripe.PaymentIntent.retrieve(paiement.payment_token)
+            with mesurer('externe'):
+                intent = stripe.PaymentIntent.retrieve(paiement.payment_token)
 
             # Mise à jour du statut de paiement selon le statut Stripe
             if intent.status == 'succeeded':
@@ -537,6 +535,7 @@ class CommandePaiementViewSet(CommandeViewSet, viewsets.ModelViewSet):
                 commande.statut = 'prise_en_charge'
                 paiement.save()
                 commande.save()
+                publier_commande(commande)
                 return Response({'status': 'success', 'message': 'Paiement vérifié et commande mise à jour.'})
             else:
                 return Response({'status': 'failed', 'message': 'Paiement non réussi.'})
@@ -552,11 +551,12 @@ def create_payment_intent(request):
     try:
         data = request.data
         amount = int(data['amount'] * 100)  # Convertir en centimes
-        intent = stripe.PaymentIntent.create(
-            amount=amount,
-            currency='eur',
-            metadata={'integration_check': 'accept_a_payment'}
-        )
+        with mesurer('externe'):
+            intent = stripe.PaymentIntent.create(
+                amount=amount,
+                currency='eur',
+                metadata={'integration_check': 'accept_a_payment'}
+            )
         return JsonResponse({'client_secret': intent['client_secret']})
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=400)
@@ -565,7 +565,8 @@ def create_payment_intent(request):
 def verify_payment(request):
     try:
         payment_intent_id = request.data.get('paymentIntentId')
-        payment_intent = stripe.PaymentIntent.retrieve(payment_intent_id)
+        with mesurer('externe'):
+            payment_intent = stripe.PaymentIntent.retrieve(payment_intent_id)
 
         if payment_intent.status == 'succeeded':
             # Logique pour traiter la commande comme payée
@@ -574,4 +575,16 @@ def verify_payment(request):
             return JsonResponse({'status': 'failed', 'message': 'Paiement non réussi'})
 
     except Exception as e:
-        return JsonResponse({'error': str(e)}, status=400)
\ No newline at end of file
+        return JsonResponse({'error': str(e)}, status=400)
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def rapport_performances(request):
+    """Centiles de latence, requêtes SQL et temps par catégorie pour chaque route, mesurés par ce processus."""
+    return Response(statistiques.rapport())
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def etat_api_adresse(request):
+    """Latence des appels à l'API adresse, état du disjoncteur et compteurs d'échecs, pour ce processus."""
+    return Response(client_api_adresse().etat())
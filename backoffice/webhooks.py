@@ -0,0 +1,84 @@
+from datetime import timedelta
+
+import stripe
+from django.conf import settings
+from django.db import transaction
+from django.http import HttpResponse, JsonResponse
+from django.utils.timezone import now
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from .evenements import publier_commandes
+from .models import Commande, EvenementStripe, Paiement, Tache
+from .taches import enfiler, tache
+
+EVENEMENTS_TRAITES = ('payment_intent.succeeded', 'payment_intent.payment_failed')
+
+
+@tache('stripe.evenements', file='stripe', groupable=True)
+@transaction.atomic
+def appliquer_evenements(evenements):
+    """
+    Applique une liste d'événements Stripe aux paiements et commandes, en quelques requêtes groupées.
+    Les événements déjà reçus sont ignorés ; les mises à jour elles-mêmes sont idempotentes.
+    Renvoie le nombre d'événements nouvellement traités.
+    """
+    evenements = {evenement['id']: evenement for evenement in evenements if evenement['type'] in EVENEMENTS_TRAITES}
+    deja_recus = set(EvenementStripe.objects.filter(identifiant__in=evenements).values_list('identifiant', flat=True))
+    nouveaux = [evenement for identifiant, evenement in evenements.items() if identifiant not in deja_recus]
+    if not nouveaux:
+        return 0
+    EvenementStripe.objects.bulk_create(
+        [EvenementStripe(identifiant=evenement['id'], type=evenement['type']) for evenement in nouveaux],
+        ignore_conflicts=True,
+    )
+
+    reussis = [e['data']['object']['id'] for e in nouveaux if e['type'] == 'payment_intent.succeeded']
+    echoues = [e['data']['object']['id'] for e in nouveaux if e['type'] == 'payment_intent.payment_failed']
+
+    if reussis:
+        Paiement.objects.filter(payment_token__in=reussis).exclude(statut_paiement='payee').update(
+            statut_paiement='payee', date_paiement=now())
+        commandes = list(Commande.objects.filter(paiement__payment_token__in=reussis, statut='en_cours')
+                         .values_list('id', flat=True))
+        if commandes:
+            Commande.objects.filter(pk__in=commandes, statut='en_cours').update(statut='prise_en_charge')
+            publier_commandes(commandes)
+    if echoues:
+        # Un paiement déjà confirmé ne repasse jamais à 'annule'
+        Paiement.objects.filter(payment_token__in=echoues, statut_paiement='en_attente').update(statut_paiement='annule')
+    return len(nouveaux)
+
+
+def evenements_en_retard():
+    """
+    Événements Stripe reçus mais toujours en attente après STRIPE_WEBHOOK_DELAI_TRAVAILLEUR secondes :
+    aucun travailleur (travailleur_taches) ne traite la file 'stripe', les paiements doivent être vérifiés
+    directement auprès de Stripe.
+    """
+    limite = now() - timedelta(seconds=getattr(settings, 'STRIPE_WEBHOOK_DELAI_TRAVAILLEUR', 120))
+    return Tache.objects.filter(nom=appliquer_evenements.nom_tache, statut='en_attente', executer_apres__lt=limite)
+
+
+@csrf_exempt
+@require_POST
+def stripe_webhook(request):
+    """Reçoit les événements signés envoyés par Stripe (payment_intent.succeeded / payment_failed)."""
+    if not settings.STRIPE_WEBHOOK_SECRET:
+        return JsonResponse({'error': 'Webhook Stripe non configuré.'}, status=503)
+    try:
+        evenement = stripe.Webhook.construct_event(
+            request.body, request.headers.get('Stripe-Signature', ''), settings.STRIPE_WEBHOOK_SECRET)
+    except ValueError:
+        return JsonResponse({'error': 'Contenu invalide.'}, status=400)
+    except stripe.SignatureVerificationError:
+        return JsonResponse({'error': 'Signature invalide.'}, status=400)
+
+    if evenement['type'] in EVENEMENTS_TRAITES:
+        # Réponse immédiate à Stripe ; la mise à jour des paiements et commandes est faite par un travailleur,
+        # qui applique en un seul appel les événements réservés ensemble (une tâche par événement pour la clé
+        # d'idempotence)
+        resume = {'id': evenement['id'], 'type': evenement['type'],
+                  'data': {'object': {'id': evenement['data']['object']['id']}}}
+        enfiler(appliquer_evenements, [resume], cle_idempotence=f"stripe:{evenement['id']}")
+    return HttpResponse(status=200)